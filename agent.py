@@ -2,121 +2,308 @@ import numpy as np
 
 #=======================================================================
 
-class Driver:
-	def __init__(self, od_pair, actions, initial_costs=None, extrapolate_costs=True, navigation_app=None, time_flexibility=0.5, flow=1.0): 
+# represents a whole population of drivers, whose attributes are stored 
+# as arrays (one entry per driver or one row per driver and one column 
+# per action), so that all drivers choose their actions and update their 
+# strategies at once (the random numbers of all drivers are also drawn at 
+# once, see choose_actions), where
+# * od_pairs is the list of OD pairs of the problem (in order),
+# * actions is the number of actions (routes) of each OD pair,
+# * drivers_od is the (order of the) OD pair of each driver,
+# * initial_costs is the list of initial costs of each OD pair, 
+# * time_flexibility and flow are the values of each driver (a single value
+#   or one per driver; see below),
+# * random_state is the random generator (numpy.random.RandomState) of the
+#   drivers (if None, numpy's global generator is used), and
+# * counts, if set, is the number of drivers represented by each entry; in 
+#   this case, each entry is a group of identical drivers (same OD pair, 
+#   time flexibility, flow and history), which is split whenever its drivers 
+#   choose different actions (see choose_actions); the results are then 
+#   statistically (but not exactly) the same as with one entry per driver
+class DriverPopulation:
+	def __init__(self, od_pairs, actions, drivers_od, initial_costs=None, extrapolate_costs=True, navigation_app=None, time_flexibility=0.5, flow=1.0, random_state=None, counts=None):
 		
-		#self.__name = 'Driver_%i' % identifier
-		self.__OD_pair = od_pair
+		self.__OD_pairs = od_pairs
+		self.__drivers_od = np.array(drivers_od, dtype=int)
+		
+		self.__n_drivers = len(self.__drivers_od)
+		self.__drivers = np.arange(self.__n_drivers)
+		
+		# the number of drivers of each entry (a single one, unless the 
+		# drivers are aggregated into groups)
+		self.__aggregated = counts is not None
+		if self.__aggregated:
+			self.__counts = np.array(counts, dtype=int)
+		else:
+			self.__counts = np.ones(self.__n_drivers, dtype=int)
+		
+		# the number of actions of each driver; since the drivers of 
+		# different OD pairs may have a different number of actions, 
+		# the arrays have as many columns as the largest set of actions,
+		# and the remaining columns (invalid actions) are never used
+		self.__n_actions = np.array(actions, dtype=int)[self.__drivers_od]
+		max_actions = max(actions) if len(actions) else 0
+		self.__valid_actions = np.arange(max_actions) < self.__n_actions[:, np.newaxis]
 		
 		# whether the average cost estimations should extrapolate 
 		# the experimented costs
 		self.__extrapolate_costs = extrapolate_costs
 		
-		# the navigation app of the driver
+		# the navigation app of the drivers
 		self.__navigation_app = navigation_app
 		
+		# the random generator
+		self.__random = random_state if random_state is not None else np.random
+		
 		# strategy (policy)
-		self.__strategy = { a: 0.0 for a in actions }#initialising with initial_costs[a] produces almost the same results, but is more difficult to explain...
+		self.__strategy = np.zeros((self.__n_drivers, max_actions))
 		
 		# sum of the experimented costs (used to obtain the average cost)
-		self.__sum_cost = 0.0
+		self.__sum_cost = np.zeros(self.__n_drivers)
 		
-		self.__last_action = None
+		self.__last_action = np.zeros(self.__n_drivers, dtype=int)
 		
-		# iteration counter
+		# iteration counter (all drivers act on every iteration)
 		self.__iteration = 0
-
-		# the time-money trade-off (the higher time_flexibility is, the more the agent prefers 
-		# saving money or, alternatively, the less it cares about travelling fast)
-		self.__time_flexibility = time_flexibility
-
-		# the flow controlled by the agent; it is within the interval ]0,d], 
-		# where d is the total flow of the current agent's OD pair; the general setting is flow=1.0
-		self.__flow = flow
-
-		# for each action, store an [sum, samples, extrapolated_sum, avg, last, last_time] array, where:
+		
+		# the time-money trade-off (the higher time_flexibility is, the more the 
+		# driver prefers saving money or, alternatively, the less it cares about 
+		# travelling fast) and the flow controlled by each driver (within the 
+		# interval ]0,d], where d is the total flow of the driver's OD pair; the 
+		# general setting is flow=1.0)
+		self.__time_flexibility = np.zeros(self.__n_drivers) + time_flexibility
+		self.__flow = np.zeros(self.__n_drivers) + flow
+		
+		# the history of costs of each action, split into one array for each field:
 		# * sum is the sum of costs experimented for this action (considering only those times when it is, in fact, chosen), 
 		# * samples is the number of samples composing the sum (the number of times the action was chosen), 
 		# * extrapolated_sum is an extrapolation of the sum of costs (when the action is not the chosen one, then the sum is incremented with the last value, given in the next field) and 
-		# * avg is the average cost, which may be defined (using parameter self.__extrapolate_costs) considering the sum or the extrapolated_sum 
+		# * avg is the average cost, which may be defined (using parameter extrapolate_costs) considering the sum or the extrapolated_sum 
 		# * last is the most updated cost of this action
 		# * last_time is the most updated travel time of this action (useful for computing deltatolling)
-		self.__history_actions_costs = { a: [0.0, 0.0, 0.0, 0.0, 0.0 if not initial_costs else initial_costs[a], 0.0 ] for a in actions } #although the last item is initialised with initial_costs, tests have shown that it makes no difference (as for the strategy initialisation)
+		self.__history_sum = np.zeros((self.__n_drivers, max_actions))
+		self.__history_samples = np.zeros((self.__n_drivers, max_actions))
+		self.__history_extrapolated_sum = np.zeros((self.__n_drivers, max_actions))
+		self.__history_avg = np.zeros((self.__n_drivers, max_actions))
+		self.__history_last = np.zeros((self.__n_drivers, max_actions))
+		self.__history_last_time = np.zeros((self.__n_drivers, max_actions))
+		if initial_costs:
+			od_initial_costs = np.zeros((len(od_pairs), max_actions))
+			for i_od in xrange(len(od_pairs)):
+				od_initial_costs[i_od, :len(initial_costs[i_od])] = initial_costs[i_od]
+			self.__history_last[:] = od_initial_costs[self.__drivers_od]
 		
 		# estimated regret
-		self.__estimated_regret = None
-		self.__estimated_action_regret = { a: 0.0 for a in actions }
-
+		self.__estimated_regret = np.zeros(self.__n_drivers)
+		self.__estimated_action_regret = np.zeros((self.__n_drivers, max_actions))
+		
 		# real regret
-		self.__real_regret = 0.0
-
-		# minimum average cost (stored here to enhance performance)
-		self.__min_avg_cost = 0.0
-
-	def get_strategy(self):
+		self.__real_regret = np.zeros(self.__n_drivers)
+		
+		# minimum average cost
+		self.__min_avg_cost = np.zeros(self.__n_drivers)
+		
+		self.__toll_dues = np.zeros(self.__n_drivers)
+	
+	def __len__(self):
+		return self.__n_drivers
+	
+	def get_OD_pairs(self):
+		return self.__OD_pairs
+	
+	# the number of drivers of each entry
+	def get_counts(self):
+		return self.__counts
+	
+	# the (order of the) OD pair of each driver
+	def get_drivers_OD(self):
+		return self.__drivers_od
+	
+	def get_strategies(self):
 		return self.__strategy
 	
-	def get_last_action(self):
+	def get_last_actions(self):
 		return self.__last_action
 	
-	def get_OD_pair(self):
-		return self.__OD_pair
-
-	def get_flow(self):
+	def get_flows(self):
 		return self.__flow
 	
-	# calculate the driver's estimated regret
+	def get_time_flexibilities(self):
+		return self.__time_flexibility
+	
+	# the state of the population (e.g., to checkpoint a simulation), as a 
+	# dictionary of arrays; the random generator is not included
+	def get_state(self):
+		return {
+			'drivers_od': self.__drivers_od,
+			'counts': self.__counts,
+			'n_actions': self.__n_actions,
+			'strategy': self.__strategy,
+			'sum_cost': self.__sum_cost,
+			'last_action': self.__last_action,
+			'iteration': np.array(self.__iteration),
+			'time_flexibility': self.__time_flexibility,
+			'flow': self.__flow,
+			'history_sum': self.__history_sum,
+			'history_samples': self.__history_samples,
+			'history_extrapolated_sum': self.__history_extrapolated_sum,
+			'history_avg': self.__history_avg,
+			'history_last': self.__history_last,
+			'history_last_time': self.__history_last_time,
+			'estimated_regret': self.__estimated_regret,
+			'estimated_action_regret': self.__estimated_action_regret,
+			'real_regret': self.__real_regret,
+			'min_avg_cost': self.__min_avg_cost,
+			'toll_dues': self.__toll_dues
+		}
+	
+	# restore a state obtained with get_state (the number of entries may 
+	# differ from the current one if the drivers are aggregated)
+	def set_state(self, state):
+		
+		self.__drivers_od = state['drivers_od']
+		self.__n_drivers = len(self.__drivers_od)
+		self.__drivers = np.arange(self.__n_drivers)
+		self.__counts = state['counts']
+		self.__n_actions = state['n_actions']
+		self.__valid_actions = np.arange(state['strategy'].shape[1]) < self.__n_actions[:, np.newaxis]
+		
+		self.__strategy = state['strategy']
+		self.__sum_cost = state['sum_cost']
+		self.__last_action = state['last_action']
+		self.__iteration = int(state['iteration'])
+		self.__time_flexibility = state['time_flexibility']
+		self.__flow = state['flow']
+		
+		self.__history_sum = state['history_sum']
+		self.__history_samples = state['history_samples']
+		self.__history_extrapolated_sum = state['history_extrapolated_sum']
+		self.__history_avg = state['history_avg']
+		self.__history_last = state['history_last']
+		self.__history_last_time = state['history_last_time']
+		
+		self.__estimated_regret = state['estimated_regret']
+		self.__estimated_action_regret = state['estimated_action_regret']
+		self.__real_regret = state['real_regret']
+		self.__min_avg_cost = state['min_avg_cost']
+		self.__toll_dues = state['toll_dues']
+	
+	# calculate the drivers' estimated regret
 	def __estimate_regret(self):
 		
 		self.__estimated_regret = (self.__sum_cost / self.__iteration) - self.__min_avg_cost
 		
 		# estimated regret per action
-		for a in self.__history_actions_costs:
-			if not self.__extrapolate_costs and self.__history_actions_costs[a][1] == 0: #just to handle initial cases
-				self.__estimated_action_regret[a] = 0.0
-			else:
-				self.__estimated_action_regret[a] = self.__history_actions_costs[a][3] - self.__min_avg_cost
+		self.__estimated_action_regret = self.__history_avg - self.__min_avg_cost[:, np.newaxis]
+		if not self.__extrapolate_costs: #just to handle initial cases
+			self.__estimated_action_regret[self.__history_samples == 0] = 0.0
 	
-	# calculate the real regret given the real minimum average cost
+	# calculate the real regret given the real minimum average cost (of each driver)
 	def update_real_regret(self, real_min_avg):
-		self.__real_regret = self.get_average_cost() - real_min_avg
+		self.__real_regret = self.get_average_costs() - real_min_avg
 	
-	def get_real_regret(self):
+	def get_real_regrets(self):
 		return self.__real_regret
-
-	def get_estimated_regret(self, action=None):
-		if action == None:
-			return self.__estimated_regret
-		else:
-			return self.__estimated_action_regret[action]
 	
-	def get_last_cost(self):
-		return self.__history_actions_costs[self.__last_action][4]
+	def get_estimated_regrets(self):
+		return self.__estimated_regret
+	
+	def get_last_costs(self):
+		return self.__history_last[self.__drivers, self.__last_action]
 	
-	def get_average_cost(self):
+	def get_average_costs(self):
 		return self.__sum_cost / self.__iteration
-
-	def get_time_flexibility(self):
-		return self.__time_flexibility
 	
 	#-------------------------------------------------------------------
-	# choose action
+	# choose actions
 	
-	def choose_action(self, epsilon=None):
+	def choose_actions(self, epsilon=None):
 		
 		# increment the iteration counter
 		self.__iteration += 1
 		
-		# epsilon-greedy: choose the action with highest probability with probability 1-epsilon
-		# otherwise, choose any action uniformly at random
-		if np.random.random() < epsilon:
-			self.__last_action = int(np.random.random() * len(self.__strategy)) #slightly slower than random.random, but it is less biased
-		else:
-			self.__last_action = max(self.__strategy, key=self.__strategy.get)
-
-		# choose the action
+		if self.__aggregated:
+			return self.__choose_actions_aggregated(epsilon)
+		
+		# epsilon-greedy: each driver chooses the action with highest probability with 
+		# probability 1-epsilon, otherwise it chooses any action uniformly at random;
+		# the random numbers of all drivers are drawn at once, as one vector to
+		# decide which drivers explore and another one to choose their actions
+		explorers = self.__random.random_sample(self.__n_drivers) < epsilon
+		draws = self.__random.random_sample(self.__n_drivers)
+		
+		self.__last_action = np.where(self.__valid_actions, self.__strategy, float('-inf')).argmax(axis=1)
+		self.__last_action[explorers] = (draws[explorers] * self.__n_actions[explorers]).astype(int)
+		
+		# return the chosen actions
 		return self.__last_action
-
+	
+	# choose the actions of groups of drivers (see choose_actions): the 
+	# number of drivers of each group taking each action is drawn from a
+	# multinomial distribution (the epsilon-greedy probabilities), and the
+	# group is then split into one group per action taken
+	def __choose_actions_aggregated(self, epsilon):
+		
+		greedy = np.where(self.__valid_actions, self.__strategy, float('-inf')).argmax(axis=1)
+		
+		# the probability of each action
+		probabilities = np.where(self.__valid_actions, epsilon / self.__n_actions[:, np.newaxis], 0.0)
+		probabilities[self.__drivers, greedy] += 1.0 - epsilon
+		
+		# sample the multinomial distributions of all groups at once, as a 
+		# sequence of binomial distributions (one per action, conditioned
+		# on the drivers not assigned to the previous actions), where the 
+		# remaining drivers are all assigned to the last valid action
+		actions_counts = np.zeros(probabilities.shape, dtype=int)
+		remaining_counts = self.__counts.copy()
+		remaining_probabilities = np.ones(self.__n_drivers)
+		for a in xrange(probabilities.shape[1]):
+			p = np.zeros(self.__n_drivers)
+			np.divide(probabilities[:, a], remaining_probabilities, out=p, where=remaining_probabilities > 0.0)
+			p = np.where(a == self.__n_actions - 1, 1.0, np.clip(p, 0.0, 1.0))
+			actions_counts[:, a] = self.__random.binomial(remaining_counts, p)
+			remaining_counts -= actions_counts[:, a]
+			remaining_probabilities -= probabilities[:, a]
+		
+		# split the groups (the new groups of each group are kept together, 
+		# in the order of the actions)
+		groups, actions = np.nonzero(actions_counts)
+		if len(groups) > self.__n_drivers:
+			self.__split(groups)
+		self.__counts = actions_counts[groups, actions]
+		self.__last_action = actions
+		
+		# return the chosen actions
+		return self.__last_action
+	
+	# replace the groups of drivers by the given ones (each one copying 
+	# the attributes of the corresponding group)
+	def __split(self, groups):
+		
+		self.__drivers_od = self.__drivers_od[groups]
+		self.__n_drivers = len(groups)
+		self.__drivers = np.arange(self.__n_drivers)
+		self.__n_actions = self.__n_actions[groups]
+		self.__valid_actions = self.__valid_actions[groups]
+		
+		self.__strategy = self.__strategy[groups]
+		self.__sum_cost = self.__sum_cost[groups]
+		self.__time_flexibility = self.__time_flexibility[groups]
+		self.__flow = self.__flow[groups]
+		
+		self.__history_sum = self.__history_sum[groups]
+		self.__history_samples = self.__history_samples[groups]
+		self.__history_extrapolated_sum = self.__history_extrapolated_sum[groups]
+		self.__history_avg = self.__history_avg[groups]
+		self.__history_last = self.__history_last[groups]
+		self.__history_last_time = self.__history_last_time[groups]
+		
+		self.__estimated_regret = self.__estimated_regret[groups]
+		self.__estimated_action_regret = self.__estimated_action_regret[groups]
+		self.__real_regret = self.__real_regret[groups]
+		self.__min_avg_cost = self.__min_avg_cost[groups]
+		self.__toll_dues = self.__toll_dues[groups]
+	
 	#-------------------------------------------------------------------
 	
 	# compute the toll values
@@ -127,122 +314,117 @@ class Driver:
 			# define a toll that makes agents indifferent with respect to time and money (i.e., it overrides their preferences)
 			toll_mct = (cost - additional_cost) # original MCT (the marginal cost itself)
 			self.__toll_dues = (toll_mct + cost * self.__time_flexibility) / self.__time_flexibility #the indifferent MCT
-
+		
 		elif weighted_MCT:
 			# weighted MCT
 			# define a toll proportional to the weighted marginal cost of agents (i.e., considering their preferences)
 			# Note: this is NOT equivalent to the original MCT
 			self.__toll_dues = additional_cost / self.__time_flexibility # additional_cost is the weighted marginal cost
-
+		
 		elif delta_tolling:
-			prev_cost = self.__history_actions_costs[self.__last_action][5]
+			prev_cost = self.__history_last_time[self.__drivers, self.__last_action]
 			self.__toll_dues = prev_cost - additional_cost
-
+		
 		elif thesis_delta_tolling: # old implementation used on my thesis (not incorrect, but less effective)
-			prev_cost = self.__history_actions_costs[self.__last_action][4]
+			prev_cost = self.__history_last[self.__drivers, self.__last_action]
 			self.__toll_dues = prev_cost - additional_cost
-
+		
 		else:
 			# MCT with preferences
-			# Note 1: this is equivalent to the original MCT if the preference parameter is 0.5 for all agents
-			# Note 2: the expression is multiplied by 2 to make it fully compatible with the original MCT formulation (and to make the code retro-compatible with previous algorithms and validations)
+			# Note: this is equivalent to the original MCT if the preference parameter is 0.5 for all agents (see compute_cost)
 			self.__toll_dues = cost - additional_cost # marginal cost
-
+		
 		return self.__toll_dues
-
+	
 	#-------------------------------------------------------------------
 	
 	# compute the total cost (considering travel time and tolls)
 	def compute_cost(self, cost, additional_cost, indifferent_MCT):
-
+		
 		new_cost = (1.0 - self.__time_flexibility) * cost + self.__time_flexibility * self.__toll_dues - additional_cost
-
+		
 		# except for the indifferent_MCT, the cost is multiplied by 2 to make the preference-based MCT formulation fully compatible with the original MCT formulation (and to make the code retro-compatible with previous algorithms and validations)
 		if not indifferent_MCT:
 			new_cost *= 2.0 
-
+		
 		return new_cost
-
+	
 	#-------------------------------------------------------------------
-
-	# update strategy
-	def update_strategy(self, cost, alpha=None, regret_as_cost=False, a_posteriori_MCT=False, indifferent_MCT=False, weighted_MCT=False, delta_tolling=False, thesis_delta_tolling=False, additional_cost=0.0): #, additional_cost2=0.0):
+	
+	# update strategies
+	def update_strategy(self, cost, alpha=None, regret_as_cost=False, a_posteriori_MCT=False, indifferent_MCT=False, weighted_MCT=False, delta_tolling=False, thesis_delta_tolling=False, additional_cost=0.0):
+		
+		drivers, last_action = self.__drivers, self.__last_action
 		
-		# store the dictionary locally to improve performance
-		self_hac = self.__history_actions_costs
-
 		# update most recent travel time of current taken action (useful for computing deltatolling)
-		self_hac[self.__last_action][5] = cost 
+		self.__history_last_time[drivers, last_action] = cost
 		
 		# if necessary, update the cost following the a posteriori MCT formulation 
 		if a_posteriori_MCT or delta_tolling:
 			cost = self.compute_cost(cost, additional_cost, indifferent_MCT)
-
+		
 		# update the sum of costs (used to compute the average cost)
 		self.__sum_cost += cost
 		
-		# receive the recommendation
+		# receive the recommendations
 		recommendation = None
 		if self.__navigation_app:
-			recommendation = self.__navigation_app.get_recommendation(self.get_OD_pair())
-
+			recommendation = np.zeros((len(self.__OD_pairs), self.__strategy.shape[1]))
+			for i_od, od in enumerate(self.__OD_pairs):
+				od_recommendation = self.__navigation_app.get_recommendation(od)
+				recommendation[i_od, :len(od_recommendation)] = od_recommendation
+			recommendation = recommendation[self.__drivers_od]
+		
 		# update the costs history
 		
 		# Pt1: for the current action
-		self_hac[self.__last_action][0] += cost #add current cost
-		self_hac[self.__last_action][1] += 1 #increment number of samples
-		self_hac[self.__last_action][4] = cost #update last cost
-		#NOTE: position 5 in the array is updated earlier to keep the travel time (instead of cost)
-
+		self.__history_sum[drivers, last_action] += cost #add current cost
+		self.__history_samples[drivers, last_action] += 1 #increment number of samples
+		self.__history_last[drivers, last_action] = cost #update last cost
+		
 		# Pt2: for all actions...
-		self.__min_avg_cost = float('inf')
-		for a in self_hac:
-			
-			# update the extrapolated sum
-			self_hac[a][2] += self_hac[a][4] #add last cost to extrapolate estimation
-		
-			# compute the average cost
-			if self.__extrapolate_costs:
-				avg_cost = self_hac[a][2] / self.__iteration
-			else:
-				try: #just to handle initial cases
-					avg_cost = self_hac[a][0] / self_hac[a][1]
-				except ZeroDivisionError:
-					avg_cost = 0
-			
-			self_hac[a][3] = avg_cost
-
-			# incorporate the recommendation into the avg_cost;
-			# observe that the recommendation is only used for
-			# computing the latter term of regret (or, in the case
-			# of maximising reward, the former term)  
-			if recommendation:
-				p=0.5
-				avg_cost = avg_cost*(1-p) + recommendation[a]*p
-			
-			if avg_cost < self.__min_avg_cost:
-				self.__min_avg_cost = avg_cost
-
+		
+		# update the extrapolated sum
+		self.__history_extrapolated_sum += self.__history_last #add last cost to extrapolate estimation
+		
+		# compute the average cost
+		if self.__extrapolate_costs:
+			self.__history_avg = self.__history_extrapolated_sum / self.__iteration
+		else:
+			self.__history_avg = np.zeros(self.__history_sum.shape)
+			np.divide(self.__history_sum, self.__history_samples, out=self.__history_avg, where=self.__history_samples != 0) #just to handle initial cases
+		avg_cost = self.__history_avg
+		
+		# incorporate the recommendation into the avg_cost;
+		# observe that the recommendation is only used for
+		# computing the latter term of regret (or, in the case
+		# of maximising reward, the former term)  
+		if recommendation is not None:
+			p=0.5
+			avg_cost = avg_cost*(1-p) + recommendation*p
+		
+		self.__min_avg_cost = np.where(self.__valid_actions, avg_cost, float('inf')).min(axis=1)
+		
 		# update the regret
 		self.__estimate_regret()
 		if regret_as_cost:
-			cost = self.get_estimated_regret(self.__last_action)
+			cost = self.__estimated_action_regret[drivers, last_action]
 		
 		# if necessary, update the cost following the a posteriori MCT formulation 
-		# NOTE: the cost is computed in the end of this procedure only for the deltatolling version used on my thesis (whose implementation is still correct, though less effective)
+		# NOTE: the cost is computed in the end of this procedure only for the deltatolling version used on my thesis
 		if thesis_delta_tolling:
 			cost = self.compute_cost(cost, additional_cost, indifferent_MCT)
-
+		
 		# update the strategy
 		self.__update_strategy_Q_learning(cost, alpha)
-		
+	
 	#-------------------------------------------------------------------
 	# Q-learning (stateless, so the gamma parameter is not required)
 	def __update_strategy_Q_learning(self, normalised_cost, alpha):
 		
 		normalised_utility = 1 - normalised_cost
 		
-		self.__strategy[self.__last_action] = (1 - alpha) * self.__strategy[self.__last_action] + alpha * normalised_utility
+		self.__strategy[self.__drivers, self.__last_action] = (1 - alpha) * self.__strategy[self.__drivers, self.__last_action] + alpha * normalised_utility
 
 #=======================================================================
 
@@ -270,9 +452,10 @@ class NavigationApp(object):
 	def update_info(self, normalise=False):
 		
 		# update the info structure
+		routes_costs = self.__P.get_routes_costs(normalise)
 		for od in self.__P.get_OD_pairs():
-			for r in xrange(self.__P.get_route_set_size(od)):
-				self.__od_route_info[od][r]['last'] = self.__P.get_route(od, r).get_cost(normalise)
+			for r, route in enumerate(self.__P.get_routes_indices(od)):
+				self.__od_route_info[od][r]['last'] = float(routes_costs[route])
 				self.__od_route_info[od][r]['sum'] += self.__od_route_info[od][r]['last']
 				self.__od_route_info[od][r]['samples'] += 1
 				self.__od_route_info[od][r]['avg'] = self.__od_route_info[od][r]['sum'] / self.__od_route_info[od][r]['samples']
@@ -287,6 +470,23 @@ class NavigationApp(object):
 	# return the current recommendation 
 	def get_recommendation(self, od):
 		return self.__od_recommendation[od]
+	
+	# the state of the app (e.g., to checkpoint a simulation), as a dictionary
+	# of arrays with the information of every route (in the order of the OD 
+	# pairs and of their routes)
+	def get_state(self):
+		routes_info = [ info for od in self.__P.get_OD_pairs() for info in self.__od_route_info[od] ]
+		return { field: np.array([ info[field] for info in routes_info ]) for field in ['avg', 'sum', 'samples', 'last'] }
+	
+	# restore a state obtained with get_state
+	def set_state(self, state):
+		fields = { field: state[field].tolist() for field in ['avg', 'sum', 'samples', 'last'] }
+		r = 0
+		for od in self.__P.get_OD_pairs():
+			for info in self.__od_route_info[od]:
+				for field in fields:
+					info[field] = fields[field][r]
+				r += 1
+			self.__od_recommendation[od] = [ e['avg'] for e in self.__od_route_info[od]]
 
 #=======================================================================
-
@@ -1,5 +1,12 @@
 from pylab import errorbar, plot
 import matplotlib.pyplot as plt
+import numpy as np
+import collections
+import struct
+import json
+import time
+import sys
+import os
 
 #=======================================================================
 
@@ -24,11 +31,12 @@ class Plotter(object):
 		
 		# plot the data
 		labels={}
+		# (the x axis is cut to the data, which may end earlier)
 		for d in self.__data:
 			if isinstance(self.__data[d][0],list):
-				labels[d] = errorbar(self.__x_axis, self.__data[d][0], yerr=self.__data[d][1])[0]
+				labels[d] = errorbar(self.__x_axis[:len(self.__data[d][0])], self.__data[d][0], yerr=self.__data[d][1])[0]
 			else:
-				labels[d] = plot(self.__x_axis, self.__data[d])[0]
+				labels[d] = plot(self.__x_axis[:len(self.__data[d])], self.__data[d])[0]
 		
 		# set axes limits and captions
 		plt.xlim(self.__x_axis[0], self.__x_axis[-1])
@@ -83,12 +91,99 @@ class DynamicPlotter(object):
 		
 #=======================================================================
 
+# prints the statistics of each episode (see Statistics) to the standard 
+# output, as one line of tab-separated values per episode, which is flushed 
+# every flush_every episodes
+class TextSink(object):
+	
+	def __init__(self, flush_every=1):
+		self.__flush_every = max(1, flush_every)
+	
+	# start writing records with the given columns, a list of (group, name) 
+	# pairs (groups span consecutive columns), by printing the headings
+	def open(self, columns):
+		
+		# the first values (the iteration and those of groups general and ema)
+		# are formatted as decimals, while the others are printed as they are
+		self.__formatted = len([ group for group, _ in columns if group in ['', 'general', 'ema'] ])
+		self.__written = 0
+		
+		print '\t'.join([ group if i == 0 or columns[i - 1][0] != group else '' for i, (group, _) in enumerate(columns) ])
+		print '\t'.join([ name for _, name in columns ])
+	
+	# write the record (list of values) of an episode
+	def write(self, record):
+		line = '\t'.join([ '%d' % record[0] ] + [ '%f' % x for x in record[1:self.__formatted] ])
+		print '%s\t%s' % (line, '\t'.join(map(str, record[self.__formatted:])))
+		self.__written += 1
+		if self.__written % self.__flush_every == 0:
+			sys.stdout.flush()
+	
+	def close(self):
+		sys.stdout.flush()
+
+#=======================================================================
+
+# writes the statistics of each episode (see Statistics) as a row of a 2D 
+# (float) NPY file, whose columns are described, as [group, name] pairs, 
+# by a JSON file with the same name and extension .columns.json; the rows 
+# are buffered and written every flush_every episodes (and when the sink is
+# closed), such that the file always holds a valid array of the rows written
+class NPYSink(object):
+	
+	# size of the header of the NPY file, which is fixed so that the shape 
+	# of the array can be updated without moving the rows already written
+	HEADER_SIZE = 128
+	
+	def __init__(self, file_name, flush_every=100):
+		self.__file_name = file_name
+		self.__flush_every = max(1, flush_every)
+	
+	# start writing records with the given columns (see TextSink.open)
+	def open(self, columns):
+		with open('%s.columns.json' % os.path.splitext(self.__file_name)[0], 'w') as f:
+			json.dump([ list(column) for column in columns ], f)
+		
+		self.__file = open(self.__file_name, 'wb')
+		self.__buffer = np.zeros((self.__flush_every, len(columns)))
+		self.__buffered = 0
+		self.__rows = 0
+		self.__write_header()
+	
+	def __write_header(self):
+		header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (self.__rows, self.__buffer.shape[1])
+		header = header.ljust(self.HEADER_SIZE - 11) + '\n'
+		self.__file.seek(0)
+		self.__file.write(np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header)
+	
+	# write the record (list of values) of an episode
+	def write(self, record):
+		self.__buffer[self.__buffered] = record
+		self.__buffered += 1
+		if self.__buffered == self.__flush_every:
+			self.flush()
+	
+	# write the buffered rows (and then the header with the new shape)
+	def flush(self):
+		self.__file.seek(0, os.SEEK_END)
+		self.__file.write(self.__buffer[:self.__buffered].astype('<f8').tostring())
+		self.__rows += self.__buffered
+		self.__buffered = 0
+		self.__write_header()
+		self.__file.flush()
+	
+	def close(self):
+		self.flush()
+		self.__file.close()
+
+#=======================================================================
+
 class Statistics(object):
 
-	def __init__(self, P, D, iterations, stat_regret_diff, plot_results, plotter, plotter_regret, stat_all, print_OD_pairs_every_episode):
+	def __init__(self, P, D, iterations, stat_regret_diff, plot_results, plotter, plotter_regret, stat_all, print_OD_pairs_every_episode, sink=None, every=1, ema=None):
 		
 		self.__P = P # problem instance
-		self.__D = D # set of drivers
+		self.__D = D # population of drivers
 		
 		# parameters of the problem instance
 		self.__iterations = iterations
@@ -98,160 +193,194 @@ class Statistics(object):
 		self.__plotter_regret = plotter_regret
 		self.__stat_all = stat_all
 		self.__print_OD_pairs_every_episode = print_OD_pairs_every_episode
+		
+		# the interval between the episodes with statistics (see run_simulation)
+		# and the number of such episodes so far
+		self.__every = every
+		self.__episodes = 0
+		
+		# the weight of each episode in the exponential moving averages of the 
+		# general statistics (if None, they are not computed), their current 
+		# values and the last episode in which they were updated
+		self.__ema = ema
+		self.__ema_values = None
+		self.__ema_iteration = None
+		
+		# the sink of the statistics of each episode (see print_statistics_episode)
+		self.__sink = sink if sink is not None else TextSink()
+		if self.__stat_all:
+			
+			# the columns of the records (see TextSink.open), i.e., the iteration,
+			# the average travel time and the regrets (in general and per OD pair)
+			regrets = ['real', 'est']
+			if self.__stat_regret_diff:
+				regrets += ['diff', 'reldiff']
+			columns = [('', 'it'), ('general', 'avg-tt')] + [ ('general', r) for r in regrets ]
+			if self.__ema is not None:
+				columns += [('ema', 'avg-tt')] + [ ('ema', r) for r in regrets ]
+			if self.__print_OD_pairs_every_episode:
+				for od in self.__P.get_OD_pairs():
+					columns += [ (od, r) for r in regrets ]
+			self.__sink.open(columns)
+	
+	# close the sink of the statistics of each episode
+	def close(self):
+		if self.__stat_all:
+			self.__sink.close()
+	
+	# the state of the statistics accumulated along the episodes (e.g., to 
+	# checkpoint a simulation), as a dictionary of arrays
+	def get_state(self):
+		return {
+			'episodes': np.array(self.__episodes),
+			'ema_values': np.array(self.__ema_values if self.__ema_values is not None else []),
+			'ema_iteration': np.array(self.__ema_iteration if self.__ema_iteration is not None else -1)
+		}
+	
+	# restore a state obtained with get_state
+	def set_state(self, state):
+		self.__episodes = int(state['episodes'])
+		self.__ema_values = state['ema_values'].tolist() if len(state['ema_values']) else None
+		self.__ema_iteration = int(state['ema_iteration']) if self.__ema_values is not None else None
 
 	#-------------------------------------------------------------------
 
-	def print_statistics(self, S, v, best, sum_regrets, routes_costs_sum):
+	def print_statistics(self, S, v, best, sum_regrets, routes_costs_sum, episodes=None):
+		
+		# the number of episodes run (less than iterations if the simulation
+		# stopped earlier, see run_simulation)
+		if episodes is None:
+			episodes = self.__iterations
 
-		# print the average regrets of each OD pair along the iterations
-		print '\nAverage regrets over all timesteps (real, estimated, absolute difference, relative difference) per OD pair:'
+		# print the average regrets of each OD pair along the iterations (with 
+		# statistics, see print_statistics_episode)
+		if self.__every == 1:
+			print '\nAverage regrets over all timesteps (real, estimated, absolute difference, relative difference) per OD pair:'
+		else:
+			print '\nAverage regrets over %d timesteps, one every %d (real, estimated, absolute difference, relative difference) per OD pair:' % (self.__episodes, self.__every)
 		for od in self.__P.get_OD_pairs():
-			print '\t%s\t%f\t%f\t%f\t%f' % (od, sum_regrets[od][0] / self.__iterations, sum_regrets[od][1] / self.__iterations, sum_regrets[od][2] / self.__iterations, sum_regrets[od][3] / self.__iterations)
+			print '\t%s\t%f\t%f\t%f\t%f' % (od, sum_regrets[od][0] / self.__episodes, sum_regrets[od][1] / self.__episodes, sum_regrets[od][2] / self.__episodes, sum_regrets[od][3] / self.__episodes)
 		
 		# print the average cost of each route of each OD pair along iterations
 		print '\nAverage cost of routes:'
 		for od in self.__P.get_OD_pairs():
 			print od
 			for r in xrange(int(self.__P.get_route_set_size(od))):
-				routes_costs_sum[od][r] /= self.__iterations
+				routes_costs_sum[od][r] /= episodes
 				print '\t%i\t%f' % (r, routes_costs_sum[od][r])
 		
 		print '\nLast solution %s = %f' % (S, v)
 		print 'Best value found was of %f' % best
 		
-		# print the average strategy (for each OD pair)
+		# print the average strategy (for each OD pair; each entry of the 
+		# population counts as many times as the drivers it represents, and 
+		# the strategies are added per OD pair with np.bincount)
 		print '\nAverage strategy per OD pair:'
-		for od in self.__P.get_OD_pairs():
-			strategies = { r: 0.0 for r in xrange(len(self.__P.get_routes(od))) }
-			for d in self.__D:
-				if d.get_OD_pair() == od:
-					S = d.get_strategy()
-					for s in S:
-						strategies[s] += S[s]
-			for s in strategies:
-				strategies[s] = round(strategies[s] / self.__P.get_OD_flow(od), 3)
+		drivers_od = self.__D.get_drivers_OD()
+		drivers_strategy = self.__D.get_strategies()
+		drivers_count = self.__D.get_counts()
+		n_OD = len(self.__P.get_OD_pairs())
+		strategies_sum = [ np.bincount(drivers_od, weights=drivers_strategy[:, r] * drivers_count, minlength=n_OD).tolist() for r in xrange(drivers_strategy.shape[1]) ]
+		for i_od, od in enumerate(self.__P.get_OD_pairs()):
+			strategies = { r: round(strategies_sum[r][i_od] / self.__P.get_OD_flow(od), 3) for r in xrange(self.__P.get_route_set_size(od)) }
 			print '\t%s\t%s' % (od, strategies)
 		
+		# the expected cost of each driver is computed route by route (only 
+		# over the routes of its OD pair) and then added per OD pair
 		print '\nAverage expected cost of drivers per OD pair'
-		expected_cost_sum = { od: 0.0 for od in self.__P.get_OD_pairs() }
-		for d in self.__D:
-			summ = 0.0
-			for r in d.get_strategy():
-				summ += d.get_strategy()[r] * routes_costs_sum[d.get_OD_pair()][r]
-			expected_cost_sum[d.get_OD_pair()] += summ
+		routes_costs = np.zeros((n_OD, drivers_strategy.shape[1]))
+		for i_od, od in enumerate(self.__P.get_OD_pairs()):
+			routes_costs[i_od, :len(routes_costs_sum[od])] = routes_costs_sum[od]
+		drivers_routes = np.array([ len(routes_costs_sum[od]) for od in self.__P.get_OD_pairs() ])[drivers_od]
+		summ = np.zeros(len(drivers_od))
+		for r in xrange(drivers_strategy.shape[1]):
+			summ = np.where(r < drivers_routes, summ + drivers_strategy[:, r] * routes_costs[drivers_od, r], summ)
+		expected_cost_sum = np.bincount(drivers_od, weights=summ * drivers_count, minlength=n_OD).tolist()
 		total = 0.0
-		for od in self.__P.get_OD_pairs():
-			total += expected_cost_sum[od]
-			print '%s\t%f' % (od, expected_cost_sum[od] / self.__P.get_OD_flow(od))
+		for i_od, od in enumerate(self.__P.get_OD_pairs()):
+			total += expected_cost_sum[i_od]
+			print '%s\t%f' % (od, expected_cost_sum[i_od] / self.__P.get_OD_flow(od))
 		print 'Average: %f' % (total / self.__P.get_total_flow())
 
 	#-------------------------------------------------------------------
 
 	def print_statistics_episode(self, iteration, v, sum_regrets):
 		
-		# store the SUM of regrets over all drivers in the CURRENT timestep
+		# compute the SUM of regrets over all drivers in the CURRENT timestep
 		# for each od [w, x, y, z], where w and x represent the real and estimated 
 		# regrets, and y and z represent absolute and relative difference between
-		# the estimated and real regrets
-		regrets = { od: [0.0, 0.0, 0.0, 0.0] for od in self.__P.get_OD_pairs() }
+		# the estimated and real regrets; the sums are grouped by the OD pair
+		# of the drivers (np.bincount adds the values of each OD pair in the
+		# order of the drivers) and each entry of the population is weighted 
+		# by the number of drivers it represents
+		drivers_od = self.__D.get_drivers_OD()
+		drivers_real = self.__D.get_real_regrets()
+		drivers_estimated = self.__D.get_estimated_regrets()
+		drivers_count = self.__D.get_counts() # number of drivers of each entry
 		
-		gen_real = 0.0
-		gen_estimated = 0.0
-		gen_diff = 0.0
-		gen_relative_diff = 0.0
-		
-		# compute the drivers' regret on CURRENT iteration
-		
-		for d in self.__D:
-			
-			# get the regrets
-			real = d.get_real_regret()
-			estimated = d.get_estimated_regret()
-
-			# store in the appropriate space
-			regrets[d.get_OD_pair()][0] += real
-			regrets[d.get_OD_pair()][1] += estimated
-			
-			gen_real += real
-			gen_estimated += estimated
-
+		values = [drivers_real * drivers_count, drivers_estimated * drivers_count]
 		if self.__stat_regret_diff:
-			for d in self.__D:
-				
-				# compute the regrets
-				real = d.get_real_regret()
-				estimated = d.get_estimated_regret()
-				diff = abs(estimated - real)
-				fxy = max(abs(estimated), abs(real))
-				try: 
-					relative_diff = (diff / fxy) #https://en.wikipedia.org/wiki/Relative_change_and_difference
-				except ZeroDivisionError:
-					relative_diff = 0.0
-
-				# store in the appropriate space
-				regrets[d.get_OD_pair()][2] += diff
-				regrets[d.get_OD_pair()][3] += relative_diff
-				
-				gen_diff += diff
-				gen_relative_diff += relative_diff
+			diff = np.abs(drivers_estimated - drivers_real)
+			fxy = np.maximum(np.abs(drivers_estimated), np.abs(drivers_real))
+			relative_diff = np.zeros(len(diff)) #https://en.wikipedia.org/wiki/Relative_change_and_difference
+			np.divide(diff, fxy, out=relative_diff, where=fxy != 0)
+			values += [diff * drivers_count, relative_diff * drivers_count]
 		
-		# calculate the total averages
-		gen_real /= self.__P.get_total_flow()
-		gen_estimated /= self.__P.get_total_flow()
-		if self.__stat_regret_diff:
-			gen_diff /= self.__P.get_total_flow()
-			gen_relative_diff /= self.__P.get_total_flow()
+		n_OD = len(self.__P.get_OD_pairs())
+		regrets = [ np.bincount(drivers_od, weights=x, minlength=n_OD).tolist() for x in values ]
 		
-		str_print = '%d\t%f\t%f\t%f' % (iteration, v, gen_real, gen_estimated)
-		if self.__stat_regret_diff:
-			str_print = '%s\t%f\t%f' % (str_print, gen_diff, gen_relative_diff)
+		# calculate the total averages (the cumulative sum is used to add the 
+		# regrets in the same order as the drivers)
+		gen_regrets = [ float(np.cumsum(x)[-1]) / self.__P.get_total_flow() for x in values ]
+		gen_real, gen_estimated = gen_regrets[:2]
+		gen_diff, gen_relative_diff = gen_regrets[2:] if self.__stat_regret_diff else (0.0, 0.0)
 		
 		# calculate the average regrets (real, estimated, absolute difference 
 		# and relative difference) and then store and plot them (ALL iterations)
 		to_print = []
-		for od in self.__P.get_OD_pairs():
+		for i_od, od in enumerate(self.__P.get_OD_pairs()):
 			
 			# calculate the averages
-			real = regrets[od][0] / self.__P.get_OD_flow(od)
-			estimated = regrets[od][1] / self.__P.get_OD_flow(od)
+			averages = [ x[i_od] / self.__P.get_OD_flow(od) for x in regrets ]
 			
 			# store (over all timesteps)
-			sum_regrets[od][0] += real
-			sum_regrets[od][1] += estimated
+			for i, average in enumerate(averages):
+				sum_regrets[od][i] += average
 			
 			# plot
 			if self.__plot_results:
-				self.__plotter_regret.add('real %s' % od, real)
-				self.__plotter_regret.add('estimated %s' % od, estimated)
+				self.__plotter_regret.add('real %s' % od, averages[0])
+				self.__plotter_regret.add('estimated %s' % od, averages[1])
+				if self.__stat_regret_diff:
+					self.__plotter_regret.add('abs. diff. %s' % od, averages[2])
 			
 			# store important information from current iteration
-			to_print.append([real, estimated])
-			
-		if self.__stat_regret_diff:
-			for iod, od in enumerate(self.__P.get_OD_pairs()):
-				
-				# compute the averages
-				diff = regrets[od][2] / self.__P.get_OD_flow(od)
-				relative_diff = regrets[od][3] / self.__P.get_OD_flow(od)
-				
-				# store (over all timesteps)
-				sum_regrets[od][2] += diff
-				sum_regrets[od][3] += relative_diff
-				
-				# plot
-				if self.__plot_results:
-					self.__plotter_regret.add('abs. diff. %s' % od, diff)
-				
-				# store important information from current iteration
-				to_print[iod].append(diff)
-				to_print[iod].append(relative_diff)
-				
-		# print important information from current iteration
+			to_print.append(averages)
+		
+		self.__episodes += 1
+		
+		# update the exponential moving averages of the general statistics; 
+		# the weight of the current episode accounts for the episodes since 
+		# the last update (which are assumed to have the same values)
+		general = [v] + gen_regrets
+		if self.__ema is not None:
+			if self.__ema_values is None:
+				self.__ema_values = general
+			else:
+				weight = 1.0 - (1.0 - self.__ema) ** (iteration - self.__ema_iteration)
+				self.__ema_values = [ ema + weight * (x - ema) for ema, x in zip(self.__ema_values, general) ]
+			self.__ema_iteration = iteration
+		
+		# write important information from current iteration
 		if self.__stat_all:
-			str_add = ''
+			record = [iteration, v, gen_real, gen_estimated]
+			if self.__stat_regret_diff:
+				record += [gen_diff, gen_relative_diff]
+			if self.__ema is not None:
+				record += self.__ema_values
 			if self.__print_OD_pairs_every_episode:
-				str_add = '%s' % ('\t'.join(map(str, [item for sublist in to_print for item in sublist])))
-			print '%s\t%s' % (str_print, str_add)
+				record += [item for sublist in to_print for item in sublist]
+			self.__sink.write(record)
 
 		# print the regrets on the last iteration
 		#if iteration == iterations-1:
@@ -264,3 +393,54 @@ class Statistics(object):
 
 #=======================================================================
 
+# accumulates the wall time and the number of calls of each phase of a 
+# simulation (see run_simulation), where each phase is timed from the end 
+# of the previous one (see lap); a disabled profiler does nothing, so that
+# the phases can be marked regardless of whether profiling is desired
+class Profiler(object):
+	
+	def __init__(self, enabled=True):
+		self.__enabled = enabled
+		self.__phases = collections.OrderedDict() # phase -> [time, calls]
+		self.__last = time.time()
+	
+	# start timing the first phase
+	def start(self):
+		self.__last = time.time()
+	
+	# end the current phase (i.e., add the time since the end of the 
+	# previous phase to the given phase)
+	def lap(self, phase):
+		if not self.__enabled:
+			return
+		now = time.time()
+		if phase not in self.__phases:
+			self.__phases[phase] = [0.0, 0]
+		self.__phases[phase][0] += now - self.__last
+		self.__phases[phase][1] += 1
+		self.__last = now
+	
+	# return the profile as a (JSON serialisable) dictionary, mapping each 
+	# phase (in the order they first ended) to its time and calls
+	def get_profile(self):
+		return collections.OrderedDict([ (phase, collections.OrderedDict([('time', t), ('calls', calls)])) for phase, (t, calls) in self.__phases.items() ])
+	
+	# aggregate the given profiles (e.g., of the replications of an 
+	# experiment), returning, for each phase, its total time and calls, 
+	# along with the average, minimum and maximum time per profile (phases 
+	# missing from a profile count as zero time)
+	@staticmethod
+	def aggregate(profiles):
+		phases = collections.OrderedDict()
+		for profile in profiles:
+			for phase in profile:
+				phases[phase] = None
+		aggregated = collections.OrderedDict()
+		for phase in phases:
+			times = [ profile[phase]['time'] if phase in profile else 0.0 for profile in profiles ]
+			calls = [ profile[phase]['calls'] if phase in profile else 0 for profile in profiles ]
+			aggregated[phase] = collections.OrderedDict([('time', sum(times)), ('calls', sum(calls)), ('mean_time', sum(times) / len(profiles)), ('min_time', min(times)), ('max_time', max(times))])
+		return aggregated
+
+#=======================================================================
+
@@ -6,13 +6,22 @@ Created on 20-Feb-17
 import sys, os
 #sys.path.insert(0, '..')
 
-from problem import ProblemInstance
+from problem import get_problem_instance
 from simulation import run_simulation
 from experiments import experiment
 
 import time
 import numpy as np
 
+# run a validation case (see aamas17.validation_cases) on the given network, 
+# returning the values produced by the simulation
+def run_validation_case(net, decay):
+
+    np.random.seed(123456789)
+    P = get_problem_instance(net)
+    # (the number of episodes run is not validated)
+    return run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=decay, epsilon_decay=decay, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, plot_results=False, stat_all=False, stat_regret_diff=False)[:3]
+
 class aamas17(experiment):
     
     #-----------------------------------------------------------------------
@@ -39,7 +48,7 @@ class aamas17(experiment):
                 decay = NETWORKS_ANDN_DECAYS[net_id][1]
                 for rep in xrange(1,REPLICATIONS+1):
                     
-                    P = ProblemInstance(net_name)
+                    P = get_problem_instance(net_name)
                     exp += 1
                     
                     print '========================================================================'
@@ -74,35 +83,30 @@ class aamas17(experiment):
     # (which are not necessarily published)
     # the rationale here is that, after the script is changed, ideally the  
     # results should not change given the same random seed is used
-    def validate_script(self):
-        
-        print "Validating script (it takes around 15 seconds)..."
-        
-        sys.stdout = open(os.devnull, 'w')
+    def validate_script(self, n_jobs=1):
         
-        # Braess_1_4200_10_c1
-        np.random.seed(123456789)
-        P = ProblemInstance('Braess_1_4200_10_c1')
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.99, epsilon_decay=0.99, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (17.87485260769432, 0.0490511312360153, 0.06446411167818451):
-            sys.stderr.write("Error while validating script on network Braess_1_4200_10_c1! [%s]\n" % ', '.join(map(str,[repr(x) for x in res])))
+        print "Validating script (it takes around 15 seconds on a single core)..."
         
-        # Braess_2_4200_10_c1
-        np.random.seed(123456789)
-        P = ProblemInstance('Braess_2_4200_10_c1')
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.995, epsilon_decay=0.995, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (26.572295918360744, 0.01498349395316248, 0.04359264795920571):
-            sys.stderr.write("Error while validating script on network Braess_2_4200_10_c1! [%s]\n" % ', '.join(map(str,[repr(x) for x in res])))
-        
-        # Braess_3_4200_10_c1
-        np.random.seed(123456789)
-        P = ProblemInstance('Braess_3_4200_10_c1')
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.9975, epsilon_decay=0.9975, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (35.56324319727688, 0.006523992913800927, 0.04611469104307984):
-            sys.stderr.write("Error while validating script on network Braess_3_4200_10_c1! [%s]\n" % ', '.join(map(str,[repr(x) for x in res])))
-        
-        sys.stdout = sys.__stdout__
-        print "Finished!"
+        self.run_validation_cases(self.get_validation_cases(), n_jobs)
+
+    #-----------------------------------------------------------------------
+
+    # the expected values were obtained with version 2 of the random streams
+    # (see experiment.baseline_version)
+    baseline_version = 2
+
+    def validation_cases(self):
+
+        net_names = ['Braess_1_4200_10_c1', 'Braess_2_4200_10_c1', 'Braess_3_4200_10_c1']
+
+        # expected results of each network, in the form [decay, expected values]
+        expected_results = {
+            'Braess_1_4200_10_c1': [0.99, (17.864649092955258, 0.049188615646446505, 0.06477374858294677)],
+            'Braess_2_4200_10_c1': [0.995, (26.582395691603345, 0.015336059712799745, 0.04342521825398908)],
+            'Braess_3_4200_10_c1': [0.9975, (35.59735204081439, 0.007026488378653412, 0.04513993778344299)]
+        }
+
+        return [ ('network "%s"' % net, run_validation_case, (net, expected_results[net][0]), expected_results[net][1]) for net in net_names ]
 
     #-----------------------------------------------------------------------
 
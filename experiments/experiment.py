@@ -3,20 +3,79 @@
 
 from abc import ABCMeta, abstractmethod
 
-from os import listdir
+from os import listdir, devnull
 from os.path import dirname, basename
 
+import sys
+import traceback
+from parallel import run_jobs
+from simulation import RANDOM_STREAMS_VERSION
+
 # required to create the abstract class (compatible with Python 2 *and* 3)
 ABC = ABCMeta('ABC', (object,), {'__slots__': ()}) 
 
 # update the list of classes within this package
 __all__ = [basename(f)[:-3] for f in listdir(dirname(__file__)) if f[-3:] == ".py" and not f.endswith("__init__.py")]
 
+# run a single validation case (see experiment.run_validation_cases), returning
+# whether it passed along with the values it produced (or the traceback of the
+# exception that prevented it from finishing)
+def validate_case(function, args, expected_values):
+	try:
+		res = function(*args)
+	except Exception:
+		return (False, traceback.format_exc())
+	return (res == expected_values, res)
+
 class experiment(ABC):
 	
+	# version of the random streams of the simulation (see 
+	# simulation.RANDOM_STREAMS_VERSION) used to obtain the expected values 
+	# of the validation cases; whenever the random streams change, the 
+	# expected values must be obtained again and this version updated
+	baseline_version = None
+	
+	@abstractmethod
+	def validate_script(self, n_jobs=1):
+		pass
+
+	# return the list of validation cases of the experiment (see 
+	# run_validation_cases)
 	@abstractmethod
-	def validate_script(self):
+	def validation_cases(self):
 		pass
+	
+	# return the list of validation cases of the experiment, checking that 
+	# their expected values were obtained with the current random streams
+	def get_validation_cases(self):
+		if self.baseline_version != RANDOM_STREAMS_VERSION:
+			raise Exception('The validation cases of %s were obtained with version %s of the random streams, but the current version is %d!' % (self.__class__.__name__, self.baseline_version, RANDOM_STREAMS_VERSION))
+		return self.validation_cases()
+
+	# run a list of validation cases (in parallel, if more than one process is
+	# allowed), reporting the outcome of each one and returning the number of 
+	# failed cases; each case is a tuple (description, function, args, 
+	# expected_values), where function(*args) must return expected_values; 
+	# the function must be defined at module level and seed the random 
+	# generators by itself, so that the outcome of a case does not depend on 
+	# the process running it or on the cases run before it
+	@staticmethod
+	def run_validation_cases(cases, n_jobs=1):
+		
+		# the output of the simulations is discarded
+		jobs = [ (validate_case, (function, args, expected_values), devnull) for (_, function, args, expected_values) in cases ]
+		
+		fails = 0
+		for i, (passed, res) in enumerate(run_jobs(jobs, n_jobs)):
+			print '\tTesting %s... %s' % (cases[i][0], 'ok' if passed else 'FAILED')
+			sys.stdout.flush()
+			if not passed:
+				fails += 1
+				sys.stderr.write("Error while validating %s! %s\n" % (cases[i][0], res))
+		
+		print '\nTest completed! Failed trials: %d out of %d (%.1f%%)\n' % (fails, len(cases), (fails/float(len(cases)))*100)
+		
+		return fails
 
 	@abstractmethod
 	def run(self, params):
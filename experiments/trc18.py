@@ -6,18 +6,64 @@ Created on 09-Mar-17
 import sys, os
 #sys.path.insert(0, '..')
 
-from problem import ProblemInstance
+from problem import get_problem_instance
 from simulation import run_simulation
 from experiments import experiment
+from parallel import run_jobs
 
 import time
 import numpy as np
 
+# run a single experiment of a batch (see trc18.run_batch_file), 
+# returning its line of the summary
+def run_experiment(exp_id, n_experiments, net_name, K, decay, app, rep):
+    
+    print '========================================================================'
+    print ' Experiment %i of %i' % (exp_id, n_experiments)
+    print ' network=%s, k=%d, decay=%f, app=%s, replication=%i' % (net_name, K, decay, app, rep)
+    print '========================================================================\n'
+    
+    alt_route_file = None
+    if net_name in ['BBraess_1_2100_10_c1_2100', 'BBraess_3_2100_10_c1_900', 'BBraess_5_2100_10_c1_900', 'BBraess_7_2100_10_c1_900']:
+        alt_route_file = 'networks/%s.TRC.routes' % net_name
+    
+    P = get_problem_instance(net_name, K, alt_route_file)
+    
+    start = time.time()
+    values = [0, 0, 0, 0, 0]
+    try:
+        values = run_simulation(P, 1000, alpha=1.0, epsilon=1.0, alpha_decay=decay, epsilon_decay=decay, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=app, plot_results=False)
+    except Exception:
+        print '[ERROR] Some exception prevented this experiment from finishing!'
+    else:
+        None
+    runtime = time.time() - start
+    
+    print '\n========================================================================\n'
+    sys.stdout.flush()
+    
+    return '%i\t%s\t%d\t%f\t%s\t%i\t%f\t%f\t%f\t%f\n' % (exp_id, net_name, K, decay, app, rep, values[0], values[1], values[2], runtime)
+
+# run a validation case (see trc18.validation_cases) on the given network, 
+# returning the values produced by the simulation
+def run_validation_case(net, K, decay):
+
+    np.random.seed(123456789)
+
+    alt_route_file = None
+    if net in ['BBraess_1_2100_10_c1_2100', 'BBraess_3_2100_10_c1_900', 'BBraess_5_2100_10_c1_900', 'BBraess_7_2100_10_c1_900']:
+        alt_route_file = 'networks/%s.TRC.routes' % net
+
+    P = get_problem_instance(net, K, alt_route_file)
+
+    # (the number of episodes run is not validated)
+    return run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=decay, epsilon_decay=decay, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)[:3]
+
 class trc18(experiment):
 
     #-----------------------------------------------------------------------
 
-    def run_batch_file(self, run_file_name):
+    def run_batch_file(self, run_file_name, n_jobs=1):
         
         SETS = []
         N_EXPERIMENTS = 0
@@ -99,15 +145,20 @@ class trc18(experiment):
         
         print 'Running %d experiments%s...' % (N_EXPERIMENTS, '' if CUR_ATEMPT == 1 else ' (attempt number %d, skipping %d experiments)'%(CUR_ATEMPT, LAST_EXP))
         
-        sys.stdout = open('experiments/results/log_params_TRC%s.txt'%('' if CUR_ATEMPT == 1 else '_attempt%d'%CUR_ATEMPT), 'w')
+        log_file_name = 'experiments/results/log_params_TRC%s' % ('' if CUR_ATEMPT == 1 else '_attempt%d'%CUR_ATEMPT)
+        
+        # the main log file lists the experiments (the output of each 
+        # experiment is written to its own log file)
+        log_file = open('%s.txt' % log_file_name, 'w')
         
-        fname = open('experiments/results/log_params_TRC%s_summary.txt'%('' if CUR_ATEMPT == 1 else '_attempt%d'%CUR_ATEMPT), 'w')
+        fname = open('%s_summary.txt' % log_file_name, 'w')
         fname.write('id\tnet\tk\tdecay\tapp\trep\tavg-tt\treal\test\truntime (s)\n')
         fname.flush()
         
-        # run the set of experiments defined in the file
+        # define the set of experiments defined in the file
         # keeping the order in which the parameters were 
         # defined in the file
+        jobs = []
         for SET in SETS:
             order = SET[-1]
             for p1 in xrange(SET[0][1]):
@@ -125,43 +176,33 @@ class trc18(experiment):
                                 
                                 CUR_EXP += 1
                                 
-                                print '========================================================================'
-                                print ' Experiment %i of %i' % (CUR_EXP, N_EXPERIMENTS)
-                                print ' network=%s, k=%d, decay=%f, app=%s, replication=%i' % (net_name, K, decay, app, rep)
-                                print '========================================================================\n'
+                                log_file.write('========================================================================\n')
+                                log_file.write(' Experiment %i of %i\n' % (CUR_EXP, N_EXPERIMENTS))
+                                log_file.write(' network=%s, k=%d, decay=%f, app=%s, replication=%i\n' % (net_name, K, decay, app, rep))
+                                log_file.write('========================================================================\n\n')
                                 
                                 if CUR_EXP <= LAST_EXP:
-                                    print 'Skipped!\n'
+                                    log_file.write('Skipped!\n\n')
                                 
                                 else:
-                                    
-                                    alt_route_file = None
-                                    if net_name in ['BBraess_1_2100_10_c1_2100', 'BBraess_3_2100_10_c1_900', 'BBraess_5_2100_10_c1_900', 'BBraess_7_2100_10_c1_900']:
-                                        alt_route_file = 'networks/%s.TRC.routes' % net_name
-                                    
-                                    P = ProblemInstance(net_name, K, alt_route_file)
-                                    
-                                    start = time.time()
-                                    values = [0, 0, 0, 0, 0]
-                                    try:
-                                        values = run_simulation(P, 1000, alpha=1.0, epsilon=1.0, alpha_decay=decay, epsilon_decay=decay, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=app, plot_results=False)
-                                    except Exception:
-                                        print '[ERROR] Some exception prevented this experiment from finishing!'
-                                    else:
-                                        None
-                                    runtime = time.time() - start
-                                    
-                                    # write summary
-                                    fname.write('%i\t%s\t%d\t%f\t%s\t%i\t%f\t%f\t%f\t%f\n' % (CUR_EXP, net_name, K, decay, app, rep, values[0], values[1], values[2], runtime))
-                                    fname.flush()
-                                    
-                                    print '\n========================================================================\n'
-                                    sys.stdout.flush()
-                                    
-                                    LAST_EXP = CUR_EXP
-                                    control_file.seek(0)
-                                    control_file.write('{:<10}'.format('%d#%d'%(CUR_ATEMPT, LAST_EXP)))
-                                    control_file.flush()
+                                    exp_log_file_name = '%s_exp%d.txt' % (log_file_name, CUR_EXP)
+                                    log_file.write('Log file: %s\n\n' % exp_log_file_name)
+                                    jobs.append((run_experiment, (CUR_EXP, N_EXPERIMENTS, net_name, K, decay, app, rep), exp_log_file_name))
+        
+        log_file.close()
+        
+        # run the experiments (in parallel, if more than one job is allowed); 
+        # the summary and the control file are updated in the experiments' order
+        for i, summary in enumerate(run_jobs(jobs, n_jobs)):
+            
+            # write summary
+            fname.write(summary)
+            fname.flush()
+            
+            LAST_EXP = jobs[i][1][0]
+            control_file.seek(0)
+            control_file.write('{:<10}'.format('%d#%d'%(CUR_ATEMPT, LAST_EXP)))
+            control_file.flush()
         
         # finish the experiment by setting a flag on the control file
         control_file.seek(0)
@@ -170,7 +211,6 @@ class trc18(experiment):
         
         # close the files
         fname.close()
-        sys.stdout = sys.__stdout__
         control_file.close()
         
         print 'finished!'
@@ -180,119 +220,48 @@ class trc18(experiment):
     # (which are not necessarily published)
     # the rationale here is that, after the script is changed, ideally the  
     # results should not change given the same random seed is used
-    def validate_script(self):
-        
-        print "Validating script (it takes around 1 minute)..."
-         
-        sys.stdout = open(os.devnull, 'w')
-         
-        net = 'Braess_1_4200_10_c1'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 4)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.99, epsilon_decay=0.99, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (17.876696712002676, 0.04901963208635559, 0.05717411243834065):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
-          
-        net = 'Braess_2_4200_10_c1'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 4)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.99, epsilon_decay=0.99, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (28.150256235818755, 0.017926762660643157, 0.028345552443374018):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
-          
-        net = 'Braess_3_4200_10_c1'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 4)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.99, epsilon_decay=0.99, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (39.54823129251494, 0.016041376984097914, 0.02531379415469834):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
-         
-        net = 'Braess_4_4200_10_c1'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 4)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.995, epsilon_decay=0.995, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (50.02816326530857, 0.000864934240362699, 0.009560876173870221):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
-         
-        net = 'Braess_5_4200_10_c1'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 8)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.995, epsilon_decay=0.995, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (59.04352607709874, 0.02236392214661536, 0.033043320440792674):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
-         
-        net = 'Braess_6_4200_10_c1'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 8)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.995, epsilon_decay=0.995, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (71.10539795918233, 0.019154097667634328, 0.030254111338520098):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
-         
-        net = 'Braess_7_4200_10_c1'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 8)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.995, epsilon_decay=0.995, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (81.09731349206372, 0.01298665787981078, 0.024803593870961906):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
-         
-        net = 'BBraess_1_2100_10_c1_2100'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 4, 'networks/%s.TRC.routes' % net)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.99, epsilon_decay=0.99, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (9.159592403619715, 0.027191306689473428, 0.029588519231558454):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
-         
-        net = 'BBraess_3_2100_10_c1_900'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 4, 'networks/%s.TRC.routes' % net)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.99, epsilon_decay=0.99, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (24.847269841260655, 0.06233493735833484, 0.06838126165572478):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
-         
-        net = 'BBraess_5_2100_10_c1_900'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 12, 'networks/%s.TRC.routes' % net)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.99, epsilon_decay=0.99, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (65.80720238095249, 0.0953541426209693, 0.12641721501320058):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
+    def validate_script(self, n_jobs=1):
         
-        net = 'BBraess_7_2100_10_c1_900'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 4, 'networks/%s.TRC.routes' % net)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.995, epsilon_decay=0.995, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (127.29053650793541, 0.017996803018044887, 0.027426301080543055):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
+        print "Validating script (it takes around 1 minute on a single core)..."
         
-        net = 'OW'
-        sys.__stdout__.write('\tTesting network "%s"...\n' % net)
-        np.random.seed(123456789)
-        P = ProblemInstance(net, 8)
-        res = run_simulation(P, 100, alpha=1.0, epsilon=1.0, alpha_decay=0.995, epsilon_decay=0.995, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=True, use_app=True, plot_results=False, stat_all=False, stat_regret_diff=False)
-        if res != (74.9434470588235, 0.04458316758358024, 0.049571630503084246):
-            sys.stderr.write("Error while validating script on network %s! [%s]\n" % (net, ', '.join(map(str,[repr(x) for x in res]))))
-         
-        sys.stdout = sys.__stdout__
-        print "\nFinished!"
+        self.run_validation_cases(self.get_validation_cases(), n_jobs)
+
+    #-----------------------------------------------------------------------
+
+    # the expected values were obtained with version 2 of the random streams
+    # (see experiment.baseline_version)
+    baseline_version = 2
+
+    def validation_cases(self):
+
+        net_names = ['Braess_1_4200_10_c1', 'Braess_2_4200_10_c1', 'Braess_3_4200_10_c1', 'Braess_4_4200_10_c1', 'Braess_5_4200_10_c1', 'Braess_6_4200_10_c1', 'Braess_7_4200_10_c1', 'BBraess_1_2100_10_c1_2100', 'BBraess_3_2100_10_c1_900', 'BBraess_5_2100_10_c1_900', 'BBraess_7_2100_10_c1_900', 'OW']
+
+        # expected results of each network, in the form [K, decay, expected values]
+        expected_results = {
+            'Braess_1_4200_10_c1': [4, 0.99, (17.864649092955258, 0.049199086451435156, 0.05744256858140431)],
+            'Braess_2_4200_10_c1': [4, 0.99, (28.105493197270036, 0.017276274565404984, 0.027751279450786235)],
+            'Braess_3_4200_10_c1': [4, 0.99, (39.56357653060993, 0.01582951147956286, 0.02505865058178646)],
+            'Braess_4_4200_10_c1': [4, 0.995, (50.01099773242875, 0.001149198412698491, 0.009477118895874801)],
+            'Braess_5_4200_10_c1': [8, 0.995, (59.14394557823244, 0.021808076719555817, 0.03261285505087767)],
+            'Braess_6_4200_10_c1': [8, 0.995, (70.86944897959057, 0.018927915532875685, 0.03003597865314672)],
+            'Braess_7_4200_10_c1': [8, 0.995, (80.76895634920649, 0.013074632440468338, 0.024378507818401476)],
+            'BBraess_1_2100_10_c1_2100': [4, 0.99, (9.149907029470224, 0.02712612811804477, 0.029463921786014705)],
+            'BBraess_3_2100_10_c1_900': [4, 0.99, (24.867654761895984, 0.06222361734699658, 0.06814151218325096)],
+            'BBraess_5_2100_10_c1_900': [12, 0.99, (65.42703412698418, 0.09541251596753048, 0.1263083460507588)],
+            'BBraess_7_2100_10_c1_900': [4, 0.995, (127.3594341269832, 0.017987870235407967, 0.027334604337576385)],
+            'OW': [8, 0.995, (74.7363176470588, 0.045012349132458766, 0.050367175119797145)]
+        }
+
+        return [ ('network "%s"' % net, run_validation_case, (net, expected_results[net][0], expected_results[net][1]), expected_results[net][2]) for net in net_names ]
 
     #-----------------------------------------------------------------------
 
     def run(self, params):
         
         if params['validate']:
-            self.validate_script()
+            self.validate_script(params['jobs'])
         else:
-            self.run_batch_file(params['config'])
+            self.run_batch_file(params['config'], params['jobs'])
 
     #-----------------------------------------------------------------------
 
@@ -302,6 +271,8 @@ class trc18(experiment):
 
         subp.add_argument('--config_file', dest='config', action='store', default='experiments/config/run_TRC', type=str, 
             help='configuration file of the experiment')
+        subp.add_argument('--jobs', dest='jobs', action='store', default=1, type=int, required=False, 
+            help='number of experiments to run in parallel (0 means one per core)')
         subp.add_argument('--validate', dest='validate', action='store_true', 
             help='validate the experiment script')
         subp.set_defaults(exp_class='trc18')
@@ -1,6 +1,27 @@
 import random
+import numpy as np
 import scipy.stats as sc_stats
 import collections
+import os
+
+# write a file through write(f), where f is the file opened for writing 
+# (in binary mode); the contents are first written to a temporary file, 
+# whose name is unique to the process, and then renamed, so that neither 
+# a crash while writing nor processes writing the same file in parallel 
+# leave an incomplete file (the previous file is replaced only when the 
+# new one is complete); errors are raised after removing the temporary file
+def write_atomically(file_name, write):
+	tmp_file_name = '%s.%d.tmp' % (file_name, os.getpid())
+	try:
+		with open(tmp_file_name, 'wb') as f:
+			write(f)
+		os.rename(tmp_file_name, file_name)
+	except:
+		if os.path.exists(tmp_file_name):
+			os.remove(tmp_file_name)
+		raise
+
+#=======================================================================
 
 class Distribution(object):
 	
@@ -99,38 +120,60 @@ class Distribution(object):
 		else:
 			raise Exception('Distribution \'%s\' is invalid!' % dist)
 		
-		# include round on the function, if desired
-		if precision != None:
-			self.__function_comp = self.__function
-			self.__function = lambda: round(self.__function_comp(), precision)
+		# the samples are rounded (by sample_many), if desired
+		self.__precision = precision
 
 	# fixed distribution that always returns value
 	# Note: to be more precise, this could be seen as a uniform distribution in the interval [value, value]
 	def __init_fixed(self, value):
-		self.__function = lambda: value
+		self.__function = lambda n: np.full(n, value, dtype=float)
 
 	# uniform distribution in the interval [min_value, max_value]
 	# Note: the interval is closed on both sides, but on the right it occurs less often (as explained by random.uniform documentation)
+	# Note 2: the samples are drawn one by one from python's generator, so that they remain the same of previous versions
 	def __init_uniform(self, min_value, max_value):
-		self.__function = lambda: random.uniform(min_value, max_value)
+		self.__function = lambda n: np.array([ random.uniform(min_value, max_value) for _ in xrange(n) ], dtype=float)
 
 	# normal distribution with mean mean and deviation standard deviation
+	# Note: the samples are drawn one by one from python's generator (as above)
 	def __init_normal(self, mean, deviation):
-		self.__function = lambda: random.gauss(mean, deviation)
+		self.__function = lambda n: np.array([ random.gauss(mean, deviation) for _ in xrange(n) ], dtype=float)
 
 	# truncated normal distribution in the interval [min_value, max_value] with mean mean and deviation standard deviation
-	# Note: the complexity of this distribution is considerably higher than the previous ones
+	# Note: the complexity of this distribution is considerably higher than the previous ones, thus num_of_samples samples are 
+	# drawn at once, and a new set of num_of_samples samples is drawn (from the same distribution) whenever they are all used
 	def __init_truncated_normal(self, mean, deviation, min_value, max_value, num_of_samples):
-		self.__trunc_norm_iter = iter(sc_stats.truncnorm((min_value-mean)/deviation, (max_value-mean)/deviation, loc=mean, scale=deviation).rvs(num_of_samples))
-		self.__function = lambda: self.__trunc_norm_iter.next()
+		self.__trunc_norm = sc_stats.truncnorm((min_value-mean)/deviation, (max_value-mean)/deviation, loc=mean, scale=deviation)
+		self.__trunc_norm_num_of_samples = num_of_samples
+		self.__trunc_norm_samples = self.__trunc_norm.rvs(num_of_samples)
+		self.__trunc_norm_next = 0 # the next sample to be used
+		self.__function = self.__sample_truncated_normal
+	
+	# return the next n samples of the truncated normal distribution
+	def __sample_truncated_normal(self, n):
+		samples = []
+		while n > 0:
+			if self.__trunc_norm_next == len(self.__trunc_norm_samples):
+				self.__trunc_norm_samples = self.__trunc_norm.rvs(self.__trunc_norm_num_of_samples)
+				self.__trunc_norm_next = 0
+			chunk = self.__trunc_norm_samples[self.__trunc_norm_next:self.__trunc_norm_next + n]
+			self.__trunc_norm_next += len(chunk)
+			n -= len(chunk)
+			samples.append(chunk)
+		return np.concatenate(samples) if samples else np.zeros(0)
 	
 	# return a single, randomly generated sample of the distribution
 	def sample(self):
-		try:
-			return self.__function()
-		except StopIteration:
-			self.__init_func()
-			return self.__function()
+		return float(self.sample_many(1)[0])
+	
+	# return an array of n randomly generated samples of the distribution (the
+	# same that would be returned by n calls of sample)
+	def sample_many(self, n):
+		samples = self.__function(n)
+		if self.__precision != None:
+			# (python's round, which rounds half away from zero, unlike np.round)
+			samples = np.array([ round(x, self.__precision) for x in samples.tolist() ])
+		return samples
 
 	# return the name of a distribution given its id
 	@staticmethod
@@ -153,7 +196,7 @@ class Distribution(object):
 		import matplotlib.pyplot as plt
 
 		# generate the specified number of samples
-		samples = [ self.sample() for _ in xrange(n_of_samples) ]
+		samples = self.sample_many(n_of_samples)
 		
 		# plot them as a histogram
 		plt.hist(samples, 100)
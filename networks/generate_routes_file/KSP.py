@@ -1,6 +1,6 @@
 #!/usr/bin/python
 '''
-KSP v1.42
+KSP v1.52
 
 Created on February 10, 2014 by Gabriel de Oliveira Ramos <goramos@inf.ufrgs.br>
 
@@ -48,11 +48,33 @@ v1.32 (19-Set-2016) - Small fix related with dedges' name (A-B is named A-B in t
                       but B-A in the backward one).
 v1.42 (12-Nov-2016) - Added parameter to define the flow of vehicles to be used when computing
 					  the links' costs.
+v1.5 (18-Oct-2026) -  Shortest paths are now computed with a binary heap (rather than by
+					  scanning all nodes on each iteration), and the graph is indexed by the
+					  new Graph class (which maps nodes' names to nodes, pairs of nodes to
+					  edges, and nodes to their outgoing/incident edges), so that no search
+					  over the lists of nodes and edges is needed. The functions that
+					  received the lists of nodes and edges now receive the Graph instead
+					  (except for getKRoutes and getKRoutesNetFile, whose interface was kept).
+					  Ties are broken as before (in favour of the node declared first), so
+					  the paths found are the same as in previous versions.
+v1.51 (18-Oct-2026) - OD pairs with the same origin can share the shortest path trees of
+					  the origin (see KShortestPaths and the new function 
+					  getKRoutesFromOrigin), which are used to find their first paths and
+					  the spur paths from the origin. Trees are indexed by the set of 
+					  ignored edges, since the spur paths from the origin only ignore the
+					  first edges of the previous paths. The run procedure shares the trees
+					  among consecutive OD pairs with the same origin.
+v1.52 (18-Oct-2026) - The potential shortest paths of Yen's algorithm (B) are kept in a heap
+					  ordered by cost (and by insertion order, to break ties as before), 
+					  along with the set of paths already added to it (so that repeated 
+					  paths are discarded on insertion), and the edges to be ignored by the
+					  shortest path searches are given as sets.
 <new versions here>
 
 '''
 
 import argparse
+import heapq
 from py_expression_eval import Parser
 
 # represents a node in the graph
@@ -160,119 +182,141 @@ def generateGraphFromList(listNodes, listEdges, generateBackwardEdges=False):
 	
 	return V, E
 
-# reset graph's variables to default
-def resetGraph(N, E):
-	for node in N:
-		node.dist = 1000000.0
-		node.prev = None
-		node.flag = 0
-
-# returns the smallest node in N but not in S
-def pickSmallestNode(N):
-	minNode = None
-	for node in N:
-		if node.flag == 0:
-			minNode = node
-			break
-	if minNode == None:
-		return minNode
-	for node in N:
-		if node.flag == 0 and node.dist < minNode.dist:
-			minNode = node
-	return minNode
+# index of the nodes and edges of a graph, built from the lists of nodes and 
+# edges (see generateGraph), so that nodes, edges and the edges of a node are 
+# retrieved in constant time (the lists of edges keep the order of E)
+class Graph:
+	def __init__(self, N, E):
+		self.nodes = N			# list of nodes
+		self.edges = E			# list of edges
+		self.node = {}			# name -> node
+		self.order = {}			# name -> position of the node in N (to break ties)
+		self.edge = {}			# (start, end) -> (first) edge from start to end
+		self.outEdges = {}		# name -> list of edges starting in the node
+		self.allEdges = {}		# name -> list of edges that start or end in the node
+		
+		for i, node in enumerate(N):
+			self.node[node.name] = node
+			self.order[node.name] = i
+			self.outEdges[node.name] = []
+			self.allEdges[node.name] = []
+		
+		for edge in E:
+			if (edge.start, edge.end) not in self.edge:
+				self.edge[(edge.start, edge.end)] = edge
+			self.outEdges[edge.start].append(edge)
+			self.allEdges[edge.start].append(edge)
+			if edge.end != edge.start:
+				self.allEdges[edge.end].append(edge)
 
 # returns the list of edges starting in node u
-def pickEdgesList(u, E):
-	uv = []
-	for edge in E:
-		if edge.start == u.name:
-			uv.append(edge)
-	return uv
+def pickEdgesList(u, G):
+	return G.outEdges[u.name]
 
 # returns the list of edges that start or end in node u
-def pickEdgesListAll(u, E):
-	uv = []
-	for edge in E:
-		if edge.start == u.name or edge.end == u.name:
-			uv.append(edge)
-	return uv
+def pickEdgesListAll(u, G):
+	return G.allEdges[u.name]
 
-# Dijkstra's shortest path algorithm
-def findShortestPath(N, E, origin, destination, ignoredEdges):
+# Dijkstra's shortest path algorithm (the nodes are kept in a binary heap, 
+# whose ties are broken in favour of the node that comes first in G.nodes); 
+# the search stops when destination is reached or, if no destination is 
+# given, when the complete shortest path tree of origin is built; returns 
+# the previous node of each node reached (the paths to the nodes processed
+# before stopping are the same whether the search stops or not)
+def shortestPathTree(G, origin, ignoredEdges, destination=None):
 	
-	# reset the graph (so as to discard information from previous runs)
-	resetGraph(N, E)
+	# distance to each (reached) node from the origin, and its previous node
+	dist = {origin: 0}
+	prev = {}
+	visited = set()
 	
-	# set origin node distance to zero, and get destination node
-	dest = None
-	for node in N:
-		if node.name == origin:
-			node.dist = 0
-		if node.name == destination:
-			dest = node
-	
-	u = pickSmallestNode(N)
-	while u != None:
-		u.flag = 1
-		uv = pickEdgesList(u, E)
-		n = None
-		for edge in uv:
+	heap = [(0, G.order[origin], origin)]
+	while heap:
+		d, _, u = heapq.heappop(heap)
+		
+		# an entry is added every time the node's distance is improved, 
+		# thus only the first one (the smallest) must be processed
+		if u in visited:
+			continue
+		
+		# stop when destination is reached
+		if u == destination:
+			break
+		
+		visited.add(u)
+		for edge in G.outEdges[u]:
 			
 			# avoid ignored edges
 			if edge in ignoredEdges:
 				continue
 			
-			# take the node n
-			for node in N:
-				if node.name == edge.end:
-					n = node
-					break
-			if n.dist > u.dist + edge.cost:
-				n.dist = u.dist + edge.cost
-				n.prev = u
-		
-		u = pickSmallestNode(N)
-		# stop when destination is reached
-		if u == dest:
-			break
+			n = edge.end
+			if dist.get(n, 1000000.0) > d + edge.cost:
+				dist[n] = d + edge.cost
+				prev[n] = u
+				heapq.heappush(heap, (dist[n], G.order[n], n))
 	
-	# generate the final path
+	return prev
+
+# generate the path to destination from a shortest path tree (see 
+# shortestPathTree); if destination was not reached, the path is [destination]
+def pathFromTree(G, prev, destination):
 	S = []
-	u = dest
-	while u.prev != None:
-		S.insert(0,u)
-		u = u.prev
-	S.insert(0,u)
+	u = destination
+	while u in prev:
+		S.append(G.node[u])
+		u = prev[u]
+	S.append(G.node[u])
+	S.reverse()
 	
 	return S
 
+# shortest path from origin to destination
+def findShortestPath(G, origin, destination, ignoredEdges):
+	return pathFromTree(G, shortestPathTree(G, origin, ignoredEdges, destination), destination)
+
+# shortest path from origin to destination using the shortest path trees in
+# trees (a dictionary from sets of ignored edges to shortest path trees of 
+# origin), which is updated with the tree built if none matches; since the 
+# paths from origin only ignore the first edges of previous paths (see 
+# runKShortestPathsStep), the same trees serve many OD pairs with that origin
+def findShortestPathFromTrees(G, trees, origin, destination, ignoredEdges):
+	key = frozenset(ignoredEdges)
+	if key not in trees:
+		trees[key] = shortestPathTree(G, origin, ignoredEdges)
+	return pathFromTree(G, trees[key], destination)
+
 # generate a string from the path S in a specific format
-def pathToString(S, E):
+def pathToString(S, G):
 	strout = '['
 	for i in xrange(0,len(S)-1):
 		if i > 0:
 			strout += ', '
-		strout += '\'' + getEdge(E, S[i].name, S[i+1].name).name + '\''
+		strout += '\'' + getEdge(G, S[i].name, S[i+1].name).name + '\''
 	return strout + ']'
 
 # generate a list with the edges' names of a given route S
-def pathToListOfString(S, E):
+def pathToListOfString(S, G):
 	lout = []
 	for i in xrange(0,len(S)-1):
-		lout.append(getEdge(E, S[i].name, S[i+1].name).name)
+		lout.append(getEdge(G, S[i].name, S[i+1].name).name)
 	return lout
 
 # get the directed edge from u to v
-def getEdge(E, u, v):
-	for edge in E:
-		if edge.start == u and edge.end == v:
-			return edge
-	return None
+def getEdge(G, u, v):
+	return G.edge.get((u, v))
 
-def runKShortestPathsStep(V, E, origin, destination, k, A, B):
+# (B is a heap of potential shortest paths, in the form (cost, insertion order,
+# path), and seen is the set of paths ever added to B, as tuples of nodes' 
+# names; if trees is given, the paths from origin are found with 
+# findShortestPathFromTrees)
+def runKShortestPathsStep(G, origin, destination, k, A, B, seen, trees=None):
 	# Step 0: iteration 1
 	if k == 1:
-		A.append(findShortestPath(V, E, origin, destination, []))
+		if trees is not None:
+			A.append(findShortestPathFromTrees(G, trees, origin, destination, set()))
+		else:
+			A.append(findShortestPath(G, origin, destination, set()))
 		
 	# Step I: iterations 2 to K
 	else:
@@ -281,57 +325,59 @@ def runKShortestPathsStep(V, E, origin, destination, k, A, B):
 			# Step I(a)
 			spurNode = lastPath[i]
 			rootPath = lastPath[0:i+1]
-			toIgnore = []
+			toIgnore = set()
 			
 			for path in A:
 				if path[0:i+1] == rootPath:
-					ed = getEdge(E, spurNode.name, path[i+1].name)
-					toIgnore.append(ed)
+					ed = getEdge(G, spurNode.name, path[i+1].name)
+					toIgnore.add(ed)
 			
 			# ignore the edges passing through nodes already in rootPath (except for the spurNode)
 			for noder in rootPath[:-1]: 
-				edgesn = pickEdgesListAll(noder, E)
-				for ee in edgesn:
-					toIgnore.append(ee)
+				toIgnore.update(pickEdgesListAll(noder, G))
 			
 			# Step I(b)
-			spurPath = findShortestPath(V, E, spurNode.name, destination, toIgnore)
+			if i == 0 and trees is not None:
+				spurPath = findShortestPathFromTrees(G, trees, origin, destination, toIgnore)
+			else:
+				spurPath = findShortestPath(G, spurNode.name, destination, toIgnore)
 			if spurPath[0] != spurNode:
 				continue
 			
 			# Step I(c)
 			totalPath = rootPath + spurPath[1:]
-			B.append(totalPath)
+			
+			# a path already found is not added again (among paths with 
+			# the same cost, the one added first is chosen in Step II)
+			key = tuple([ node.name for node in totalPath ])
+			if key in seen:
+				continue
+			heapq.heappush(B, (calcPathCost(totalPath, G), len(seen), totalPath))
+			seen.add(key)
 		
 		# handle the case where no spurs (new paths) are available
 		if not B:
 			return False
 			
 		# Step II
-		bestInB = None
-		bestInBcost = 999999999
-		for path in B:
-			cost = calcPathCost(path, E)
-			if cost < bestInBcost:
-				bestInBcost = cost
-				bestInB = path
-		A.append(bestInB)
-		while bestInB in B:
-			B.remove(bestInB)
+		A.append(heapq.heappop(B)[2])
 		
 	return True
 
-# Yen's K shortest loopless paths algorithm
-def KShortestPaths(V, E, origin, destination, K):
+# Yen's K shortest loopless paths algorithm (trees is an optional dictionary of 
+# shortest path trees of origin, to be shared among OD pairs with the same 
+# origin; see findShortestPathFromTrees)
+def KShortestPaths(G, origin, destination, K, trees=None):
 	# the K shortest paths
 	A = []
 	
-	# potential shortest paths
+	# potential shortest paths (heap), and the set of paths already added to it
 	B = []
+	seen = set()
 	
 	for k in xrange(1,K+1):
 		try:
-			if not runKShortestPathsStep(V, E, origin, destination, k, A, B):
+			if not runKShortestPathsStep(G, origin, destination, k, A, B, seen, trees):
 				break
 		except:
 			print 'Problem on generating more paths! Only %d paths were found!' % (k-1)
@@ -340,12 +386,12 @@ def KShortestPaths(V, E, origin, destination, K):
 	return A
 
 # calculate path S's cost
-def calcPathCost(S, E):
+def calcPathCost(S, G):
 	cost = 0
 	prev = None
 	for node in S:
 		if prev != None:
-			cost += getEdge(E, prev.name, node.name).cost
+			cost += getEdge(G, prev.name, node.name).cost
 		prev = node
 	
 	return cost
@@ -355,6 +401,7 @@ def run(graph_file, K, OD_pairs=None, flow=0.0):
 	
 	# read graph from file
 	N, E, OD = generateGraph(graph_file, flow)
+	G = Graph(N, E)
 	
 	# process the list of OD-pairs (if no OD pair was defined by the 
 	# user, then all OD pairs from the network file are considered)
@@ -366,9 +413,15 @@ def run(graph_file, K, OD_pairs=None, flow=0.0):
 	# find K shortest paths of each OD-pair
 	print 'ksptable = ['
 	lastod = len(OD)-1
+	trees = {}
 	for iod, (o, d) in enumerate(OD):
+		# the shortest path trees are shared among consecutive OD-pairs
+		# with the same origin
+		if iod > 0 and o != OD[iod-1][0]:
+			trees = {}
+		
 		# find K shortest paths for this specific OD-pair
-		S = KShortestPaths(N, E, o, d, K)
+		S = KShortestPaths(G, o, d, K, trees)
 		
 		# print the result for this specific OD-pair
 		print '\t[ # ' + str(o) + '|' + str(d) + ' flow'
@@ -377,7 +430,7 @@ def run(graph_file, K, OD_pairs=None, flow=0.0):
 			comma = ','
 			if i == last:
 				comma = ''
-			print '\t\t' + pathToString(path, E) + comma + " # cost " + str(calcPathCost(path, E))
+			print '\t\t' + pathToString(path, G) + comma + " # cost " + str(calcPathCost(path, G))
 		comma = ','
 		if iod == lastod:
 			comma = ''
@@ -393,35 +446,53 @@ def getKRoutesNetFile(graph_file, origin, destination, K):
 	
 	# read graph from file
 	N, E, _ = generateGraph(graph_file)
+	G = Graph(N, E)
 	
 	# find K shortest paths for this specific OD-pair
-	S = KShortestPaths(N, E, origin, destination, K)
+	S = KShortestPaths(G, origin, destination, K)
 	
 	for path in S:
 		# store the path (in list of strings format) and cost to the out list 
-		lout.append([pathToListOfString(path, E), calcPathCost(path, E)])
+		lout.append([pathToListOfString(path, G), calcPathCost(path, G)])
 		
 	return lout
 
 # return a list with the K shortest paths for the given origin-destination pair,
 # given the lists of nodes and edges (this function was created to be called 
-# externally by another applications)
-def getKRoutes(N, E, origin, destination, K):
+# externally by another applications); when routes are generated for many OD 
+# pairs, the Graph of N and E should be built once and given as G (and the 
+# shortest path trees of origin may be shared as well; see KShortestPaths)
+def getKRoutes(N, E, origin, destination, K, G=None, trees=None):
 	
 	lout = []
 	
+	if G is None:
+		G = Graph(N, E)
+	
 	# find K shortest paths for this specific OD-pair
-	S = KShortestPaths(N, E, origin, destination, K)
+	S = KShortestPaths(G, origin, destination, K, trees)
 	
 	for path in S:
 		# store the path (in list of strings format) and cost to the out list 
-		lout.append([pathToListOfString(path, E), calcPathCost(path, E)])
+		lout.append([pathToListOfString(path, G), calcPathCost(path, G)])
 		
 	return lout
 	
+# return, for each of the given destinations, the list with the K shortest 
+# paths from the given origin (see getKRoutes), where the shortest path trees 
+# of origin are shared among all destinations
+def getKRoutesFromOrigin(N, E, origin, destinations, K, G=None):
+	
+	if G is None:
+		G = Graph(N, E)
+	
+	trees = {}
+	
+	return [ getKRoutes(N, E, origin, destination, K, G, trees) for destination in destinations ]
+	
 # initializing procedure
 if __name__ == '__main__':
-	parser = argparse.ArgumentParser(description='KSP v1.42\nCompute the K shortest loopless paths between two nodes of a given graph, using Yen\'s algorithm [1]. Complete instructions available at [2].',
+	parser = argparse.ArgumentParser(description='KSP v1.52\nCompute the K shortest loopless paths between two nodes of a given graph, using Yen\'s algorithm [1]. Complete instructions available at [2].',
 		epilog='GRAPH FILE FORMATTING INSTRUCTIONS' +
 		'\nSee [3] for complete instructions.'+
 		'\n\nREFERENCES' +
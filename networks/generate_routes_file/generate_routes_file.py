@@ -1,40 +1,90 @@
 import KSP # KSP algorithm
 from tqdm import tqdm # loading bar
 import argparse # arguments
+import multiprocessing # parallel generation of routes
+import itertools
 
-def generate_routes_file(net_file, k, flow):
+# graph used to generate the routes (it is defined before the worker processes
+# are created, so that they share it instead of receiving a copy of it)
+graph = None
+
+# run the algorithm for the given origin and its destinations (return, for
+# each destination, the K routes and associated costs of the corresponding
+# origin-destination pair)
+def get_routes(task):
+	origin, destinations, k = task
+	V, E, G = graph
+	return KSP.getKRoutesFromOrigin(V, E, origin, destinations, k, G)
+
+def generate_routes_file(net_file, k, flow, processes=1):
+	global graph
 
 	# generate the list of vertices and edges from the network file
 	V, E, OD = KSP.generateGraph(net_file, flow)
+	graph = (V, E, KSP.Graph(V, E))
 
 	# create the routes file
 	arq = open(net_file.replace('.net','.routes'), 'w')
 	arq.write('#OD route\n')
 
-	# for each OD pair
-	for od in tqdm(OD, ascii=True, desc='Generating routes (k=%d, |OD|=%d)' % (k, len(OD))): # to look at all pairs, use the variable OD (above)
-
-		#~ print 'Pair %s' % od
-		origin, destination = od.split('|')
-		
-		# run the algorithm (return the K routes and associated costs of the given origin-destination pair)
-		routes = KSP.getKRoutes(V, E, origin, destination, k)
-		
-		# print the routes
-		for i in routes:
-			
-			# the route as a list of strings, where each element corresponds to a link's name
-			route = i[0]
-			
-			# the cost of the route (a float value)
-			cost = i[1]
-			
-			# add the current route to the file
-			arq.write('%s %s\n' % (od, str(route).replace('[','').replace(']','').replace('\'','').replace(' ','')))
-
-		arq.flush()
-
-	arq.close()
+	# consecutive OD pairs with the same origin are grouped (so that they 
+	# share the shortest path trees of the origin; see KSP.KShortestPaths)
+	tasks = []
+	for origin, ods in itertools.groupby(OD, lambda od: od.split('|')[0]):
+		tasks.append((origin, [ od.split('|')[1] for od in ods ], k))
+
+	# the groups are independent, thus their routes can be generated
+	# in parallel (the results are received in the order of OD)
+	if processes <= 0:
+		processes = multiprocessing.cpu_count()
+	pool = None
+	if processes > 1:
+		pool = multiprocessing.Pool(processes)
+		results = pool.imap(get_routes, tasks, chunksize=max(1, min(16, len(tasks) // (processes * 16))))
+	else:
+		results = itertools.imap(get_routes, tasks)
+
+	try:
+
+		progress = tqdm(total=len(OD), ascii=True, desc='Generating routes (k=%d, |OD|=%d)' % (k, len(OD))) # to look at all pairs, use the variable OD (above)
+
+		# for each origin
+		for (origin, destinations, _), routes_od in itertools.izip(tasks, results):
+
+			# for each OD pair
+			for destination, routes in zip(destinations, routes_od):
+
+				od = '%s|%s' % (origin, destination)
+
+				# print the routes
+				for i in routes:
+
+					# the route as a list of strings, where each element corresponds to a link's name
+					route = i[0]
+
+					# the cost of the route (a float value)
+					cost = i[1]
+
+					# add the current route to the file
+					arq.write('%s %s\n' % (od, str(route).replace('[','').replace(']','').replace('\'','').replace(' ','')))
+
+			arq.flush()
+			progress.update(len(destinations))
+
+		progress.close()
+
+		if pool is not None:
+			pool.close()
+
+	except:
+		if pool is not None:
+			pool.terminate()
+		raise
+
+	finally:
+		if pool is not None:
+			pool.join()
+		arq.close()
 
 if __name__ == '__main__':
     
@@ -51,6 +101,8 @@ if __name__ == '__main__':
                         help='the number of routes to find (as for the Braess networks, we used k=100)')
     parser.add_argument('--flow', dest='flow', default=0.0, type=float, 
                         help='the flow of vehicles to be used when computing the links\' costs (as for the Braess networks, we used flow=1.0 to differentiate routes with fixed and non-fixed costs)')
+    parser.add_argument('--jobs', dest='jobs', default=1, type=int,
+                        help='the number of processes used to generate the routes (0 means one per core); OD pairs are distributed among the processes, but the routes file is written in the order of OD pairs')
     args = parser.parse_args()
     
-    generate_routes_file(net_file=args.net_file, k=args.k, flow=args.flow)
+    generate_routes_file(net_file=args.net_file, k=args.k, flow=args.flow, processes=args.jobs)
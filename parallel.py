@@ -0,0 +1,65 @@
+import sys
+import random
+import traceback
+import multiprocessing
+import numpy as np
+
+# run a list of jobs on a pool of processes, returning (as a generator) their
+# results in the same order of the list, where each job is a tuple
+# (function, args, log_file_name), such that function(*args) is called with
+# its standard output written to log_file_name; parameters:
+# * jobs: list of jobs
+# * processes: number of processes to use (if <= 0, all cores are used);
+#   with a single process, the jobs are run (in order) by the current process
+# NOTES:
+# * functions must be defined at module level (so that they can be pickled)
+# * since the processes are forked from the current one, each job has its
+#   random generators (numpy's and python's) re-seeded with a seed drawn
+#   (in order) from numpy's generator; in this way, the results do not
+#   depend on the number of processes, and a seed set before calling this
+#   function makes the whole set of jobs reproducible
+def run_jobs(jobs, processes=1):
+
+	if processes <= 0:
+		processes = multiprocessing.cpu_count()
+	processes = min(processes, len(jobs))
+
+	# define the seed of each job
+	jobs = [ (function, args, log_file_name, seed) for (function, args, log_file_name), seed in zip(jobs, np.random.randint(0, 2**31 - 1, size=len(jobs))) ]
+
+	if processes <= 1:
+		for job in jobs:
+			yield run_job(job)
+
+	else:
+		pool = multiprocessing.Pool(processes)
+		try:
+			for result in pool.imap(run_job, jobs):
+				yield result
+			pool.close()
+		except:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+
+# run a single job (see run_jobs), with its standard output redirected to
+# its log file only while the job is running
+def run_job(job):
+	function, args, log_file_name, seed = job
+
+	np.random.seed(seed)
+	random.seed(seed)
+
+	log_file = open(log_file_name, 'w')
+	stdout = sys.stdout
+	sys.stdout = log_file
+	try:
+		return function(*args)
+	except:
+		# print the exception on the job's log before raising it
+		traceback.print_exc(file=log_file)
+		raise
+	finally:
+		sys.stdout = stdout
+		log_file.close()
@@ -1,5 +1,13 @@
-from py_expression_eval import Parser
-from sympy import diff, symbols
+from py_expression_eval import Parser, TNUMBER, TVAR, TOP1, TOP2
+import numpy as np
+from scipy.sparse import csr_matrix
+import cPickle as pickle
+import math
+import copy
+import zipfile
+import re
+import os
+from misc import write_atomically
 
 #=======================================================================
 
@@ -9,12 +17,26 @@ class ProblemInstance:
 		
 		self.__N = {}
 		self.__L = {}
-		self.__routes = {}
+		self.__links_order = [] # the links' names, in order of creation (used to index links' arrays)
+		self.__routes = {} # the range of routes' indices of each OD pair (see get_routes_order)
+		self.__routes_objects = {} # the routes already created (see get_route)
+		self.__incidence_matrix_T = None # the transposed incidence matrix (see __create_routes)
 		self.__normalisation_factor_routes = float('-inf')
 		
-		self.__create_graph(network_name)
+		# read the network and its routes (from the binary cache 
+		# whenever possible; see load_network_files)
+		routes_file_name = 'networks/%s.routes' % network_name
+		if alt_route_file_name != None:
+			routes_file_name = alt_route_file_name # useful when an alternative route files must be used 
+		network = load_network_files('networks/%s.net' % network_name, routes_file_name)
+		
+		self.__create_graph(network)
 		
-		self.__create_routes(network_name, routes_per_OD, alt_route_file_name)
+		# store the values derived from the cost functions that were not 
+		# cached yet (see get_cached)
+		store_cached()
+		
+		self.__create_routes(network_name, network, routes_per_OD)
 		
 		# reset the graph
 		# this is necessary because, in order to compute the routes' 
@@ -25,13 +47,16 @@ class ProblemInstance:
 		# (it cannot be performed earlier because the graph
 		# must be empty; but it was not, since the links are
 		# created with maximum flow)
-		for od in self.get_OD_pairs():
-			for r in self.get_routes(od):
-				r.set_free_flow_travel_time(r.get_cost(False), r.get_cost(True))
+		routes = self.__routes_state
+		invalid = np.flatnonzero(routes.normalised_cost > 1)
+		if len(invalid):
+			self.__get_route(invalid[0]).get_cost(True) # raises the exception
+		routes.free_flow_travel_time[:] = routes.cost
+		routes.free_flow_travel_time_normalised[:] = routes.normalised_cost
 		
 	def get_route_set_size(self, od=None):
 		if od:
-			return len(self.get_routes(od))
+			return len(self.__routes[od])
 		else:
 			return len(self.__routes[self.get_OD_pairs()[0]])
 	
@@ -55,206 +80,251 @@ class ProblemInstance:
 		return self.__OD_matrix.get_OD_pairs()
 	
 	def get_routes_ids(self, od_pair):
-		return range(len(self.get_routes(od_pair)))
+		return range(len(self.__routes[od_pair]))
 	
 	def get_routes(self, od_pair=None):
-		return self.__routes[od_pair]
+		return [ self.__get_route(i) for i in self.__routes[od_pair] ]
 	
 	def get_route(self, od_pair, index):
-		return self.__routes[od_pair][index]
+		return self.__get_route(self.__routes[od_pair][index])
+	
+	# the indices of the routes of the OD pair (see get_routes_order)
+	def get_routes_indices(self, od_pair):
+		return self.__routes[od_pair]
+	
+	# the route of the given index (see get_routes_order); routes are only 
+	# created when requested for the first time (since their links are 
+	# stored in the arrays of the problem instance, see get_route_links_ids)
+	def __get_route(self, index):
+		if index not in self.__routes_objects:
+			self.__routes_objects[index] = Route(self, self.__routes_state, index)
+		return self.__routes_objects[index]
 	
 	def get_link(self, link_name):
 		return self.__L[link_name]
 	
+	def get_links_order(self):
+		return self.__links_order
+	
+	# the routes of all OD pairs (in order of OD pair)
+	def get_routes_order(self):
+		return [ self.__get_route(i) for i in xrange(self.get_number_of_routes()) ]
+	
+	# the number of routes of all OD pairs
+	def get_number_of_routes(self):
+		return len(self.__routes_links_offsets) - 1
+	
+	# the links' ids (see get_links_order) of the route with the given index 
+	# (see get_routes_order), where the links of all routes are stored in a 
+	# single (possibly memory-mapped) array
+	def get_route_links_ids(self, index):
+		return self.__routes_links[self.__routes_links_offsets[index]:self.__routes_links_offsets[index+1]]
+	
+	# the flows of all links (ordered as in get_links_order)
+	def get_links_flows(self):
+		return self.__links_state.flow
+
+	# the costs of all links (ordered as in get_links_order)
+	def get_links_costs(self, normalise=False):
+		if normalise:
+			return self.__links_state.normalised_cost
+		else:
+			return self.__links_state.cost
+
+	# the costs of all routes (ordered as in get_routes_order)
+	def get_routes_costs(self, normalise=False):
+		if normalise:
+			return self.__routes_state.normalised_cost
+		else:
+			return self.__routes_state.cost
+	
+	# the weighted marginal costs of all routes (ordered as in get_routes_order)
+	def get_routes_weighted_marginal_costs(self, normalise=False):
+		if normalise:
+			return self.__routes_state.normalised_weighted_marginal_cost
+		else:
+			return self.__routes_state.weighted_marginal_cost
+	
+	# the free flow travel times of all routes (ordered as in get_routes_order)
+	def get_routes_free_flow_travel_times(self, normalise=False):
+		if normalise:
+			return self.__routes_state.free_flow_travel_time_normalised
+		else:
+			return self.__routes_state.free_flow_travel_time
+	
+	# the (sparse) route-link incidence matrix, whose rows and columns
+	# follow the order of get_routes_order and get_links_order
+	def get_incidence_matrix(self):
+		return self.__incidence_matrix
+	
+	# compute the cost and the cost's first derivative of every link given 
+	# an array of flows (ordered as in get_links_order), in a single call; 
+	# if the aggregate time flexibility of each link is given, then the 
+	# marginal costs (i.e., time flexibility * derivative) are returned 
+	# instead of the derivatives (as in Link.add_flow); if the ids of some 
+	# links are given, then only the values of these links are computed 
+	# (and returned, in the same order of links)
+	def evaluate_links_costs(self, flows, sum_time_flexibility=None, links=None):
+		flows = np.asarray(flows, dtype=float)
+		costs = np.zeros(len(self.__links_order))
+		marginal_costs = np.zeros(len(self.__links_order))
+		evaluated = np.ones(len(self.__links_order), dtype=bool)
+		if links is not None:
+			evaluated[:] = False
+			evaluated[links] = True
+		for function, ids, constants in self.__links_functions:
+			k = evaluated[ids]
+			if k.all():
+				costs[ids], marginal_costs[ids] = function.evaluate(flows[ids], constants)
+			elif k.any():
+				costs[ids[k]], marginal_costs[ids[k]] = function.evaluate(flows[ids[k]], constants[:, k])
+		
+		# handle the links whose marginal cost cannot be evaluated
+		invalid = evaluated & ~np.isfinite(marginal_costs)
+		if invalid.any():
+			if (flows[invalid] != 0.0).any():
+				i = np.flatnonzero(invalid & (flows != 0.0))[0]
+				raise Exception('Error on evaluating marginal cost of link %s with flow %f!' % (self.__links_order[i], flows[i]))
+			marginal_costs[invalid] = 0.0
+		
+		if links is not None:
+			costs = costs[links]
+			marginal_costs = marginal_costs[links]
+			if sum_time_flexibility is not None:
+				sum_time_flexibility = np.asarray(sum_time_flexibility)[links]
+		
+		if sum_time_flexibility is not None:
+			marginal_costs *= sum_time_flexibility
+		
+		return costs, marginal_costs
+	
 	def get_total_flow(self):
 		return self.__OD_matrix.get_total_flow()	
 
 	def get_normalisation_factor_routes(self):
 		return self.__normalisation_factor_routes
 	
-	# read the graph from a file
-	def __create_graph(self, network_name):
+	# create the graph from the arrays of the network (see parse_network_files)
+	def __create_graph(self, network):
 		
-		OD_entries = []
-		for line in open('networks/%s.net' % network_name, 'r'):
-			
-			# ignore \n
-			line = line.rstrip()
-			
-			# ignore comments
-			hash_pos = line.find('#')
-			if hash_pos > -1:
-				line = line[:hash_pos]
-			
-			# split the line
-			taglist = line.split()
-			if len(taglist) == 0:
-				continue
-			
-			if taglist[0] == 'od':
-				
-				# if no flow is set for the OD pair, then 
-				# it is not created (just to avoid problems
-				# when computing OD-related statistics)
-				if float(taglist[4]) > 0:
-					
-					OD_entries.append(taglist)
-					
-					# the set of routes is initialised (with the keys) here, 
-					# but populated only in __create_routes
-					self.__routes[taglist[1]] = []
-		
-		# create the OD matrix
+		# create the OD matrix; the set of routes is initialised (with 
+		# the keys) here, but populated only in __create_routes
+		OD_entries = zip(network['od_names'].tolist(), network['od_flows'].tolist())
 		self.__OD_matrix = ODMatrix(OD_entries)
-		total_flow = self.__OD_matrix.get_total_flow()
+		for od, _ in OD_entries:
+			self.__routes[od] = xrange(0)
 		
-		F = {} # cost functions
-		normalisation_factor = float('-inf')
-		lineid = 0
-		for line in open('networks/%s.net' % network_name, 'r'):
-			
-			lineid += 1
-			
-			# ignore \n
-			line = line.rstrip()
-			
-			# ignore comments
-			hash_pos = line.find('#')
-			if hash_pos > -1:
-				line = line[:hash_pos]
-			
-			# split the line
-			taglist = line.split()
-			if len(taglist) == 0:
-				continue
-			
-			if taglist[0] == 'function':
-				
-				# process the params
-				params = taglist[2][1:-1].split(',')
-				if len(params) > 1:
-					raise Exception('Cost functions with more than one parameter are not yet acceptable! (parameters defined: %s)' % str(params)[1:-1])
-				
-				# process the function
-				expr = taglist[3]
-				function = Parser().parse(expr)
-
-				# compute the derivative of the function (for tolling)
-				expr_deriv = str(diff(expr, params[0])) #compute derivative
-				expr_deriv = expr_deriv.replace('**','^').replace(' ','') #convert syntax (from sympy to py_expression_eval)
-				function_deriv = Parser().parse(expr_deriv) #create the function
-				
-				# handle the case where the parameter is not in the formula
-				# (this needs to be handled because py-expression-eval does
-				# not allows simplifying all variables of an expression)
-				if taglist[1] not in function.variables():
-					expr = '%s+%s-%s' % (expr, params[0], params[0])
-					function = Parser().parse(expr)
-					expr_deriv = '%s+%s-%s' % (expr_deriv, params[0], params[0])
-					function_deriv = Parser().parse(expr_deriv)
-
-				# process the constants
-				constants = function.variables()
-				if params[0] in constants: # the parameter must be ignored
-					constants.remove(params[0])
-				
-				# store the function
-				F[taglist[1]] = [params[0], constants, expr, expr_deriv, None]
-			
-			elif taglist[0] == 'node':
-				self.__N[taglist[1]] = Node(taglist[1])
-			
-			elif taglist[0] == 'dedge' or taglist[0] == 'edge': # dedge is a directed edge
-				
-				# process the function
-				func_tuple = F[taglist[4]] # get the corresponding function
-				param_values = dict(zip(func_tuple[1], map(float, taglist[5:]))) # associate constants and values specified in the line (in order of occurrence)
-				function = Parser().parse(func_tuple[2]) # create the function
-				function = function.simplify(param_values) # replace constants
-
-				# compute the function's first derivative w.r.t. the parameter
-				function_deriv = Parser().parse(func_tuple[3])
-				function_deriv = function_deriv.simplify(param_values)
-				# check for zero division error, which shall happen when the parameter is a divisor (e.g., the BPR function)
-				# Note: this is just a warning, since in this case we just need to assume the marginal cost to be zero (as done later, at link's marginal cost evaluation)
-				try:
-					function_deriv.evaluate({func_tuple[0]: 0.0})
-				except ZeroDivisionError:
-					if func_tuple[4] == None:
-						# store a single warning message to avoid printing multiple ones
-						func_tuple[4] = '[WARNING] The derivative (%s) of function %s (%s) has a parameter as divisor!' % (func_tuple[3], taglist[4], func_tuple[2])
-				
-				# create the edge(s)
-				link_name = taglist[1]
-				self.__L[link_name] = Link(link_name, taglist[2], taglist[3], function, function_deriv, func_tuple[0])
-				if taglist[0] == 'edge':
-					link_name = '%s-%s'%(taglist[3], taglist[2])
-					self.__L[link_name] = Link(link_name, taglist[3], taglist[2], function, function_deriv, func_tuple[0])
-				
-				# store the greatest free flow time (used to normalise the links' costs)
-				v = function.evaluate({func_tuple[0]: total_flow})
-				if v > normalisation_factor:
-					normalisation_factor = v
-			
-			elif taglist[0] == 'od':
-				continue
-			
-			else:
-				raise Exception('Network file does not comply with the specification! (line %d: "%s")' % (lineid, line))
+		# create the nodes
+		for node in network['nodes'].tolist():
+			self.__N[node] = Node(node)
+		
+		# create the cost functions (compiled, so that links do not need 
+		# to walk the expression tree every time their cost is updated)
+		functions = []
+		constants_offsets = network['functions_constants_offsets']
+		for i, (name, param, expr, expr_deriv) in enumerate(zip(network['functions_names'].tolist(), network['functions_params'].tolist(), network['functions_exprs'].tolist(), network['functions_derivs'].tolist())):
+			constants = network['functions_constants'][constants_offsets[i]:constants_offsets[i+1]].tolist()
+			functions.append(CostFunction(name, param, constants, expr, expr_deriv))
+		
+		# the function of each name (as in the network file, a function 
+		# replaces any previously defined function with the same name)
+		F = dict([ (f.get_name(), i) for i, f in enumerate(functions) ])
 		
-		# print function warnings 
+		# create the links (as views on the arrays of the links' state)
+		links_functions = network['links_functions']
+		constants_offsets = network['links_constants_offsets']
+		self.__links_state = LinksState(len(links_functions))
+		for i, (link_name, origin, destination) in enumerate(zip(network['links_names'].tolist(), network['links_origins'].tolist(), network['links_destinations'].tolist())):
+			constants = network['links_constants'][constants_offsets[i]:constants_offsets[i+1]].tolist()
+			self.__L[link_name] = Link(link_name, origin, destination, functions[links_functions[i]], constants, self.__links_state, len(self.__links_order))
+			self.__links_order.append(link_name)
+		
+		# group the links by cost function, so that the costs of all 
+		# links can be evaluated at once (see evaluate_links_costs)
+		self.__links_functions = []
 		for func in F:
-			if F[func][4]:
-				print F[func][4]
-
-		# define the links' normalisation factor
-		for l in self.__L.values():
-			l.set_normalisation_factor(normalisation_factor)
-			
-			# set all links with maximum flow (used to calculate the 
-			# normalisation factor, in function __create_routes)
-			l.add_flow(self.get_total_flow())
+			ids = np.flatnonzero(links_functions == F[func])
+			if len(ids):
+				constants = network['links_constants'][constants_offsets[ids][:, None] + np.arange(len(functions[F[func]].get_constants()))]
+				self.__links_functions.append((functions[F[func]], ids, constants.T))
+		
+		# print function warnings (a single message per function) when the 
+		# derivative cannot be evaluated on empty links, which shall happen 
+		# when the parameter is a divisor (e.g., the BPR function)
+		# Note: this is just a warning, since in this case we just need to assume the marginal cost to be zero (as done later, at link's marginal cost evaluation)
+		for func in F:
+			for function, ids, constants in self.__links_functions:
+				if function is functions[F[func]] and not np.isfinite(function.evaluate(np.zeros(len(ids)), constants)[1]).all():
+					print '[WARNING] The derivative (%s) of function %s (%s) has a parameter as divisor!' % (function.get_derivative_expression(), func, function.get_expression())
 		
-	# read the set of routes from a file
-	def __create_routes(self, network_name, routes_per_OD=None, alt_route_file_name=None):
+		# store the costs of the empty links (used to reset them)
+		state = self.__links_state
+		state.free_flow_cost[:], state.free_flow_marginal_cost[:] = self.evaluate_links_costs(np.zeros(len(self.__links_order)))
 		
-		fname = 'networks/%s.routes' % network_name
-		if alt_route_file_name != None:
-			fname = alt_route_file_name # useful when an alternative route files must be used 
-		f = open(fname, 'r')
+		# set all links with maximum flow (used to calculate the 
+		# normalisation factor, in function __create_routes)
+		state.flow.fill(self.get_total_flow())
+		state.cost[:], state.marginal_cost[:] = self.evaluate_links_costs(state.flow, state.sum_time_flexibility)
+		
+		# define the links' normalisation factor (the greatest cost 
+		# with maximum flow)
+		normalisation_factor = float('-inf')
+		if len(state.cost) and state.cost.max() > normalisation_factor:
+			normalisation_factor = float(state.cost.max())
+		state.normalisation_factor.fill(normalisation_factor)
+		state.update_normalised_costs()
+		
+	# create the set of routes from the arrays of the network (see 
+	# parse_network_files), where up to routes_per_OD routes are used 
+	# for each OD pair
+	def __create_routes(self, network_name, network, routes_per_OD=None):
 		
 		self.__normalisation_factor_routes = float('-inf')
 		
-		for line in f:
-			
-			# ignore \n
-			line = line.rstrip()
-			
-			# ignore comments
-			hash_pos = line.find('#')
-			if hash_pos > -1:
-				line = line[:hash_pos]
-			
-			# split the line
-			spl = line.split()
-			if len(spl) == 0:
-				continue
-			
-			od = spl[0]
-			
-			# if the OD pair is not in the dictionary, it
-			# means that it is invalid (e.g. zero flow)
-			if od not in self.__routes:
-				continue #self.__routes[od] = []
-			
-			# add the route to the list (up to routes_per_OD routes 
-			# are stored for each OD pair) 
-			if routes_per_OD <= 0 or len(self.__routes[od]) < routes_per_OD:
-				route = Route(spl[1], self)
-				self.__routes[od].append(route)
-				
-				if route.get_cost(False) > self.__normalisation_factor_routes:
-					self.__normalisation_factor_routes = route.get_cost(False)
+		# select the routes of each OD pair
+		routes_ids = dict([ (od, []) for od in self.__routes ])
+		for i, od in enumerate(network['routes_ods'].tolist()):
+			if routes_per_OD <= 0 or len(routes_ids[od]) < routes_per_OD:
+				routes_ids[od].append(i)
+		
+		# the routes are indexed (in the arrays of the routes' state and 
+		# in the incidence matrix) following the order of the OD pairs
+		selected = []
+		self.__OD_routes_offsets = [0] # the index of the first route of each OD pair (and the number of routes, at the end)
+		for od in self.get_OD_pairs():
+			self.__routes[od] = xrange(len(selected), len(selected) + len(routes_ids[od]))
+			selected.extend(routes_ids[od])
+			self.__OD_routes_offsets.append(len(selected))
+		self.__routes_state = RoutesState(len(selected))
+		
+		# create the (sparse) route-link incidence matrix, where A[r,l] is 1 
+		# if route r traverses link l (the links of each row are stored in 
+		# the same order of the route, so that A.dot sums the links' values 
+		# in the same order as if the route was traversed); when all routes 
+		# of the network are used (in the same order), the network's array 
+		# of links is used without a copy
+		links_ids = network['routes_links']
+		offsets = network['routes_links_offsets']
+		A = csr_matrix((np.ones(len(links_ids)), links_ids, offsets), shape=(len(offsets) - 1, len(self.__links_order)))
+		if selected != range(len(offsets) - 1):
+			A = select_rows(A, selected)
+		self.__incidence_matrix = A
+		
+		# the transposed incidence matrix (where the routes of each link can 
+		# be selected, see evaluate_assignment), which is computed here, so 
+		# that it is shared by all clones of the problem instance
+		self.__incidence_matrix_T = A.T.tocsr()
+		
+		# store the links of the routes (the links of the i-th route are 
+		# in positions offsets[i] to offsets[i+1] of the array of links)
+		self.__routes_links = A.indices
+		self.__routes_links_offsets = A.indptr
+		
+		# compute the routes' costs (with links at maximum flow)
+		self.__update_routes_costs()
+		costs = self.__routes_state.cost
+		if len(costs) and costs.max() > self.__normalisation_factor_routes:
+			self.__normalisation_factor_routes = float(costs.max())
 		
 		#TODO find a better way of defining this value (OW 0.45, SF 0.05)
 		# I believe this is a topology-demand-based question.
@@ -264,61 +334,175 @@ class ProblemInstance:
 			self.__normalisation_factor_routes *= 0.1
 		
 		# set the normalisation factor on the routes
-		for od in self.get_OD_pairs():
-			for r in self.get_routes(od):
-				r.set_normalisation_factor(self.__normalisation_factor_routes)
+		self.__routes_state.normalisation_factor.fill(self.__normalisation_factor_routes)
+		self.__routes_state.update_normalised_costs()
+	
+	# update the costs of all routes from the current costs of the links
+	# (if the indices of some routes are given, only these are updated)
+	def __update_routes_costs(self, routes_ids=None):
+		links = self.__links_state
+		routes = self.__routes_state
 		
-		f.close()
+		# the marginal costs of links are normalised whenever 
+		# possible (as in Link.get_marginal_cost)
+		marginal_costs = np.where(links.normalisation_factor != 0.0, links.normalised_marginal_cost, links.marginal_cost)
 		
+		# when many routes are affected, it is cheaper to update all of 
+		# them (each route's cost is the same either way)
+		if routes_ids is not None and len(routes_ids) > len(routes.cost) // 4:
+			routes_ids = None
+		
+		if routes_ids is None:
+			routes.cost[:] = self.__incidence_matrix.dot(links.cost)
+			routes.weighted_marginal_cost[:] = self.__incidence_matrix.dot(marginal_costs)
+		else:
+			A = select_rows(self.__incidence_matrix, routes_ids)
+			routes.cost[routes_ids] = A.dot(links.cost)
+			routes.weighted_marginal_cost[routes_ids] = A.dot(marginal_costs)
+		routes.update_normalised_costs()
+	
 	# reset the graph non-fixed attributes (e.g., flow on each link)
 	def reset_graph(self):
 		# reset the flow and costs on links
-		for l in self.__L:
-			self.__L[l].reset()
+		self.__links_state.reset()
 		
 		# reset the costs on routes
-		for od in self.get_OD_pairs():
-			for r in self.get_routes(od):
-				r.update_cost()
+		self.__update_routes_costs()
+		
+		# there is no previous assignment (see evaluate_assignment)
+		self.__last_assignment = None
+	
+	# reset the non-fixed attributes of the problem instance (e.g., the flow 
+	# and costs of links and routes), which returns to the state it had when
+	# created, so that it can be reused (e.g., on multiple replications)
+	def reset_state(self):
+		self.reset_graph()
+	
+	# return a copy of the problem instance, in the state it had when created;
+	# the copy shares the fixed attributes (nodes, cost functions, OD matrix,
+	# incidence matrix, etc.) with this instance, and only the non-fixed ones 
+	# (stored in the links' and routes' states) are copied, so that it is 
+	# created much faster than by reading the network again
+	def clone(self):
+		P = copy.copy(self)
+		P.__links_state = copy.deepcopy(self.__links_state)
+		P.__routes_state = copy.deepcopy(self.__routes_state)
+		
+		# create the links (as views on the copied states); routes are 
+		# created on demand (see get_route)
+		P.__L = {}
+		for link_name, l in self.__L.iteritems():
+			P.__L[link_name] = Link(link_name, l.get_origin(), l.get_destination(), l.get_cost_function(), l.get_constants(), P.__links_state, l.get_index())
+		P.__routes_objects = {}
+		
+		P.reset_state()
+		
+		return P
 	
 	# evaluate the cost of a given assignment, where
-	# - solution is the assignment itself (i.e., flow of each OD-route pair)
-	# - solution_time_flexibility contains the aggregate time flexibility of agents (useful for tolling)
+	# - solution is the assignment itself (i.e., flow of each OD-route pair, as a list of lists, or of 
+	#   each route, as an array ordered as in get_routes_order)
+	# - solution_time_flexibility contains the aggregate time flexibility of agents (useful for tolling), 
+	#   in the same format of solution
 	# - check_consistency checks if the assignment is valid w.r.t. the total flow of the problem instance
-	def evaluate_assignment(self, solution, solution_time_flexibility, check_consistency=True):
+	# - incremental updates only the links (and routes) affected by the routes whose values changed since 
+	#   the previous assignment (if any, since the graph was reset), assuming the graph was not changed by 
+	#   other means (e.g., Link.add_flow) in the meantime; the results are exactly the same in both modes
+	def evaluate_assignment(self, solution, solution_time_flexibility, check_consistency=True, incremental=False):
+		
+		# the flow (and aggregated time flexibility) of each route, in the 
+		# same order of the rows of the incidence matrix (the time 
+		# flexibility is only considered on routes with some flow)
+		if isinstance(solution, np.ndarray):
+			routes_flow = np.array(solution, dtype=float)
+			routes_time_flexibility = np.array(solution_time_flexibility, dtype=float)
+		else:
+			routes_flow = np.array([ x for flows in solution for x in flows ], dtype=float)
+			routes_time_flexibility = np.array([ x for tfs in solution_time_flexibility for x in tfs ], dtype=float)
+		routes_time_flexibility[routes_flow <= 0.0] = 0.0
 		
-		# check if the solution is valid
+		# check if the solution is valid (the flows are summed per OD pair)
 		if check_consistency:
-			if sum([ sum(x) for x in solution ]) != self.get_total_flow():
-				print '[WARNING] The solution is not valid! (current flow %f differs from the expected one %f)' % (sum([ sum(x) for x in solution ]), self.get_total_flow())
+			if isinstance(solution, np.ndarray):
+				flows = routes_flow.tolist()
+				offsets = self.__OD_routes_offsets
+				solution_flow = sum([ sum(flows[offsets[i]:offsets[i+1]]) for i in xrange(len(offsets) - 1) ])
+			else:
+				solution_flow = sum([ sum(x) for x in solution ])
+			if solution_flow != self.get_total_flow():
+				print '[WARNING] The solution is not valid! (current flow %f differs from the expected one %f)' % (solution_flow, self.get_total_flow())
 		
-		self.reset_graph()
+		state = self.__links_state
+		
+		# find the routes whose values changed since the last assignment and 
+		# the links they traverse (when many links are affected, all of them 
+		# are updated, which is cheaper and gives the same values)
+		links = None
+		if incremental and self.__last_assignment is not None:
+			last_routes_flow, last_routes_time_flexibility = self.__last_assignment
+			changed = np.flatnonzero((routes_flow != last_routes_flow) | (routes_time_flexibility != last_routes_time_flexibility))
+			links = np.flatnonzero(mask(len(state.flow), select_rows(self.__incidence_matrix, changed).indices))
+			if len(links) > len(state.flow) // 4:
+				links = None
+		
+		if links is not None:
+			
+			# find the routes that traverse the affected links (i.e., whose 
+			# costs may have changed)
+			A = select_rows(self.__incidence_matrix_T, links)
+			routes = np.flatnonzero(mask(len(routes_flow), A.indices))
+			
+			# update the flow (and aggregated time flexibility) on the 
+			# affected links; the values are computed from scratch (rather 
+			# than by adding the differences), with the routes summed in 
+			# the same order as when all links are updated
+			state.flow[links] = A.dot(routes_flow)
+			state.sum_time_flexibility[links] = A.dot(routes_time_flexibility)
+			
+			# update the affected links' costs (those links with no flow 
+			# keep their free flow values)
+			costs, derivatives = self.evaluate_links_costs(state.flow, links=links)
+			loaded = state.flow[links] > 0.0
+			state.cost[links] = np.where(loaded, costs, state.free_flow_cost[links])
+			state.marginal_cost[links] = np.where(loaded, state.sum_time_flexibility[links] * derivatives, state.free_flow_marginal_cost[links])
+			state.update_normalised_costs()
+			
+			# update the affected routes' costs
+			self.__update_routes_costs(routes)
+			
+		else:
+			
+			# update the flow (and aggregated time flexibility) on each link
+			state.flow[:] = self.__incidence_matrix.T.dot(routes_flow)
+			state.sum_time_flexibility[:] = self.__incidence_matrix.T.dot(routes_time_flexibility)
+			
+			# update the links' costs at once (those links with no flow 
+			# keep their free flow values)
+			costs, derivatives = self.evaluate_links_costs(state.flow)
+			loaded = state.flow > 0.0
+			state.cost[:] = np.where(loaded, costs, state.free_flow_cost)
+			state.marginal_cost[:] = np.where(loaded, state.sum_time_flexibility * derivatives, state.free_flow_marginal_cost)
+			state.update_normalised_costs()
+			
+			# update the routes' costs
+			self.__update_routes_costs()
+		
+		self.__last_assignment = (routes_flow, routes_time_flexibility)
 		
-		# update the flow (and aggregated time flexibility) on each link
-		for i_od in xrange(len(solution)):
-			for i_od_route in xrange(len(solution[i_od])):
-				flow = solution[i_od][i_od_route]
-				time_flexibility = solution_time_flexibility[i_od][i_od_route]
-				if flow > 0.0:
-					route = self.__routes[self.__OD_matrix.get_order_OD(i_od)][i_od_route]
-					for link in route.get_links():
-						self.__L[link].add_time_flexibility(time_flexibility) #time_flexibility needs to be added before flow
-						self.__L[link].add_flow(flow)
-		
-		# update the routes' costs and compute the (normalised and non-normalised) 
-		# total costs (i.e., the sum of travel time of all agents)
-		total_cost = 0.0 # non-normalised
-		normalised_total_cost = 0.0 # normalised
-		for i_od in xrange(len(solution)):
-			for i_od_route in xrange(len(solution[i_od])):
-				route = self.__routes[self.__OD_matrix.get_order_OD(i_od)][i_od_route]
-				route.update_cost()
-				total_cost += route.get_cost(False) * solution[i_od][i_od_route]
-				normalised_total_cost += route.get_cost(True) * solution[i_od][i_od_route]
+		# check the normalisation of the routes' costs
+		invalid = np.flatnonzero(self.__routes_state.normalised_cost > 1)
+		if len(invalid):
+			self.__get_route(invalid[0]).get_cost(True) # raises the exception
+		
+		# compute the (normalised and non-normalised) total costs (i.e., the 
+		# sum of travel time of all agents); the cumulative sum is used to 
+		# add the costs in the same order as the routes
+		total_cost = np.cumsum(self.__routes_state.cost * routes_flow)[-1] # non-normalised
+		normalised_total_cost = np.cumsum(self.__routes_state.normalised_cost * routes_flow)[-1] # normalised
 		
 		# compute the (normalised and non-normalised) average travel times
-		avg_cost = total_cost / self.get_total_flow()
-		normalised_avg_cost = normalised_total_cost / self.get_total_flow()
+		avg_cost = float(total_cost) / self.get_total_flow()
+		normalised_avg_cost = float(normalised_total_cost) / self.get_total_flow()
 
 		
 		# alternative way of calculating the average costs (according to Roughgarden's book, pg. 19)
@@ -331,6 +515,427 @@ class ProblemInstance:
 		
 #=======================================================================
 
+# return the given rows of a (csr) sparse matrix, keeping the order of the 
+# values of each row (which is not ensured when indexing scipy's matrices,
+# but is required to sum them in the same order; see ProblemInstance)
+def select_rows(A, rows):
+	rows = np.asarray(rows, dtype=int)
+	lengths = A.indptr[rows + 1] - A.indptr[rows]
+	indptr = np.concatenate([[0], np.cumsum(lengths)])
+	positions = np.repeat(A.indptr[rows] - indptr[:-1], lengths) + np.arange(indptr[-1])
+	return csr_matrix((A.data[positions], A.indices[positions], indptr), shape=(len(rows), A.shape[1]))
+
+# return a boolean array of the given size that is True at the given indices
+def mask(size, indices):
+	m = np.zeros(size, dtype=bool)
+	m[indices] = True
+	return m
+
+#=======================================================================
+
+# the problem instance last created by this process (see get_problem_instance)
+problem_instances = {}
+
+# return a problem instance (see ProblemInstance) with the given parameters, 
+# which is a clone of the one created the first time these parameters were
+# used by this process (so that replications of an experiment do not need 
+# to load the network again); only the instance of the latest parameters 
+# is kept, since the replications of each case (e.g., of a validation or 
+# of a parallel worker) run one after the other, and thus the instances of 
+# previous cases would just hold their networks in memory
+def get_problem_instance(network_name, routes_per_OD=None, alt_route_file_name=None):
+	key = (network_name, routes_per_OD, alt_route_file_name)
+	if key not in problem_instances:
+		problem_instances.clear()
+		problem_instances[key] = ProblemInstance(network_name, routes_per_OD, alt_route_file_name)
+	return problem_instances[key].clone()
+
+#=======================================================================
+
+# version of the binary network files (see load_network_files), which must 
+# be changed whenever parse_network_files changes
+NETWORK_CACHE_VERSION = 2
+
+# return the network (see parse_network_files) of the given network and 
+# routes files; the network is cached in binary files next to the routes 
+# file, which are used instead of the source files as long as they do not
+# change (i.e., their modification times and sizes are the same as when 
+# the cache was created); the links of the routes, which are by far the 
+# largest array, are stored in a separate (.npy) file and memory-mapped, 
+# so that they are only read (and kept in memory) as needed, whereas the 
+# other arrays are stored in a .npz file
+def load_network_files(net_file_name, routes_file_name):
+	
+	cache_file_name = '%s.npz' % routes_file_name
+	routes_links_file_name = '%s.links.npy' % routes_file_name
+	sources = np.array([net_file_name, routes_file_name])
+	stamps = np.array([ [os.path.getmtime(f), os.path.getsize(f)] for f in sources ])
+	
+	# load the cache (if it is up to date)
+	try:
+		with np.load(cache_file_name) as cache:
+			if cache['version'] == NETWORK_CACHE_VERSION and np.array_equal(cache['sources'], sources) and np.array_equal(cache['stamps'], stamps):
+				network = dict([ (key, cache[key]) for key in cache.files ])
+				network['routes_links'] = np.load(routes_links_file_name, mmap_mode='r')
+				return network
+	except (IOError, KeyError, ValueError, zipfile.BadZipfile):
+		pass
+	
+	network = parse_network_files(net_file_name, routes_file_name)
+	
+	# create the cache (the files are written atomically, so that processes
+	# running in parallel never read incomplete files, see write_atomically;
+	# the .npz file is written last, since it validates the cache)
+	try:
+		write_atomically(routes_links_file_name, lambda f: np.save(f, network['routes_links']))
+		write_atomically(cache_file_name, lambda f: np.savez(f, version=NETWORK_CACHE_VERSION, sources=sources, stamps=stamps, **dict([ (key, value) for key, value in network.iteritems() if key != 'routes_links' ])))
+	except (IOError, OSError):
+		pass
+	
+	return network
+
+# read the network (.net) and routes (.routes) files into a dictionary 
+# of arrays, with the OD pairs (and their flows), the nodes, the cost 
+# functions (and their derivatives and constants), the links (and their 
+# functions and constants' values) and the routes (and their OD pairs and 
+# links' ids); the links are in the order of ProblemInstance.get_links_order 
+# and variable-length values (e.g., the links of each route) are stored in
+# flat arrays, such that the values of the i-th element are in positions 
+# offsets[i] to offsets[i+1] (where offsets is the corresponding array 
+# of offsets)
+def parse_network_files(net_file_name, routes_file_name):
+	
+	OD_entries = []
+	nodes = []
+	functions = [] # (name, param, constants, expr, expr_deriv)
+	functions_ids = {} # the index of each function name (on functions)
+	links_entries = []
+	lineid = 0
+	for line in open(net_file_name, 'r'):
+		
+		lineid += 1
+		
+		# ignore \n
+		line = line.rstrip()
+		
+		# ignore comments
+		hash_pos = line.find('#')
+		if hash_pos > -1:
+			line = line[:hash_pos]
+		
+		# split the line
+		taglist = line.split()
+		if len(taglist) == 0:
+			continue
+		
+		if taglist[0] == 'od':
+			
+			# if no flow is set for the OD pair, then 
+			# it is not created (just to avoid problems
+			# when computing OD-related statistics)
+			if float(taglist[4]) > 0:
+				OD_entries.append((taglist[1], float(taglist[4])))
+		
+		elif taglist[0] == 'function':
+			
+			# process the params
+			params = taglist[2][1:-1].split(',')
+			if len(params) > 1:
+				raise Exception('Cost functions with more than one parameter are not yet acceptable! (parameters defined: %s)' % str(params)[1:-1])
+			
+			# process the function (the results of parsing and 
+			# differentiating it are cached; see get_cached)
+			expr = taglist[3]
+			variables = get_cached(('variables', expr), lambda: Parser().parse(expr).variables())
+
+			# compute the derivative of the function (for tolling)
+			expr_deriv = get_cached(('derivative', expr, params[0]), lambda: differentiate(expr, params[0]))
+			
+			# handle the case where the parameter is not in the formula
+			# (this needs to be handled because py-expression-eval does
+			# not allows simplifying all variables of an expression)
+			if taglist[1] not in variables:
+				expr = '%s+%s-%s' % (expr, params[0], params[0])
+				expr_deriv = '%s+%s-%s' % (expr_deriv, params[0], params[0])
+
+			# process the constants (the parameter must be ignored)
+			constants = [ v for v in variables if v != params[0] ]
+			
+			# store the function
+			functions_ids[taglist[1]] = len(functions)
+			functions.append((taglist[1], params[0], constants, expr, expr_deriv))
+		
+		elif taglist[0] == 'node':
+			nodes.append(taglist[1])
+		
+		elif taglist[0] == 'dedge' or taglist[0] == 'edge': # dedge is a directed edge
+			
+			# process the function
+			function = functions_ids[taglist[4]] # get the corresponding function
+			constants = map(float, taglist[5:5+len(functions[function][2])]) # the constants' values specified in the line (in order of occurrence)
+			
+			# store the edge(s)
+			links_entries.append((taglist[1], taglist[2], taglist[3], function, constants))
+			if taglist[0] == 'edge':
+				links_entries.append(('%s-%s'%(taglist[3], taglist[2]), taglist[3], taglist[2], function, constants))
+		
+		else:
+			raise Exception('Network file does not comply with the specification! (line %d: "%s")' % (lineid, line))
+	
+	# the index of each link (if there are multiple links with the same 
+	# name, the last one is considered)
+	links_ids = dict([ (l[0], i) for i, l in enumerate(links_entries) ])
+	OD_pairs = set([ od for od, _ in OD_entries ])
+	
+	routes_ods = []
+	routes_links = []
+	routes_links_offsets = [0]
+	for line in open(routes_file_name, 'r'):
+		
+		# ignore \n
+		line = line.rstrip()
+		
+		# ignore comments
+		hash_pos = line.find('#')
+		if hash_pos > -1:
+			line = line[:hash_pos]
+		
+		# split the line
+		spl = line.split()
+		if len(spl) == 0:
+			continue
+		
+		# if the OD pair is not in the network, it
+		# means that it is invalid (e.g. zero flow)
+		if spl[0] not in OD_pairs:
+			continue
+		
+		# store the route (as the ids of its links)
+		routes_ods.append(spl[0])
+		routes_links.extend([ links_ids[l] for l in spl[1].split(',') ])
+		routes_links_offsets.append(len(routes_links))
+	
+	return {
+		'od_names': np.array([ od for od, _ in OD_entries ], dtype=str),
+		'od_flows': np.array([ flow for _, flow in OD_entries ], dtype=float),
+		'nodes': np.array(nodes, dtype=str),
+		'functions_names': np.array([ f[0] for f in functions ], dtype=str),
+		'functions_params': np.array([ f[1] for f in functions ], dtype=str),
+		'functions_constants': np.array([ c for f in functions for c in f[2] ], dtype=str),
+		'functions_constants_offsets': np.cumsum([0] + [ len(f[2]) for f in functions ]),
+		'functions_exprs': np.array([ f[3] for f in functions ], dtype=str),
+		'functions_derivs': np.array([ f[4] for f in functions ], dtype=str),
+		'links_names': np.array([ l[0] for l in links_entries ], dtype=str),
+		'links_origins': np.array([ l[1] for l in links_entries ], dtype=str),
+		'links_destinations': np.array([ l[2] for l in links_entries ], dtype=str),
+		'links_functions': np.array([ l[3] for l in links_entries ], dtype=np.int32),
+		'links_constants': np.array([ c for l in links_entries for c in l[4] ], dtype=float),
+		'links_constants_offsets': np.cumsum([0] + [ len(l[4]) for l in links_entries ]),
+		'routes_ods': np.array(routes_ods, dtype=str),
+		'routes_links': np.array(routes_links, dtype=np.int32),
+		'routes_links_offsets': np.array(routes_links_offsets)
+	}
+
+#=======================================================================
+
+# values derived from the cost functions' expressions (e.g., their 
+# derivatives and compiled kernels), keyed by the expressions' text; the 
+# cache is shared by all problem instances of the process and stored on 
+# disk (in COST_FUNCTIONS_CACHE_FILE), so that the functions are parsed, 
+# differentiated and compiled only once, rather than whenever a network 
+# is loaded (entries must be picklable; the file is discarded when the 
+# version does not match, i.e., if the way values are derived changes)
+COST_FUNCTIONS_CACHE_FILE = 'networks/cost_functions.cache'
+COST_FUNCTIONS_CACHE_VERSION = 1
+cost_functions_cache = None
+cost_functions_cache_changed = False
+
+# return the cached value of key, which is computed (and stored) with 
+# compute() if it is not in the cache yet (the new values are only written
+# to disk by store_cached)
+def get_cached(key, compute):
+	global cost_functions_cache, cost_functions_cache_changed
+	
+	# load the cache from disk (once per process; a file that cannot be 
+	# read, whatever the reason, is just ignored and replaced later)
+	if cost_functions_cache is None:
+		cost_functions_cache = {}
+		try:
+			with open(COST_FUNCTIONS_CACHE_FILE, 'rb') as f:
+				version, values = pickle.load(f)
+			if version == COST_FUNCTIONS_CACHE_VERSION:
+				cost_functions_cache = values
+		except Exception:
+			pass
+	
+	if key not in cost_functions_cache:
+		cost_functions_cache[key] = compute()
+		cost_functions_cache_changed = True
+	
+	return cost_functions_cache[key]
+
+# write the cache to disk if values were added to it since it was loaded 
+# or last written (it is written atomically, so that processes running in
+# parallel never read an incomplete file, see write_atomically; in the 
+# worst case, some entries are lost and computed again)
+def store_cached():
+	global cost_functions_cache_changed
+	
+	if not cost_functions_cache_changed:
+		return
+	
+	try:
+		write_atomically(COST_FUNCTIONS_CACHE_FILE, lambda f: pickle.dump((COST_FUNCTIONS_CACHE_VERSION, cost_functions_cache), f, pickle.HIGHEST_PROTOCOL))
+		cost_functions_cache_changed = False
+	except (IOError, OSError):
+		pass
+
+# compute the derivative of expr with respect to param (in py_expression_eval
+# syntax); sympy is only imported here, since it takes a while to load and 
+# is not needed when the derivatives are cached
+def differentiate(expr, param):
+	from sympy import diff
+	expr_deriv = str(diff(expr, param)) #compute derivative
+	return expr_deriv.replace('**','^').replace(' ','') #convert syntax (from sympy to py_expression_eval)
+	
+#=======================================================================
+
+# represents a cost function, compiled from its (py_expression_eval) 
+# expression into a kernel that can be evaluated on a single flow value 
+# as well as on arrays of flows (in which case the constants are arrays 
+# too, with one value per link)
+class CostFunction:
+	
+	# python code of the supported operators
+	__ops2 = { '+': '(%s+%s)', '-': '(%s-%s)', '*': '(%s*%s)', '/': '(%s/%s)', '%': '(%s%%%s)', '^': '_pow(%s,%s)' }
+	__ops1 = [ 'sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'sqrt', 'log', 'abs', 'ceil', 'floor', 'round', 'exp' ]
+	
+	# scalar kernels use the same functions as py_expression_eval (so that 
+	# the results are exactly the same), whereas vectorised ones use numpy's
+	__scalar_namespace = dict([ ('_pow', math.pow), ('_abs', abs), ('_round', round) ] + [ ('_%s' % f, getattr(math, f)) for f in __ops1 if hasattr(math, f) ])
+	__vector_namespace = dict([ ('_pow', np.power), ('_asin', np.arcsin), ('_acos', np.arccos), ('_atan', np.arctan) ] + [ ('_%s' % f, getattr(np, f)) for f in __ops1 if hasattr(np, f) ])
+	
+	# kernels compiled by this process, keyed by their python code
+	__kernels = {}
+	
+	# the BPR function, t*(1+a*(f/c)^b), and its derivative (as computed 
+	# by sympy); the parameter and the constants' names may vary
+	__bpr_regex = re.compile(r'^(\w+)\*\(1\+(\w+)\*\((\w+)/(\w+)\)\^(\w+)\)(\+\3-\3)?$')
+	
+	def __init__(self, name, param, constants, expr, expr_deriv):
+		self.__name = name
+		self.__param = param
+		self.__constants = constants
+		self.__expr = expr
+		self.__expr_deriv = expr_deriv
+		
+		# compile the function and its derivative (their python code is 
+		# cached, as well as the kernels; see get_cached)
+		self.__cost_scalar, self.__cost_vector = self.__compile(get_cached(('code', expr, param, tuple(constants)), lambda: self.__translate(Parser().parse(expr))))
+		self.__deriv_scalar, self.__deriv_vector = self.__compile(get_cached(('code', expr_deriv, param, tuple(constants)), lambda: self.__translate(Parser().parse(expr_deriv))))
+		
+		# check whether the BPR fast path can be used (i.e., the function and
+		# its derivative follow the BPR form, so that the power term can be 
+		# computed only once for both); the operations are kept in the same 
+		# order as in the original expressions to ensure the same results
+		self.__bpr = None
+		m = self.__bpr_regex.match(expr.replace(' ', ''))
+		if m and m.group(3) == param:
+			t, a, c, b = m.group(1), m.group(2), m.group(4), m.group(5)
+			padded = m.group(6) != None
+			if expr_deriv.replace(' ', '') == '%s*%s*%s*(%s/%s)^%s/%s%s' % (a, b, t, param, c, b, param, m.group(6) or ''):
+				self.__bpr = [ constants.index(x) for x in [t, a, c, b] ] + [padded]
+	
+	# translate the expression (in reverse polish notation) into python code 
+	# (a lambda of the parameter and the constants, in this order)
+	def __translate(self, function):
+		args = dict([ (c, '_k%d' % i) for i, c in enumerate(self.__constants) ] + [ (self.__param, '_x') ])
+		stack = []
+		for token in function.tokens:
+			if token.type_ == TNUMBER:
+				stack.append(repr(token.number_))
+			elif token.type_ == TVAR and token.index_ in args:
+				stack.append(args[token.index_])
+			elif token.type_ == TOP2 and token.index_ in self.__ops2:
+				n2 = stack.pop()
+				n1 = stack.pop()
+				stack.append(self.__ops2[token.index_] % (n1, n2))
+			elif token.type_ == TOP1 and token.index_ == '-':
+				stack.append('(-%s)' % stack.pop())
+			elif token.type_ == TOP1 and token.index_ in self.__ops1:
+				stack.append('_%s(%s)' % (token.index_, stack.pop()))
+			else:
+				raise Exception('Cost function %s cannot be compiled (unsupported token "%s")!' % (self.__name, token.toString()))
+		if len(stack) != 1:
+			raise Exception('Cost function %s cannot be compiled (invalid expression)!' % self.__name)
+		
+		return 'lambda %s: %s' % (', '.join(['_x'] + ['_k%d' % i for i in xrange(len(self.__constants))]), stack[0])
+	
+	# compile the python code of an expression into a scalar and a 
+	# vectorised kernel
+	def __compile(self, source):
+		if source not in self.__kernels:
+			code = compile(source, '<cost function %s>' % self.__name, 'eval')
+			self.__kernels[source] = (eval(code, dict(self.__scalar_namespace)), eval(code, dict(self.__vector_namespace)))
+		return self.__kernels[source]
+	
+	def get_name(self):
+		return self.__name
+	
+	def get_param(self):
+		return self.__param
+	
+	def get_constants(self):
+		return self.__constants
+	
+	def get_expression(self):
+		return self.__expr
+	
+	def get_derivative_expression(self):
+		return self.__expr_deriv
+	
+	# cost of a single flow value, given the constants' values of the link
+	def get_cost(self, value, constants):
+		return self.__cost_scalar(value, *constants)
+	
+	# cost's derivative of a single flow value, given the constants' values 
+	# of the link (raises ZeroDivisionError when the parameter is a divisor 
+	# and the value is zero)
+	def get_derivative(self, value, constants):
+		return self.__deriv_scalar(value, *constants)
+	
+	# evaluate the cost and the cost's derivative of an array of flows at 
+	# once, where constants is a sequence with one array per constant (in the 
+	# order of get_constants); the derivatives that cannot be evaluated 
+	# (e.g., because of a zero division) are returned as inf or nan
+	def evaluate(self, flows, constants):
+		with np.errstate(divide='ignore', invalid='ignore'):
+			if self.__bpr:
+				t, a, c, b = [ constants[i] for i in self.__bpr[:4] ]
+				x = np.power(flows / c, b)
+				costs = t * (1.0 + a * x)
+				derivs = a * b * t * x / flows
+				if self.__bpr[4]:
+					costs = costs + flows - flows
+					derivs = derivs + flows - flows
+			else:
+				costs = self.__cost_vector(flows, *constants)
+				derivs = self.__deriv_vector(flows, *constants)
+		
+		# expressions that do not depend on the flow (e.g., the derivative 
+		# of linear functions) produce scalars, which must be broadcast
+		if np.ndim(costs) == 0:
+			costs = np.full(len(flows), costs)
+		if np.ndim(derivs) == 0:
+			derivs = np.full(len(flows), derivs)
+		
+		return costs, derivs
+	
+	def __str__(self):
+		return self.__name
+
+#=======================================================================
+
 # represents a node in the graph
 class Node:
 	def __init__(self, name):
@@ -344,202 +949,234 @@ class Node:
 
 # represents a link in the graph
 class Link:
-	def __init__(self, name, origin, destination, cost_function, cost_function_deriv, param_name):
+	def __init__(self, name, origin, destination, cost_function, constants, links_state, index):
 		self.__name = name
 		self.__origin = origin
 		self.__destination = destination
 		
 		self.__cost_function = cost_function
-		self.__cost_function_deriv = cost_function_deriv
-		self.__param_name = param_name
-
-		# store the sum of time flexibility of all drivers using the 
-		# present link (required for computing marginal cost tolls)
-		# EXPLANATION: following the MCT definition, the toll on a link is 
-		# 		flow * vdf_derivative 
-		# a.k.a. the marginal cost; my generalised version includes a time 
-		# flexibility parameter (\eta_i for driver i), which rewrites tolls as 
-		# 		((1-\eta_1) * vdf_deriv) + ((1-\eta_2) * vdf_deriv) + ...
-		# for all drivers 1, 2, ... using that link, which is equivalent 
-		# to the original definition if \eta=1 for all drivers; to simplify 
-		# the process, we can compute this generalised toll value as 
-		# 		((1-\eta_1) + (1-\eta_2) + ...) * vdf_derivative
-		# hence, this variable is used to store that sum of time flexibility, 
-		# which reduces the complexity of computing the toll values
-		self.__sum_time_flexibility = 0.0
+		self.__constants = constants
 		
-		# used to compute the normalised cost
-		self.__normalisation_factor = None
-
-		# create/reset non-static variables (those that may change during simulations, like flow and cost)
-		self.reset()
+		# the non-fixed attributes of the link (flow, costs, etc.) are 
+		# stored in position index of the arrays of links_state (they are
+		# initialised by the problem instance, for all links at once)
+		self.__state = links_state
+		self.__index = index
 	
 	def __get_cost(self, value):
-		return self.__cost_function.evaluate({self.__param_name: value})
+		return self.__cost_function.get_cost(value, self.__constants)
 	
 	def __get_cost_deriv(self, value):
 		try:
-			return self.__cost_function_deriv.evaluate({self.__param_name: value})
+			return self.__cost_function.get_derivative(value, self.__constants)
 		except ZeroDivisionError:
 			if value == 0.0:
 				return 0.0
 			else:
 				raise Exception('Error on evaluating marginal cost of link %s with flow %f!' % (self.__name, value))
 
+	def get_cost_function(self):
+		return self.__cost_function
+	
+	def get_constants(self):
+		return self.__constants
+	
+	def get_index(self):
+		return self.__index
+	
 	def get_origin(self):
 		return self.__origin
 	
 	def get_destination(self):
 		return self.__destination
 	
-	def set_normalisation_factor(self, normalisation_factor):
-		self.__normalisation_factor = normalisation_factor
-		self.reset()
-	
-	# reset the flow and costs of the link
-	# during instantiation, it is called by the __init__ method without
-	# the normalisation factor, and thus without creating the normalised
-	# cost; the normalised cost is created only after the 
-	# set_normalisation_factor method is called
+	# reset the flow and costs of the link (to their free flow values); the
+	# normalised costs are only updated if the normalisation factor of the 
+	# link is defined (see ProblemInstance, which sets it for all links)
 	def reset(self):
-		self.__flow = 0.0
-		self.__cost = self.__get_cost(self.__flow)
-		self.__marginal_cost = self.__get_cost_deriv(self.__flow)
-		if self.__normalisation_factor:
-			self.__normalised_cost = self.__cost / self.__normalisation_factor
-			self.__normalised_marginal_cost = self.__marginal_cost / self.__normalisation_factor
-		self.__sum_time_flexibility = 0.0
-	
-	def add_time_flexibility(self, time_flexibility):
-		self.__sum_time_flexibility += time_flexibility
+		s, i = self.__state, self.__index
+		s.flow[i] = 0.0
+		s.cost[i] = s.free_flow_cost[i]
+		s.marginal_cost[i] = s.free_flow_marginal_cost[i]
+		if s.normalisation_factor[i]:
+			s.normalised_cost[i] = s.cost[i] / s.normalisation_factor[i]
+			s.normalised_marginal_cost[i] = s.marginal_cost[i] / s.normalisation_factor[i]
+		s.sum_time_flexibility[i] = 0.0
 
 	def get_marginal_cost(self):
-		if self.__normalisation_factor:
-			return self.__normalised_marginal_cost
+		if self.__state.normalisation_factor[self.__index]:
+			return float(self.__state.normalised_marginal_cost[self.__index])
 		else:
-			return self.__marginal_cost
+			return float(self.__state.marginal_cost[self.__index])
 
 	def add_flow(self, amount):
-		self.__flow += amount
+		s, i = self.__state, self.__index
+		s.flow[i] += amount
+		flow = float(s.flow[i])
 		
 		# update the costs
-		self.__cost = self.__get_cost(self.__flow)
-		self.__marginal_cost = self.__sum_time_flexibility * self.__get_cost_deriv(self.__flow)
-		if self.__normalisation_factor:
-			self.__normalised_cost = self.__cost / self.__normalisation_factor
-			self.__normalised_marginal_cost = self.__marginal_cost / self.__normalisation_factor
+		s.cost[i] = self.__get_cost(flow)
+		s.marginal_cost[i] = s.sum_time_flexibility[i] * self.__get_cost_deriv(flow)
+		if s.normalisation_factor[i]:
+			s.normalised_cost[i] = s.cost[i] / s.normalisation_factor[i]
+			s.normalised_marginal_cost[i] = s.marginal_cost[i] / s.normalisation_factor[i]
 	
 	def get_flow(self):
-		return self.__flow
+		return float(self.__state.flow[self.__index])
 	
 	def get_cost(self, normalise=False):
+		s, i = self.__state, self.__index
 		if normalise:
-			if self.__normalisation_factor:
-				if self.__normalised_cost > 1:
-					raise Exception('Error on cost normalisation of link %s (cost is %f and normalised cost is %f)!' % (self, self.__cost, self.__normalised_cost))
-				return self.__normalised_cost
+			if s.normalisation_factor[i]:
+				if s.normalised_cost[i] > 1:
+					raise Exception('Error on cost normalisation of link %s (cost is %f and normalised cost is %f)!' % (self, s.cost[i], s.normalised_cost[i]))
+				return float(s.normalised_cost[i])
 			else:
 				raise Exception('Cost normalisation is not supported on link %s!'%self)
 		else:
-			return self.__cost
+			return float(s.cost[i])
 	
 	def __str__(self):
 		return self.__name
 
 #=======================================================================
 
-# represents a route
-class Route:
-	def __init__(self, route_str, problem_instance):
+# stores the non-fixed attributes of the links (flow, costs, etc.) as 
+# arrays indexed by the links' ids (i.e., their position in the list 
+# returned by ProblemInstance.get_links_order), so that the whole network 
+# can be updated/reset at once; Link objects are just views on them
+class LinksState:
+	def __init__(self, n_links):
+		self.flow = np.zeros(n_links)
+		self.cost = np.zeros(n_links)
+		self.marginal_cost = np.zeros(n_links)
+		self.normalised_cost = np.zeros(n_links)
+		self.normalised_marginal_cost = np.zeros(n_links)
 		
-		self.__links = []
-		self.__name = ''
+		# store the sum of time flexibility of all drivers using each 
+		# link (required for computing marginal cost tolls)
+		# EXPLANATION: following the MCT definition, the toll on a link is 
+		# 		flow * vdf_derivative 
+		# a.k.a. the marginal cost; my generalised version includes a time 
+		# flexibility parameter (\eta_i for driver i), which rewrites tolls as 
+		# 		((1-\eta_1) * vdf_deriv) + ((1-\eta_2) * vdf_deriv) + ...
+		# for all drivers 1, 2, ... using that link, which is equivalent 
+		# to the original definition if \eta=1 for all drivers; to simplify 
+		# the process, we can compute this generalised toll value as 
+		# 		((1-\eta_1) + (1-\eta_2) + ...) * vdf_derivative
+		# hence, this variable is used to store that sum of time flexibility, 
+		# which reduces the complexity of computing the toll values
+		self.sum_time_flexibility = np.zeros(n_links)
 		
-		self.__cost = 0.0
-		self.__normalised_cost = 0.0
-
-		# store the weighted marginal cost of the route (i.e., the marginal 
-		# cost considering the individual preferences/flexibility of agents)
-		self.__weighted_marginal_cost = 0.0
-		self.__normalised_weighted_marginal_cost = 0.0
+		# used to compute the normalised costs (zero means undefined)
+		self.normalisation_factor = np.zeros(n_links)
 		
-		# used to compute the normalised cost
-		self.__normalisation_factor = None
+		# the costs of the empty links (evaluated by the problem instance, 
+		# for all links at once)
+		self.free_flow_cost = np.zeros(n_links)
+		self.free_flow_marginal_cost = np.zeros(n_links)
+	
+	# reset the flow and costs of all links
+	def reset(self):
+		self.flow.fill(0.0)
+		self.sum_time_flexibility.fill(0.0)
+		self.cost[:] = self.free_flow_cost
+		self.marginal_cost[:] = self.free_flow_marginal_cost
+		self.update_normalised_costs()
+	
+	# update the normalised costs (of the links whose normalisation 
+	# factor is defined) after the costs have changed
+	def update_normalised_costs(self):
+		defined = self.normalisation_factor != 0.0
+		np.divide(self.cost, self.normalisation_factor, out=self.normalised_cost, where=defined)
+		np.divide(self.marginal_cost, self.normalisation_factor, out=self.normalised_marginal_cost, where=defined)
+
+#=======================================================================
+
+# represents a route
+class Route:
+	def __init__(self, problem_instance, routes_state, index):
 		
-		# store the problem instance for updating the route cost
+		# the links of the route are stored by the problem instance (see 
+		# ProblemInstance.get_route_links_ids)
 		self.__problem_instance = problem_instance
 		
-		# read the route from links
-		spl = route_str.split(',')
-		for l in spl:
-			self.__links.append(l)
-			link = self.__problem_instance.get_link(l)
-			
-			# create the route name (based on nodes)
-			if self.__name == '':
-				self.__name = link.get_origin()
-			self.__name = '%s-%s' % (self.__name, link.get_destination())
-			
-		# update the route cost
-		self.update_cost()
-		
-		# the free flow travel time
-		self.__free_flow_travel_time = 0.0
-		self.__free_flow_travel_time_normalised = 0.0
-		
-	def set_free_flow_travel_time(self, fftt, fftt_normalised):
-		self.__free_flow_travel_time = fftt
-		self.__free_flow_travel_time_normalised = fftt_normalised
+		# the non-fixed attributes of the route (costs, etc.) are stored 
+		# in position index of the arrays of routes_state (and are 
+		# updated by the problem instance, for all routes at once)
+		self.__state = routes_state
+		self.__index = index
 	
 	def get_free_flow_travel_time(self, normalise=False):
 		if normalise:
-			return self.__free_flow_travel_time_normalised
+			return float(self.__state.free_flow_travel_time_normalised[self.__index])
 		else:
-			return self.__free_flow_travel_time
-		
-	def set_normalisation_factor(self, normalisation_factor):
-		self.__normalisation_factor = normalisation_factor
-		self.update_cost()
-	
-	# update the route cost
-	def update_cost(self):
-		self.__cost = 0.0
-		self.__normalised_cost = 0.0
-
-		self.__weighted_marginal_cost = 0.0
-		self.__normalised_weighted_marginal_cost = 0.0
-
-		for l in self.__links:
-			self.__cost += self.__problem_instance.get_link(l).get_cost()
-			self.__weighted_marginal_cost += self.__problem_instance.get_link(l).get_marginal_cost()
-			
-		if self.__normalisation_factor:
-			self.__normalised_cost = self.__cost / self.__normalisation_factor
-			self.__normalised_weighted_marginal_cost = self.__weighted_marginal_cost / self.__normalisation_factor
+			return float(self.__state.free_flow_travel_time[self.__index])
 		
 	def get_cost(self, normalise=False):
+		s, i = self.__state, self.__index
 		if normalise:
-			if self.__normalised_cost > 1:
+			if s.normalised_cost[i] > 1:
 				# IMPORTANT: do not comment exception below
-				raise Exception('Error on cost normalisation of route %s (cost is %f, normalised cost is %f and normalisation factor is %f)!' % (self, self.__cost, self.__normalised_cost, self.__normalisation_factor))
-			return self.__normalised_cost
+				raise Exception('Error on cost normalisation of route %s (cost is %f, normalised cost is %f and normalisation factor is %f)!' % (self, s.cost[i], s.normalised_cost[i], s.normalisation_factor[i]))
+			return float(s.normalised_cost[i])
 		else:
-			return self.__cost
+			return float(s.cost[i])
 
 	def get_weighted_marginal_cost(self, normalise=False):
+		s, i = self.__state, self.__index
 		if normalise:
-			if self.__normalised_weighted_marginal_cost > 1:
+			if s.normalised_weighted_marginal_cost[i] > 1:
 				# IMPORTANT: do not comment exception below
-				raise Exception('Error on marginal cost normalisation of route %s (cost is %f, normalised cost is %f and normalisation factor is %f)!' % (self, self.__weighted_marginal_cost, self.__normalised_weighted_marginal_cost, self.__normalisation_factor))
-			return self.__normalised_weighted_marginal_cost
+				raise Exception('Error on marginal cost normalisation of route %s (cost is %f, normalised cost is %f and normalisation factor is %f)!' % (self, s.weighted_marginal_cost[i], s.normalised_weighted_marginal_cost[i], s.normalisation_factor[i]))
+			return float(s.normalised_weighted_marginal_cost[i])
 		else:
-			return self.__weighted_marginal_cost
+			return float(s.weighted_marginal_cost[i])
 	
 	def get_links(self):
-		return self.__links
+		links_order = self.__problem_instance.get_links_order()
+		return [ links_order[l] for l in self.get_links_ids() ]
+	
+	# the links' indices (see ProblemInstance.get_links_order)
+	def get_links_ids(self):
+		return self.__problem_instance.get_route_links_ids(self.__index)
 	
+	def get_index(self):
+		return self.__index
+	
+	# the route name (based on nodes)
 	def __str__(self):
-		return self.__name
+		links = [ self.__problem_instance.get_link(l) for l in self.get_links() ]
+		return '-'.join([ links[0].get_origin() ] + [ l.get_destination() for l in links ])
+	
+#=======================================================================
+
+# stores the non-fixed attributes of the routes (costs, etc.) as arrays 
+# indexed by the routes' ids (i.e., their position in the list returned 
+# by ProblemInstance.get_routes_order); Route objects are views on them
+class RoutesState:
+	def __init__(self, n_routes):
+		self.cost = np.zeros(n_routes)
+		self.normalised_cost = np.zeros(n_routes)
+		
+		# store the weighted marginal cost of the routes (i.e., the marginal 
+		# cost considering the individual preferences/flexibility of agents)
+		self.weighted_marginal_cost = np.zeros(n_routes)
+		self.normalised_weighted_marginal_cost = np.zeros(n_routes)
+		
+		# used to compute the normalised costs (zero means undefined)
+		self.normalisation_factor = np.zeros(n_routes)
+		
+		# the free flow travel time
+		self.free_flow_travel_time = np.zeros(n_routes)
+		self.free_flow_travel_time_normalised = np.zeros(n_routes)
+	
+	# update the normalised costs (of the routes whose normalisation 
+	# factor is defined) after the costs have changed
+	def update_normalised_costs(self):
+		defined = self.normalisation_factor != 0.0
+		np.divide(self.cost, self.normalisation_factor, out=self.normalised_cost, where=defined)
+		np.divide(self.weighted_marginal_cost, self.normalisation_factor, out=self.normalised_weighted_marginal_cost, where=defined)
 	
 #=======================================================================
 
@@ -567,12 +1204,11 @@ class ODMatrix:
 		
 	def __create_OD_matrix(self, OD_entries):
 		
-		# read the OD matrix from a file
+		# read the OD matrix from the (OD pair, flow) entries
 		order = 0
-		for entry in OD_entries:
-			od_name = entry[1]
+		for od_name, flow in OD_entries:
 			
-			self.__OD_matrix[od_name] = float(entry[4])
+			self.__OD_matrix[od_name] = flow
 			
 			self.__OD_pairs.append(od_name)
 			
@@ -581,7 +1217,7 @@ class ODMatrix:
 			order += 1
 	
 			# compute the total flow
-			self.__total_flow += float(entry[4])
+			self.__total_flow += flow
 		
 	def get_total_flow(self):
 		return self.__total_flow
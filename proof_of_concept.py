@@ -1,50 +1,69 @@
 import sys
 import argparse
 import time
+import json
 import numpy as np
 from experiments import *
 
 def parse_arguments():
 	
-	# argparse action to call the validation procedure of every experiment class
+	# argparse action to run the validation cases of every experiment class
+	# (on a pool of processes, whose size may be given as argument)
 	class ValidateAllAction(argparse.Action):
 		def __init__(self, option_strings, version=None, dest=None, default=None, help=None):
-			super(ValidateAllAction, self).__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+			super(ValidateAllAction, self).__init__(option_strings=option_strings, dest=dest, default=default, nargs='?', const=0, type=int, metavar='JOBS', help=help)
 			self.version = version
 		def print_line(self):
 			print '-----------------------------------------------------------------------'
 		def __call__(self, parser, namespace, values, option_string=None):
 			
 			self.print_line()
-			print '\n Running complete validation (it takes around 65 minutes)...\n'
+			print '\n Running complete validation (it takes around 65 minutes on a single core)...\n'
+			self.print_line()
 
 			t_start = time.time()
 
-			# call the validation procedure of every experiment class
+			# collect the validation cases of every experiment class, so 
+			# that all of them are run on the same pool of processes
+			cases = []
 			for c in sorted([x.__name__ for x in experiment.__subclasses__()]):
-				self.print_line()
-				print 'validating script of experiment \'%s\'' % (c)
-				self.print_line()
-
 				exp = globals()[c]()
+				cases += [ ('%s: %s' % (c, description), function, args, expected_values) for (description, function, args, expected_values) in exp.get_validation_cases() ]
 
-				p_start = time.time()
-				exp.validate_script()
-				p_runtime = time.time() - p_start
-
-				print '\nRuntime: %f seconds\n' % p_runtime
+			fails = experiment.run_validation_cases(cases, values)
 
 			t_runtime = time.time() - t_start
 			self.print_line()
 			print '\nTotal runtime: %s minutes\n' % (t_runtime/60.0)
 			self.print_line()
 
-			parser.exit()
+			parser.exit(1 if fails > 0 else 0)
+
+	# argparse action to resume an interrupted batch of replications from the
+	# parameters file written by its experiment class (see aamas20's option
+	# --checkpoint-every), such that each unfinished replication continues 
+	# from its last checkpoint
+	class ResumeAction(argparse.Action):
+		def __init__(self, option_strings, dest=None, default=None, help=None):
+			super(ResumeAction, self).__init__(option_strings=option_strings, dest=dest, default=default, metavar='PARAMS_FILE', help=help)
+		def __call__(self, parser, namespace, values, option_string=None):
+			
+			# read the parameters (as strings, rather than unicode)
+			with open(values) as f:
+				params = { str(k): str(v) if isinstance(v, unicode) else v for k, v in json.load(f).items() }
+			params['resume'] = True
+			
+			exp = globals()[params['exp_class']]()
+			exp.run(params)
+			
+			parser.exit(0)
 
 	# create the top-level parser
 	parser = argparse.ArgumentParser(description='Proof of concept of Gabriel\'s PhD thesis.')
 	parser.add_argument('--validate_all', dest='validate_all', action=ValidateAllAction, 
-		help='validate all experiments')
+		help='validate all experiments, running JOBS validation cases in parallel (if JOBS is not given, one per core)')
+	parser.add_argument('--resume', dest='resume', action=ResumeAction, 
+		help='resume an interrupted batch of replications from its parameters file (PARAMS_FILE, written to the logs folder when checkpoints are enabled)')
 		
 	# create the sub-parsers (one for each experiment class)
 	subparsers = parser.add_subparsers(help='experiment to run')
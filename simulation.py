@@ -1,23 +1,140 @@
-from agent import Driver, NavigationApp
-from misc import Distribution
+from agent import DriverPopulation, NavigationApp
+from misc import Distribution, write_atomically
 from analytics import *
+import numpy as np
+import collections
 import sys
+import os
 import random
 import scipy.stats as sc_stats
 import matplotlib.pyplot as plt
 from decimal import Decimal
 
-# return the cost observed by agent d after taking its action
+# version of the random streams of run_simulation (i.e., of the way random 
+# numbers are drawn), which determines the results obtained with a given 
+# seed; the expected values of the experiments' validation cases depend on
+# it (see experiments.experiment):
+# * 1: numbers drawn from numpy's global generator, one or two per driver 
+#   in turn (the version used to obtain the results of the papers)
+# * 2: numbers drawn from a generator created for each run (see the seed
+#   parameter of run_simulation), with one vector per episode to decide 
+#   which drivers explore and another one for the actions they choose
+RANDOM_STREAMS_VERSION = 2
+
+# return the cost observed by each driver after taking its action, where 
+# routes_taken are the routes (in the order of P.get_routes_order) taken by 
+# the drivers and drivers_flow_rate is the index of their flow in flow_rates
 # (created this method to avoid redundant code)
-def get_cost(P, d, difference_rewards, difference_reward_per_route, NORMALISE_COSTS):
-	cost = 0.0
-	route = P.get_route(d.get_OD_pair(), d.get_last_action())
+def get_cost(P, routes_taken, drivers_flow_rate, difference_rewards, difference_reward_per_route, NORMALISE_COSTS):
 	if difference_rewards:
-		cost = difference_reward_per_route[d.get_OD_pair()][d.get_last_action()][d.get_flow()]
+		cost = difference_reward_per_route[routes_taken, drivers_flow_rate]
 	else:
-		cost = route.get_cost(NORMALISE_COSTS)
+		cost = P.get_routes_costs(NORMALISE_COSTS)[routes_taken]
 	return cost
 
+# return the difference reward of each route (in the order of 
+# P.get_routes_order) for each flow rate in flow_rates, as a [routes x flow 
+# rates] array, given the normalised average cost (norm_v) of the current 
+# assignment; flows_to_remove is the amount of flow removed from the links 
+# to compute the difference of each flow rate (see run_simulation)
+def get_difference_rewards(P, flow_rates, flows_to_remove, norm_v, NORMALISE_COSTS):
+	
+	# compute the cost difference of each link, for all links at once (links
+	# with no flow have no difference); the flow rates are processed in order,
+	# and the flow of each link is removed and then added back before the next 
+	# rate, as when this was computed on each link (so that the results, which
+	# may suffer from floating point errors, are exactly the same)
+	flows = P.get_links_flows().copy()
+	costs = P.get_links_costs(False).copy()
+	difference_reward_per_link = np.zeros((len(flows), len(flow_rates)))
+	for i, flow_to_add in enumerate(flows_to_remove):
+		
+		# only the loaded links are evaluated (the cost functions may not 
+		# be defined on the negative flows of the others)
+		loaded = np.flatnonzero(flows > 0)
+		
+		# get the current total cost (cost * flow) of the links, remove the 
+		# flow and compute the new total cost (cost * flow) of the links
+		flows_minus_one = flows.copy()
+		flows_minus_one[loaded] -= flow_to_add
+		costs_minus_one = P.evaluate_links_costs(flows_minus_one, links=loaded)[0]
+		difference_reward_per_link[loaded, i] = costs[loaded] * flows[loaded] - costs_minus_one * flows_minus_one[loaded]
+		
+		# undo the flow change (and update the costs accordingly)
+		if i < len(flow_rates) - 1:
+			flows[loaded] = flows_minus_one[loaded] + flow_to_add
+			costs[loaded] = P.evaluate_links_costs(flows, links=loaded)[0]
+	
+	# sum the links' cost differences of each route
+	sum_diff = P.get_incidence_matrix().dot(difference_reward_per_link)
+	if NORMALISE_COSTS:
+		sum_diff /= P.get_normalisation_factor_routes()
+	
+	# compute the difference of each route
+	tf = P.get_total_flow() # total flow
+	tc = norm_v * tf # total cost
+	return (tf * sum_diff - tc) / (tf * (tf - 1.0))
+
+# return the flow of vehicles and the sum of their time flexibility on each 
+# route (as arrays ordered as P.get_routes_order), given the routes taken by 
+# the drivers (in the order of P.get_routes_order)
+def get_routes_flows(P, D, routes_taken):
+	
+	# sum the drivers' values on each route (in the drivers' order)
+	flows = D.get_flows() * D.get_counts()
+	routes_flow = np.zeros(P.get_number_of_routes())
+	np.add.at(routes_flow, routes_taken, flows)
+	routes_time_flexibility = np.zeros(P.get_number_of_routes())
+	np.add.at(routes_time_flexibility, routes_taken, flows * (1 - D.get_time_flexibilities()))
+	
+	return routes_flow, routes_time_flexibility
+
+# return the relative gap of the current assignment, i.e., how much the total
+# travel time exceeds the one obtained if all vehicles took the shortest 
+# route of their OD pairs (under the current costs), relative to the latter;
+# od_first_route is the index of the first route of each OD pair (the routes
+# of each OD pair are consecutive in the order of P.get_routes_order)
+def get_relative_gap(P, routes_flow, od_first_route):
+	costs = P.get_routes_costs()
+	od_flow = np.add.reduceat(routes_flow, od_first_route)
+	shortest = np.dot(od_flow, np.minimum.reduceat(costs, od_first_route))
+	return (np.dot(routes_flow, costs) - shortest) / shortest
+
+# return the assignment (i.e., the flow of vehicles and the sum of their 
+# time flexibility for each OD-route pair) given the routes taken by the 
+# drivers (in the order of P.get_routes_order)
+def get_assignment(P, D, routes_taken):
+	
+	routes_flow, routes_time_flexibility = get_routes_flows(P, D, routes_taken)
+	routes_used = np.bincount(routes_taken, minlength=P.get_number_of_routes()) > 0
+	
+	# store the flow of vehicles (S) and the sum of agents' time flexibility 
+	# (S_time_flexibility) for each OD-route pair (routes not taken by any 
+	# driver keep the values of an empty solution)
+	routes_flow = routes_flow.tolist()
+	routes_time_flexibility = routes_time_flexibility.tolist()
+	routes_used = routes_used.tolist()
+	S = []
+	S_time_flexibility = []
+	for od in P.get_OD_pairs():
+		routes = P.get_routes_indices(od)
+		S.append([ routes_flow[r] if routes_used[r] else 0 for r in routes ])
+		S_time_flexibility.append([ routes_time_flexibility[r] if routes_used[r] else 0 for r in routes ])
+	
+	return S, S_time_flexibility
+
+# write the state of a simulation (a dictionary of arrays, see run_simulation)
+# to a compressed NPZ file; a previous checkpoint is only replaced by a 
+# complete one (e.g., if the process is killed while writing it; see 
+# write_atomically)
+def save_checkpoint(file_name, state):
+	write_atomically(file_name, lambda f: np.savez_compressed(f, **state))
+
+# read the state of a simulation written by save_checkpoint
+def load_checkpoint(file_name):
+	with np.load(file_name) as f:
+		return { name: f[name] for name in f.files }
+
 # run_simulation: run a route choice simulation
 # Parameters:
 # * P: problem instance
@@ -42,12 +159,24 @@ def get_cost(P, d, difference_rewards, difference_reward_per_route, NORMALISE_CO
 # * time_flexibility_distribution: specifies the probability distribution from which the drivers' time flexibility (over money) should be drawn
 # * agent_vehicles_factor: specifies the number of vehicles each agent should control (it can even be a fraction)
 # * ignore_avf_difference_rewards: whether agents should be considered one unit (or agent_vehicles_factor units) flow each when computing the difference rewards
+# * profiler: a Profiler (see analytics) in which the wall time and the number of calls of each phase of the simulation (setup, choose_actions, evaluate_assignment, difference_rewards, tolling, update_strategy, navigation_app, regrets, statistics_episode, checkpoint and statistics) are accumulated; if None, the simulation is not profiled
+# * seed: seed of the random generator of the simulation (if None, it is drawn from numpy's global generator, so that seeding the latter still makes the simulation reproducible)
+# * aggregate_drivers: whether or not identical drivers (same OD pair, flow and time flexibility) should be simulated as groups, which are split (by multinomial sampling) only when their drivers take different actions; the results are statistically (but not exactly) the same, with much less computation and memory when there are many drivers per OD pair (see DriverPopulation)
 # * plot_results: whether or not results should be plotted
 # * dynamic_plot_results: whether or not results should be plotted in real time
 # * stat_all: whether or not a report with simulation statistics should be printed after the simulation is completed
 # * stat_regret_diff: whether or not the above report should print additional regret statistics (absolute and relative difference between estimated and real regrets) as well
 # * print_OD_pairs_every_episode: whether or not information about each OD pair should be printed on every episode
-def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99, epsilon_decay=0.99, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=False, use_app=False, difference_rewards=False, a_posteriori_MCT=False, indifferent_MCT=False, weighted_MCT=False, delta_tolling=False, thesis_delta_tolling=False, revenue_division_rate=0.0, time_flexibility_distribution=None, agent_vehicles_factor=1.0, ignore_avf_difference_rewards=True, plot_results=False, dynamic_plot_results=False, stat_all=True, stat_regret_diff=True, print_OD_pairs_every_episode=True):
+# * stats_sink: where the statistics of every episode are written when stat_all is set, e.g., an NPYSink (if None, they are printed to the standard output by a TextSink; see analytics)
+# * stats_every: interval (in episodes) between the episodes whose statistics (drivers' regrets) are computed and written, i.e., the first one and every stats_every-th after it; the last episode is always included, so that the returned values are exact, and the averages over time are computed over the episodes included
+# * stats_ema: if not None, the weight (in (0,1]) of each episode in exponential moving averages of the general statistics, which are written along with them (the episodes not included by stats_every are assumed to have the values of the next one included)
+# * stop_criterion: if not None, the simulation stops before the given number of iterations once it has converged according to one of the following criteria, checked on every episode: 'assignment' (the flow of no route changed by more than stop_tolerance in the last stop_window episodes), 'gap' (the relative gap of the assignment, see get_relative_gap, was at most stop_tolerance in the last stop_window episodes) or 'regret' (the drivers' average estimated regret varied by at most stop_tolerance in the last stop_window episodes); the statistics of the last episode run are computed as usual
+# * stop_window: number of episodes considered by the stopping criterion
+# * stop_tolerance: tolerance of the stopping criterion
+# * checkpoint_file: the file (compressed NPZ) where the state of the simulation is written every checkpoint_every episodes (except on the last one), so that it can be resumed (see resume) if the process dies; the state includes the drivers (strategies, histories, etc.), the navigation app, the random generator and the sums used by the statistics, whereas the network is restored by evaluating the last assignment; the plots and the profile only cover the episodes run after resuming, whose statistics are written to stats_sink as usual
+# * checkpoint_every: interval (in episodes) between consecutive checkpoints (if 0, no checkpoint is written)
+# * resume: whether or not the simulation should be resumed from checkpoint_file (if it exists; otherwise, the simulation starts from scratch); the other parameters must be the same of the interrupted simulation, which is then continued exactly as if it had not been interrupted
+def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99, epsilon_decay=0.99, min_alpha=0.0, min_epsilon=0.0, normalise_costs=True, regret_as_cost=True, extrapolate_costs=False, use_app=False, difference_rewards=False, a_posteriori_MCT=False, indifferent_MCT=False, weighted_MCT=False, delta_tolling=False, thesis_delta_tolling=False, revenue_division_rate=0.0, time_flexibility_distribution=None, agent_vehicles_factor=1.0, ignore_avf_difference_rewards=True, profiler=None, seed=None, aggregate_drivers=False, plot_results=False, dynamic_plot_results=False, stat_all=True, stat_regret_diff=True, print_OD_pairs_every_episode=True, stats_sink=None, stats_every=1, stats_ema=None, stop_criterion=None, stop_window=100, stop_tolerance=1e-4, checkpoint_file=None, checkpoint_every=0, resume=False):
 	
 	ITERATIONS = iterations
 	
@@ -62,6 +191,30 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 	
 	REGRET_AS_COST = regret_as_cost
 	
+	# start profiling (if desired)
+	if profiler is None:
+		profiler = Profiler(enabled=False)
+	profiler.start()
+	
+	# create the random generator of the simulation (see RANDOM_STREAMS_VERSION)
+	if seed is None:
+		seed = np.random.randint(0, 2**31 - 1)
+	random_state = np.random.RandomState(seed)
+	
+	if stop_window < 1:
+		raise Exception('The window of the stopping criterion must have at least 1 episode (%d given)!' % stop_window)
+	
+	if stats_every < 1:
+		raise Exception('The interval between the episodes with statistics must be at least 1 (%d given)!' % stats_every)
+	if stats_ema is not None and not 0.0 < stats_ema <= 1.0:
+		raise Exception('The weight of the episodes in the moving averages must be in (0,1] (%f given)!' % stats_ema)
+	
+	if stop_criterion not in [None, 'assignment', 'gap', 'regret']:
+		raise Exception('Invalid stopping criterion "%s"!' % stop_criterion)
+	
+	if checkpoint_every > 0 and checkpoint_file is None:
+		raise Exception('A checkpoint file must be given to write checkpoints every %d episodes!' % checkpoint_every)
+	
 	# if no distribution was defined for time flexibility, then instantiate a default fixed distribution
 	if not isinstance(time_flexibility_distribution, Distribution):
 		time_flexibility_distribution = Distribution(Distribution.DIST_FIXED)
@@ -71,7 +224,7 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 	plotter_regret = None
 	if plot_results:
 		plotter = Plotter(x_axis_range=range(1,ITERATIONS+1), title='Average travel time along episodes', x_axis_label='episodes', y_axis_label='average travel time')
-		plotter_regret = Plotter(x_axis_range=range(1,ITERATIONS+1), title='Average regret along episodes', x_axis_label='episodes', y_axis_label='regret')
+		plotter_regret = Plotter(x_axis_range=[ it + 1 for it in xrange(ITERATIONS) if it % stats_every == 0 or it == ITERATIONS-1 ], title='Average regret along episodes', x_axis_label='episodes', y_axis_label='regret')
 
 	# create a dynamic plotter
 	dyn_plotter = None
@@ -84,8 +237,12 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 	if use_app:
 		app_to_agent = app
 	
-	# create the drivers
-	D = [] # set of drivers
+	# create the drivers (their attributes are collected here, and then 
+	# the whole population is created at once)
+	drivers_od = [] # the (order of the) OD pair of each driver
+	drivers_flow = []
+	od_actions = [] # number of actions of each OD pair
+	od_initial_costs = [] # initial costs of each OD pair
 	flow_rates = set([agent_vehicles_factor]) # set of flow rates in use, defined as [agent_vehicles_factor] U [ r_od | od in OD ], where r_od is the remainder flow of OD pair od; this set is necessary to efficiently compute the difference rewards
 	for od in P.get_OD_pairs():
 
@@ -111,14 +268,15 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 			n_of_agents += 1 # this extra agent controls the remainder flow
 			flow_rates.add(remainder)
 
-		# create the set of actions
-		actions = range(len(P.get_routes(od)))
+		# store the number of actions
+		od_actions.append(P.get_route_set_size(od))
 		
 		# compute the initial costs (used to initialise the estimated 
 		# regret values)
 		initial_costs = []
-		for r in P.get_routes(od):
-			initial_costs.append(r.get_cost(NORMALISE_COSTS))
+		for r in P.get_routes_indices(od):
+			initial_costs.append(float(P.get_routes_costs(NORMALISE_COSTS)[r]))
+		od_initial_costs.append(initial_costs)
 		
 		# create the drivers
 		#print 'OD pair %s has %d agents with %f flow each (remainder is %f)' % (od, n_of_agents, agent_vehicles_factor, remainder)
@@ -126,12 +284,39 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 			flow = agent_vehicles_factor
 			if i == 0 and remainder > 0.0:
 				flow = remainder
-			D.append(Driver(od, actions, initial_costs=initial_costs, extrapolate_costs=extrapolate_costs, navigation_app=app_to_agent, time_flexibility=time_flexibility_distribution.sample(), flow=flow))
+			drivers_od.append(P.get_OD_order(od))
+			drivers_flow.append(flow)
+	
+	# draw the drivers' time flexibility at once
+	drivers_time_flexibility = time_flexibility_distribution.sample_many(len(drivers_od)).tolist()
+	
+	# if necessary, aggregate consecutive identical drivers into groups
+	if aggregate_drivers:
+		groups_od, groups_flow, groups_time_flexibility, groups_count = [], [], [], []
+		for driver in zip(drivers_od, drivers_flow, drivers_time_flexibility):
+			if groups_count and driver == (groups_od[-1], groups_flow[-1], groups_time_flexibility[-1]):
+				groups_count[-1] += 1
+			else:
+				groups_od.append(driver[0])
+				groups_flow.append(driver[1])
+				groups_time_flexibility.append(driver[2])
+				groups_count.append(1)
+		D = DriverPopulation(P.get_OD_pairs(), od_actions, groups_od, initial_costs=od_initial_costs, extrapolate_costs=extrapolate_costs, navigation_app=app_to_agent, time_flexibility=groups_time_flexibility, flow=groups_flow, random_state=random_state, counts=groups_count)
+	else:
+		D = DriverPopulation(P.get_OD_pairs(), od_actions, drivers_od, initial_costs=od_initial_costs, extrapolate_costs=extrapolate_costs, navigation_app=app_to_agent, time_flexibility=drivers_time_flexibility, flow=drivers_flow, random_state=random_state)
+	
+	# the first route of each OD pair (used to find the routes taken by the 
+	# drivers in the order of P.get_routes_order) and the index of each 
+	# driver's flow in flow_rates (used to get their difference rewards; 
+	# when drivers are aggregated, it is updated as the groups are split)
+	od_first_route = np.array([ P.get_routes_indices(od)[0] for od in P.get_OD_pairs() ])
+	flow_rates = list(flow_rates)
+	drivers_flow_rate = (D.get_flows()[:, np.newaxis] == np.array(flow_rates)).argmax(axis=1)
 	
 	# check if the sum of agents' flow match the OD matrix
 	od_flow_check = { od: Decimal('0.0') for od in P.get_OD_pairs() }
-	for d in D:
-		od_flow_check[d.get_OD_pair()] += Decimal(str(d.get_flow()))
+	for i_od, flow in zip(drivers_od, drivers_flow):
+		od_flow_check[P.get_OD_pairs()[i_od]] += Decimal(str(flow))
 	errors_count = 0
 	for od in od_flow_check:
 		ofc = Decimal(str(P.get_OD_flow(od)))
@@ -141,18 +326,20 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 	if errors_count > 0:
 		raise Exception('Error on the decimal representation of %d OD pairs!' % errors_count)
 
-	# create structures to store difference rewards 
-	# (to avoid computing the difference of each driver) 
-	# (this structure is recomputed at each iteration)
-	# (the innermost dictionary generalises the algorithm to infinitesimal and non-uniform flows, rather than always 1)
-	if difference_rewards:
-		# difference reward per link
-		difference_reward_per_link = { link : { fr: 0.0 for fr in flow_rates} for link in P.get_links() }
-
-		# difference reward per route and OD pair
-		difference_reward_per_route = { od: [ { fr: 0.0 for fr in flow_rates} for _ in xrange(P.get_route_set_size(od)) ] for od in P.get_OD_pairs() }
+	# difference rewards are stored per route and flow rate (to avoid 
+	# computing the difference of each driver); they are recomputed at each 
+	# iteration (see get_difference_rewards); the flow rates generalise the
+	# algorithm to infinitesimal and non-uniform flows, rather than always 1
+	difference_reward_per_route = None
+	
+	# define the amount of flow to compute the difference of each flow rate; 
+	# the usual amount is 1.0 (i.e., each agent controls one unit of flow), 
+	# but this value may vary if agents control a different fraction of flow 
+	# (e.g., if agent_vehicles_factor = 0.3)
+	if ignore_avf_difference_rewards:
+		flows_to_remove = [ 1.0 for fr in flow_rates ]
 	else:
-		difference_reward_per_route = None
+		flows_to_remove = flow_rates
 
 	# sum of routes' costs along time (used to compute the averages)
 	routes_costs_sum = { od: [ 0.0 for _ in xrange(P.get_route_set_size(od)) ] for od in P.get_OD_pairs() }
@@ -166,67 +353,88 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 	sum_regrets = { od : [0.0, 0.0, 0.0, 0.0] for od in P.get_OD_pairs() }
 	
 	# declare the report functions locally to improve performance
-	stats = Statistics(P, D, ITERATIONS, stat_regret_diff, plot_results, plotter, plotter_regret, stat_all, print_OD_pairs_every_episode)
+	# (the report headings are written here, see Statistics)
+	stats = Statistics(P, D, ITERATIONS, stat_regret_diff, plot_results, plotter, plotter_regret, stat_all, print_OD_pairs_every_episode, stats_sink, stats_every, stats_ema)
+	
+	# measures of the last episodes (see stop_criterion) and the flow of 
+	# routes in the previous episode (used by the assignment criterion)
+	stop_measures = collections.deque(maxlen=stop_window)
+	previous_routes_flow = None
 	
-	if stat_all:
-
-		# print the report headings
-		head1 = '\tgeneral\t\t'
-		head2 = 'it\tavg-tt\treal\test'
-		if stat_regret_diff:
-			head1 = '%s\t\t' % (head1)
-			head2 = '%s\tdiff\treldiff' % (head2)
-		if print_OD_pairs_every_episode:
-			for od in P.get_OD_pairs():
-				head1 = '%s\t%s\t' % (head1, od)
-				head2 = '%s\treal\test' % (head2)
-				if stat_regret_diff:
-					head1 = '%s\t\t' % (head1)
-					head2 = '%s\tdiff\treldiff' % (head2)
-		print head1
-		print head2
-
-	# run the simulation
 	best = float('inf')
-	for iteration in xrange(ITERATIONS):
+	
+	# the parameters that cannot change when the simulation is resumed from
+	# a checkpoint (see checkpoint_file)
+	checkpoint_parameters = repr([ITERATIONS, alpha, epsilon, alpha_decay, epsilon_decay, min_alpha, min_epsilon, normalise_costs, regret_as_cost, extrapolate_costs, use_app, difference_rewards, a_posteriori_MCT, indifferent_MCT, weighted_MCT, delta_tolling, thesis_delta_tolling, revenue_division_rate, agent_vehicles_factor, ignore_avf_difference_rewards, aggregate_drivers, stat_regret_diff, stats_every, stats_ema, stop_criterion, stop_window, stop_tolerance, P.get_number_of_routes(), len(P.get_OD_pairs())])
+	
+	# resume the simulation from its checkpoint, if desired (and if it exists)
+	first_iteration = 0
+	if resume and checkpoint_file is not None and os.path.exists(checkpoint_file):
+		state = load_checkpoint(checkpoint_file)
+		if str(state['parameters']) != checkpoint_parameters:
+			raise Exception('The checkpoint "%s" was written by a simulation with other parameters (%s)!' % (checkpoint_file, state['parameters']))
+		substate = lambda prefix: { name[len(prefix):]: value for name, value in state.items() if name.startswith(prefix) }
 		
-		# flush stdout
-		sys.stdout.flush()
-
-		#-------------------------------------------
-		# generate an empty solution
+		# restore the variables of the simulation
+		first_iteration = int(state['iteration'])
+		ALPHA = float(state['alpha'])
+		EPSILON = float(state['epsilon'])
+		best = float(state['best'])
+		random_state.set_state(('MT19937', state['random_keys'], int(state['random_pos']), int(state['random_has_gauss']), float(state['random_cached_gaussian'])))
 		
-		# store the flow of vehicles for each OD-route pair
-		S = P.get_empty_solution()
-
-		# store the sum of agents' time flexibility for each OD-route pair
-		S_time_flexibility = P.get_empty_solution()
+		# restore the drivers, the navigation app and the statistics
+		D.set_state(substate('drivers_'))
+		app.set_state(substate('app_'))
+		stats.set_state(substate('stats_'))
+		drivers_flow_rate = (D.get_flows()[:, np.newaxis] == np.array(flow_rates)).argmax(axis=1)
+		
+		# restore the sums of routes' costs and regrets (over the OD pairs and their routes, in order)
+		flat_routes_costs_sum = state['routes_costs_sum'].tolist()
+		for od in P.get_OD_pairs():
+			routes_costs_sum[od] = flat_routes_costs_sum[:P.get_route_set_size(od)]
+			flat_routes_costs_sum = flat_routes_costs_sum[P.get_route_set_size(od):]
+		for od, regrets in zip(P.get_OD_pairs(), state['sum_regrets'].tolist()):
+			sum_regrets[od] = regrets
+		
+		# restore the state of the network by evaluating the last assignment
+		P.evaluate_assignment(state['routes_flow'], state['routes_time_flexibility'])
+		
+		# restore the stopping criterion
+		stop_measures.extend(state['stop_measures'].tolist())
+		previous_routes_flow = state['routes_flow']
+		
+		print 'Resuming from checkpoint "%s" (episode %d)' % (checkpoint_file, first_iteration)
+	
+	profiler.lap('setup')
+	
+	# run the simulation
+	for iteration in xrange(first_iteration, ITERATIONS):
 
 		#-------------------------------------------
 		# choose actions
 		
-		for d in D:
-
-			# choose the action
-			a = d.choose_action(EPSILON)
-
-			# update the assignment
-			od = P.get_OD_order(d.get_OD_pair())
-			S[od][a] += d.get_flow()
-
-			# update the sum of time flexibility of the vehicles within this route
-			S_time_flexibility[od][a] += d.get_flow() * (1 - d.get_time_flexibility())
+		actions = D.choose_actions(EPSILON) # (groups of drivers may be split)
+		routes_taken = od_first_route[D.get_drivers_OD()] + actions
+		if aggregate_drivers:
+			drivers_flow_rate = (D.get_flows()[:, np.newaxis] == np.array(flow_rates)).argmax(axis=1)
+		
+		# compute the assignment, i.e., the flow of vehicles and the sum of 
+		# agents' time flexibility on each route
+		routes_flow, routes_time_flexibility = get_routes_flows(P, D, routes_taken)
 		
 		if EPSILON > MIN_EPSILON:
 			EPSILON = EPSILON * EPSILON_DECAY
 		else:
 			EPSILON = MIN_EPSILON
 		
+		profiler.lap('choose_actions')
+		
 		#-------------------------------------------
 		# update network
 
 		# compute the (non-normalised) average travel time and the (normalised) total cost
-		v, norm_v = P.evaluate_assignment(S, S_time_flexibility) 
+		# (only the links and routes affected by route switches are updated)
+		v, norm_v = P.evaluate_assignment(routes_flow, routes_time_flexibility, incremental=True)
 
 		if v < best:
 			best = v
@@ -237,6 +445,8 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 		if dynamic_plot_results:
 			dyn_plotter.update(iteration, v)
 		
+		profiler.lap('evaluate_assignment')
+		
 		# compute the difference reward for each route of each OD pair
 		if difference_rewards:
 			
@@ -250,112 +460,55 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 			# all agents), and c' is the sum of cost difference of each link.
 			# Also important: the costs normalisation must be done on routes (rather than on links) 
 			# because the normalisation factors for links and routes are not the same.
-
-
-			# compute the cost difference of each link
-			for link_name in P.get_links():
-
-				link = P.get_link(link_name)
-
-				for fr in flow_rates:
-
-					if link.get_flow() > 0:
-
-						# get the current total cost (cost * flow) of the link
-						tc_link = link.get_cost(False) * link.get_flow()
-
-						# define the amount of flow to compute the difference; the usual amount is 1.0
-						# (i.e., each agent controls one unit of flow), but this value may vary if agents
-						# control a different fraction of flow (e.g., if agent_vehicles_factor = 0.3)
-						flow_to_add = fr
-						if ignore_avf_difference_rewards:
-							flow_to_add = 1.0
-
-						# remove one unit of flow and compute the new total cost (cost * flow) of the link
-						link.add_flow(-flow_to_add)
-						tc_link_minus_one = link.get_cost(False) * link.get_flow()
-
-						# undo the flow change (the cost is then automatically updated)
-						link.add_flow(+flow_to_add)
-
-						# compute (and store) the link's cost difference
-						difference_reward_per_link[link_name][fr] = tc_link - tc_link_minus_one
-					
-					else:
-						difference_reward_per_link[link_name][fr] = 0.0
-
-			# compute the difference of each route
-			tf = P.get_total_flow() # total flow
-			tc = norm_v * tf # total cost
-			for od in P.get_OD_pairs():
-				for r in xrange(int(P.get_route_set_size(od))):
-					for fr in flow_rates:
-					
-						# sum the links' cost differences
-						sum_diff = 0.0
-						for link_name in P.get_route(od, r).get_links():
-							sum_diff += difference_reward_per_link[link_name][fr]
-						
-						if NORMALISE_COSTS:
-							sum_diff /= P.get_normalisation_factor_routes()
-
-						# compute (and store) the route's difference
-						difference_reward_per_route[od][r][fr] = (tf * sum_diff - tc) / (tf * (tf - 1.0))
+			# All links (and flow rates) are processed at once (see get_difference_rewards).
+			difference_reward_per_route = get_difference_rewards(P, flow_rates, flows_to_remove, norm_v, NORMALISE_COSTS)
+			
+			profiler.lap('difference_rewards')
 			
 		#-------------------------------------------
 		# update strategies
 		
+		# compute the cost of each driver
+		cost = get_cost(P, routes_taken, drivers_flow_rate, difference_rewards, difference_reward_per_route, NORMALISE_COSTS)
+		
 		# compute the tolls first
 		# additionally, compute the revenue (from tolls) to be redistributed among the agents
 		if a_posteriori_MCT or delta_tolling or thesis_delta_tolling:
 			
-			if revenue_division_rate > 0.0:
-				tolls_share_per_OD = [ 0.0 for _ in xrange(len(P.get_OD_pairs())) ]
-
-			for d in D:
-				
-				route = P.get_route(d.get_OD_pair(), d.get_last_action())
-				
-				# compute the cost
-				cost = get_cost(P, d, difference_rewards, difference_reward_per_route, NORMALISE_COSTS)
-
-				# toll-based methods required additional values to compute rewards: 
-				# weighted MCT needs the weighted marginal costs
-				if weighted_MCT:
-					additional_cost = route.get_weighted_marginal_cost(NORMALISE_COSTS)
-				# other methods need the free flow travel time
-				else:
-					additional_cost = route.get_free_flow_travel_time(NORMALISE_COSTS)
-
-				# compute the toll
-				toll = d.compute_toll_dues(cost, a_posteriori_MCT=a_posteriori_MCT, indifferent_MCT=indifferent_MCT, weighted_MCT=weighted_MCT, delta_tolling=delta_tolling, thesis_delta_tolling=thesis_delta_tolling, additional_cost=additional_cost)
+			# toll-based methods required additional values to compute rewards: 
+			# weighted MCT needs the weighted marginal costs
+			if weighted_MCT:
+				additional_cost = P.get_routes_weighted_marginal_costs(NORMALISE_COSTS)[routes_taken]
+				if NORMALISE_COSTS and (additional_cost > 1).any():
+					# raise the normalisation exception of the (first) invalid route
+					P.get_routes_order()[routes_taken[np.flatnonzero(additional_cost > 1)[0]]].get_weighted_marginal_cost(NORMALISE_COSTS)
+			# other methods need the free flow travel time
+			else:
+				additional_cost = P.get_routes_free_flow_travel_times(NORMALISE_COSTS)[routes_taken]
 
-				# update the total revenue 
-				if revenue_division_rate > 0.0:
-					od = P.get_OD_order(d.get_OD_pair())
-					tolls_share_per_OD[od] += toll
+			# compute the tolls
+			tolls = D.compute_toll_dues(cost, a_posteriori_MCT=a_posteriori_MCT, indifferent_MCT=indifferent_MCT, weighted_MCT=weighted_MCT, delta_tolling=delta_tolling, thesis_delta_tolling=thesis_delta_tolling, additional_cost=additional_cost)
 
-			# compute the share to be redistributed with the agents
+			# compute the total revenue and the share to be redistributed with the agents
 			if revenue_division_rate > 0.0:
-				for od in P.get_OD_pairs():
-					tolls_share_per_OD[P.get_OD_order(od)] = (tolls_share_per_OD[P.get_OD_order(od)] * revenue_division_rate) / P.get_OD_flow(od)
+				tolls_share_per_OD = np.zeros(len(P.get_OD_pairs()))
+				np.add.at(tolls_share_per_OD, D.get_drivers_OD(), tolls * D.get_counts())
+				tolls_share_per_OD = (tolls_share_per_OD * revenue_division_rate) / np.array([ P.get_OD_flow(od) for od in P.get_OD_pairs() ])
+			
+			profiler.lap('tolling')
 
 		# update the strategies
-		for d in D:
-			
-			# compute the cost
-			cost = get_cost(P, d, difference_rewards, difference_reward_per_route, NORMALISE_COSTS)
+		if a_posteriori_MCT or delta_tolling or thesis_delta_tolling: 
 			
-			if a_posteriori_MCT or delta_tolling or thesis_delta_tolling: 
-				
-				additional_cost = 0.0
-				if revenue_division_rate > 0.0:
-					additional_cost = tolls_share_per_OD[P.get_OD_order(d.get_OD_pair())]
+			additional_cost = 0.0
+			if revenue_division_rate > 0.0:
+				additional_cost = tolls_share_per_OD[D.get_drivers_OD()]
 
-				d.update_strategy(cost, ALPHA, REGRET_AS_COST, a_posteriori_MCT=a_posteriori_MCT, indifferent_MCT=indifferent_MCT, weighted_MCT=weighted_MCT, delta_tolling=delta_tolling, thesis_delta_tolling=thesis_delta_tolling, additional_cost=additional_cost)
-			else:
-				d.update_strategy(cost, ALPHA, REGRET_AS_COST)
-				
+			D.update_strategy(cost, ALPHA, REGRET_AS_COST, a_posteriori_MCT=a_posteriori_MCT, indifferent_MCT=indifferent_MCT, weighted_MCT=weighted_MCT, delta_tolling=delta_tolling, thesis_delta_tolling=thesis_delta_tolling, additional_cost=additional_cost)
+		else:
+			D.update_strategy(cost, ALPHA, REGRET_AS_COST)
+		
+		profiler.lap('update_strategy')
 		
 		# agents use initial (before trip) recommendations to compute their regret
 		# NOTE: the update is made only after the recommendation because, otherwise, 
@@ -363,18 +516,41 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 		# before the update
 		app.update_info(NORMALISE_COSTS)
 		
+		profiler.lap('navigation_app')
+		
 		if ALPHA > MIN_ALPHA:
 			ALPHA = ALPHA * ALPHA_DECAY
 		else:
 			ALPHA = MIN_ALPHA
 		
+		#-------------------------------------------
+		# check whether the simulation has converged (see stop_criterion)
+		
+		converged = False
+		if stop_criterion == 'assignment':
+			if previous_routes_flow is not None:
+				stop_measures.append(np.abs(routes_flow - previous_routes_flow).max())
+			previous_routes_flow = routes_flow
+			converged = len(stop_measures) == stop_window and max(stop_measures) <= stop_tolerance
+		elif stop_criterion == 'gap':
+			stop_measures.append(get_relative_gap(P, routes_flow, od_first_route))
+			converged = len(stop_measures) == stop_window and max(stop_measures) <= stop_tolerance
+		elif stop_criterion == 'regret':
+			stop_measures.append(np.dot(D.get_estimated_regrets(), D.get_counts()) / P.get_total_flow())
+			converged = len(stop_measures) == stop_window and max(stop_measures) - min(stop_measures) <= stop_tolerance
+		
+		# the last episode (whose statistics are always computed)
+		last = iteration == ITERATIONS-1 or converged
+		
 		#-------------------------------------------
 		# compute the episode statistics
 
 		# update the sum of routes' costs (used to compute the averages)
+		routes_costs = P.get_routes_costs(NORMALISE_COSTS)
+		routes_free_flow_travel_times = P.get_routes_free_flow_travel_times(NORMALISE_COSTS)
 		for od in P.get_OD_pairs():
-			for r in xrange(int(P.get_route_set_size(od))):
-				cc = P.get_route(od, r).get_cost(NORMALISE_COSTS)
+			for r, route in enumerate(P.get_routes_indices(od)):
+				cc = float(routes_costs[route])
 				if a_posteriori_MCT or delta_tolling or thesis_delta_tolling:
 					# NOTE: I do not know exactly why, but regret is not being computed  
 					# properly in the case of delta_tolling. I tried to consider not 2*cc, 
@@ -382,16 +558,61 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 					# the results remain weird. I decided to use the same way as for the
 					# a_posteriori_MCT, to make things simple. Therefore, the real regret
 					# should NOT be reported in its current form.
-					cc = 2*cc - P.get_route(od, r).get_free_flow_travel_time(NORMALISE_COSTS)
+					cc = 2*cc - float(routes_free_flow_travel_times[route])
 				routes_costs_sum[od][r] += cc
-			routes_costs_min[od] = min(routes_costs_sum[od]) / (iteration + 1)
+		
+		# the remaining statistics are computed only on the episodes sampled
+		# (see stats_every), as the real regret is not used by the drivers
+		sampled = iteration % stats_every == 0 or last
 		
 		# compute the agents' real regret
-		for d in D:
-			d.update_real_regret(routes_costs_min[d.get_OD_pair()])
+		if sampled:
+			for od in P.get_OD_pairs():
+				routes_costs_min[od] = min(routes_costs_sum[od]) / (iteration + 1)
+			D.update_real_regret(np.array([ routes_costs_min[od] for od in P.get_OD_pairs() ])[D.get_drivers_OD()])
+		
+		profiler.lap('regrets')
 
-		if stat_all or iteration == ITERATIONS-1:
+		if (stat_all and sampled) or last:
 			gen_real, gen_estimated, gen_diff, gen_relative_diff, sum_regrets = stats.print_statistics_episode(iteration, v, sum_regrets)
+			profiler.lap('statistics_episode')
+		
+		if last:
+			break
+		
+		# write a checkpoint, if desired (the variables of the simulation 
+		# are those required by the next episode)
+		if checkpoint_every > 0 and (iteration + 1) % checkpoint_every == 0:
+			_, random_keys, random_pos, random_has_gauss, random_cached_gaussian = random_state.get_state()
+			state = {
+				'parameters': np.array(checkpoint_parameters),
+				'iteration': np.array(iteration + 1),
+				'alpha': np.array(ALPHA),
+				'epsilon': np.array(EPSILON),
+				'best': np.array(best),
+				'random_keys': random_keys,
+				'random_pos': np.array(random_pos),
+				'random_has_gauss': np.array(random_has_gauss),
+				'random_cached_gaussian': np.array(random_cached_gaussian),
+				'routes_costs_sum': np.array([ c for od in P.get_OD_pairs() for c in routes_costs_sum[od] ]),
+				'sum_regrets': np.array([ sum_regrets[od] for od in P.get_OD_pairs() ]),
+				'routes_flow': routes_flow,
+				'routes_time_flexibility': routes_time_flexibility,
+				'stop_measures': np.array(list(stop_measures))
+			}
+			for prefix, values in [('drivers_', D.get_state()), ('app_', app.get_state()), ('stats_', stats.get_state())]:
+				for name, value in values.items():
+					state[prefix + name] = value
+			save_checkpoint(checkpoint_file, state)
+			profiler.lap('checkpoint')
+	
+	episodes = iteration + 1
+	
+	# write the remaining statistics of the episodes
+	stats.close()
+	
+	if episodes < ITERATIONS:
+		print '\nConverged (%s criterion) after %d episodes' % (stop_criterion, episodes)
 	
 	# keep the dynamic plot visible in the end of simulation
 	if dynamic_plot_results:
@@ -400,11 +621,16 @@ def run_simulation(P, iterations=1000, alpha=0.5, epsilon=1.0, alpha_decay=0.99,
 	# print (and compute) the statistics
 	if stat_all:
 
-		stats.print_statistics(S, v, best, sum_regrets, routes_costs_sum)
+		S = get_assignment(P, D, routes_taken)[0]
+		stats.print_statistics(S, v, best, sum_regrets, routes_costs_sum, episodes)
 		
 		if plot_results:
 			plotter.plot()
 			plotter_regret.plot()
+		
+		profiler.lap('statistics')
 
-	return v, gen_real, gen_estimated
+	# return the average travel time, the average (real and estimated) regrets 
+	# of the last episode and the number of episodes run (see stop_criterion)
+	return v, gen_real, gen_estimated, episodes
 